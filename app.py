@@ -1,13 +1,21 @@
-from fastapi import FastAPI, Request, BackgroundTasks, HTTPException # Импортируем HTTPException
+from fastapi import FastAPI, Request, HTTPException, Query, Header # Импортируем HTTPException
 from fastapi.templating import Jinja2Templates
 from fastapi.staticfiles import StaticFiles
 # Импортируем AsyncSession для тайп-хинтинга в middleware и эндпоинтах
 from sqlalchemy.ext.asyncio import AsyncSession
 # Импортируем все модели и фабрику асинхронных сессий
-from models import Base, engine, AsyncSessionLocal, check_db_connection
-from starlette.responses import HTMLResponse
+from models import engine, AsyncSessionLocal, check_db_connection, SYNC_JOB_SERVICEDESK, SYNC_JOB_FTP
+from migrations import run_migrations
+from starlette.responses import HTMLResponse, Response
 import os
-from services import ServiceDeskService
+from services import ServiceDeskService, limiter
+import sync_partitions
+import sync_events
+from repositories import SyncEventRepository, SyncJobRepository, SyncRunRepository
+import metrics
+import profiling
+import asyncio
+import secrets
 import logging
 # Импортируем SQLAlchemyError для обработки ошибок
 from sqlalchemy.exc import SQLAlchemyError
@@ -24,10 +32,14 @@ from schemas import (
     ServerSearchResult,
     WorkstationSearchResult,
     FiscalRegisterSearchResult,
-    SearchResultResponse
+    SearchResultResponse,
+    SyncEventsResponse,
+    SyncJobResponse,
+    SyncRunResponse,
+    SyncRunListResponse
 )
 
-setup_logger(console_logging=True)
+setup_logger(console_logging=True, log_name="app")
 # Получаем логгер, настроенный в другом месте
 logger = logging.getLogger("ServiceDeskLogger")
 
@@ -51,15 +63,20 @@ async def lifespan(app: FastAPI):
         raise # Пробрасываем исключение, чтобы Uvicorn его увидел
     
     try:
-        async with engine.begin() as conn:
-             # run_sync позволяет выполнять синхронные операции с асинхронным движком
-             await conn.run_sync(Base.metadata.create_all)
-        logger.info("Проверка и создание таблиц БД завершены в lifespan.")
+        # Миграции схемы (таблицы, новые колонки, индексы), см. migrations.py
+        await run_migrations(engine)
+        logger.info("Миграции схемы БД применены в lifespan.")
     except Exception as e:
         logger.critical(f"Критическая ошибка при инициализации или создании таблиц БД в lifespan: {e}", exc_info=True)
         # Генерируем исключение, чтобы Uvicorn не запускал приложение
         raise
 
+    # Обновления по запросу оператора расходуют общий с воркерами бюджет запросов к SD
+    try:
+        await sync_partitions.attach_rate_budget(limiter, AsyncSessionLocal)
+    except Exception as e:
+        logger.error(f"Не удалось подключить общий бюджет запросов к SD, действует только лимит процесса: {e}", exc_info=True)
+
     # --- После yield приложение начинает принимать запросы ---
     yield
 
@@ -179,7 +196,11 @@ async def search_entities(
 
     try:
         # Вызываем метод поиска из сервиса
-        results = await service.search_entities(db, search_term, show_inactive)
+        # При PROFILE_SEARCH=1 медленные запросы профилируются (только задача этого запроса)
+        with metrics.SEARCH_REQUEST_SECONDS.time(), profiling.profiled(
+            "search", profiling.PROFILE_SEARCH, task_only=True, min_seconds=profiling.PROFILE_SEARCH_MIN_SECONDS
+        ):
+            results = await service.search_entities(db, search_term, show_inactive)
         logger.info(f"Поиск завершен. Найдено: Компаний={len(results.companies)}, Серверов={len(results.servers)}, Рабочих станций={len(results.workstations)}, ФР={len(results.fiscal_registers)}")
         return results
     except SQLAlchemyError as e:
@@ -190,25 +211,176 @@ async def search_entities(
         raise HTTPException(status_code=500, detail="Произошла ошибка при поиске")
 
 
-# Эндпоинт для запуска синхронизации данных из SD в фоновом режиме
-@app.post("/sync/servicedesk")
-async def sync_servicedesk_data(request: Request, background_tasks: BackgroundTasks):
+# Обновление одной сущности из SD по запросу оператора
+@app.post("/api/refresh/{uuid}", response_model=SearchResultResponse)
+async def refresh_entity(request: Request, uuid: str):
     """
-    Запускает полную инкрементальную синхронизацию данных из ServiceDesk
-    в фоновой задаче.
+    Получает сущность из ServiceDesk (вместе с отсутствующими в БД компаниями-владельцами),
+    сохраняет ее и возвращает в формате результатов поиска. Запросы к SD берут токены
+    общего бюджета из резерва, который воркеры синхронизации не расходуют (SD_PRIORITY_RESERVE).
     """
     service = ServiceDeskService()
-    background_tasks.add_task(service.sync_all_data, AsyncSessionLocal)
-    logger.info("Запрос на синхронизацию данных из ServiceDesk получен. Фоновая задача запущена.")
-    return {"message": "Синхронизация данных из ServiceDesk запущена в фоновом режиме"}
+    uuid = uuid.strip()
+    logger.info(f"Запрошено обновление сущности {uuid} из ServiceDesk.")
+    meta_class = await service.refresh_entity(AsyncSessionLocal, uuid)
+    if meta_class is None:
+        raise HTTPException(status_code=502, detail="Не удалось получить или сохранить сущность из ServiceDesk")
+    try:
+        result = await service.get_search_result(get_db(request), meta_class, uuid)
+    except SQLAlchemyError as e:
+        logger.error(f"Ошибка БД при чтении обновленной сущности {uuid}: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail="Ошибка при чтении сущности из базы данных")
+    if result is None:
+        raise HTTPException(status_code=404, detail="Сущность не найдена в базе данных после обновления")
+    return result
 
-# Эндпоинт для запуска синхронизации данных с FTP в фоновом режиме (заглушка)
-@app.post("/sync/ftp")
-async def sync_ftp_data(request: Request, background_tasks: BackgroundTasks):
+
+async def enqueue_sync_job(request: Request, job_type: str) -> SyncJobResponse:
     """
-    Заглушка: Запускает синхронизацию данных с FTP в фоновой задаче.
+    Добавляет задание синхронизации в очередь sync_jobs.
+    Сама синхронизация выполняется отдельным процессом sync_runner.py --serve,
+    поэтому не нагружает веб-воркер и не прерывается при перезапуске API.
     """
-    service = ServiceDeskService()
-    background_tasks.add_task(service.sync_ftp_data, AsyncSessionLocal)
-    logger.info("Запрос на синхронизацию данных с FTP получен. Фоновая задача запущена (заглушка).")
-    return {"message": "Синхронизация данных с FTP запущена в фоновом режиме (заглушка)"}
+    db: AsyncSession = get_db(request)
+    job = await SyncJobRepository(db).enqueue(job_type)
+    if job is None:
+        await db.rollback()
+        raise HTTPException(status_code=500, detail="Не удалось поставить синхронизацию в очередь")
+    try:
+        await db.commit()
+    except SQLAlchemyError as e:
+        logger.error(f"Ошибка БД при сохранении задания синхронизации {job_type}: {e}", exc_info=True)
+        await db.rollback()
+        raise HTTPException(status_code=500, detail="Не удалось поставить синхронизацию в очередь")
+    logger.info(f"Задание синхронизации {job_type} поставлено в очередь: {job.id}")
+    return SyncJobResponse.model_validate(job)
+
+
+# Эндпоинт для запуска синхронизации данных из SD
+@app.post("/sync/servicedesk", response_model=SyncJobResponse, status_code=202)
+async def sync_servicedesk_data(request: Request):
+    """
+    Ставит в очередь полную инкрементальную синхронизацию данных из ServiceDesk.
+    Возвращает задание, статус которого можно проверить через GET /sync/jobs/{job_id}.
+    """
+    return await enqueue_sync_job(request, SYNC_JOB_SERVICEDESK)
+
+# Эндпоинт для запуска синхронизации данных с FTP (заглушка)
+@app.post("/sync/ftp", response_model=SyncJobResponse, status_code=202)
+async def sync_ftp_data(request: Request):
+    """
+    Заглушка: Ставит в очередь синхронизацию данных с FTP.
+    """
+    return await enqueue_sync_job(request, SYNC_JOB_FTP)
+
+# Уведомления SD об изменении сущностей (вебхук)
+@app.post("/sync/events", response_model=SyncEventsResponse, status_code=202)
+async def receive_sync_events(request: Request, x_events_token: Optional[str] = Header(None)):
+    """
+    Принимает пачку уведомлений [{"UUID", "metaClass"}] и ставит сущности в очередь sync_events.
+    Обрабатывает их воркер sync_runner.py --events (см. sync_events). Требует заголовок X-Events-Token.
+    """
+    if not sync_events.SYNC_EVENTS_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not x_events_token or not secrets.compare_digest(x_events_token, sync_events.SYNC_EVENTS_TOKEN):
+        raise HTTPException(status_code=403, detail="Неверный токен уведомлений")
+    try:
+        payload = await request.json()
+        events, ignored = sync_events.parse_events(payload)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=f"Неверный формат уведомлений: {e}")
+    if sync_events.SYNC_EVENTS_RECORD:
+        try:
+            await asyncio.to_thread(sync_events.record_events, payload)
+        except OSError as e:
+            logger.error(f"Не удалось записать уведомления SD в {sync_events.SYNC_EVENTS_RECORD}: {e}")
+
+    db: AsyncSession = get_db(request)
+    accepted = await SyncEventRepository(db).add(events)
+    if accepted is None:
+        await db.rollback()
+        raise HTTPException(status_code=500, detail="Не удалось сохранить уведомления")
+    try:
+        await db.commit()
+    except SQLAlchemyError as e:
+        logger.error(f"Ошибка БД при сохранении {len(events)} уведомлений SD: {e}", exc_info=True)
+        await db.rollback()
+        raise HTTPException(status_code=500, detail="Не удалось сохранить уведомления")
+    logger.debug(f"Получено уведомлений SD: {accepted} принято, {ignored} пропущено.")
+    return SyncEventsResponse(accepted=accepted, ignored=ignored)
+
+# Статус задания синхронизации
+@app.get("/sync/jobs/{job_id}", response_model=SyncJobResponse)
+async def get_sync_job(request: Request, job_id: int):
+    """Возвращает состояние задания синхронизации."""
+    job = await SyncJobRepository(get_db(request)).get_by_id(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Задание синхронизации не найдено")
+    return SyncJobResponse.model_validate(job)
+
+# Отчеты о запусках синхронизации, начиная с последнего
+@app.get("/sync/runs", response_model=SyncRunListResponse)
+async def list_sync_runs(
+    request: Request,
+    limit: int = Query(20, ge=1, le=200),
+    offset: int = Query(0, ge=0)
+):
+    """Постранично возвращает отчеты sync_runs: счетчики, запросы к SD, время этапов, самые долгие сущности."""
+    repo = SyncRunRepository(get_db(request))
+    runs = await repo.list(limit=limit, offset=offset)
+    total = await repo.count()
+    return SyncRunListResponse(
+        total=total,
+        limit=limit,
+        offset=offset,
+        items=[SyncRunResponse.model_validate(run) for run in runs]
+    )
+
+# Метрики процесса API в формате Prometheus
+@app.get("/metrics")
+async def metrics_endpoint():
+    """
+    Отдает метрики поиска и (если синхронизация выполнялась в этом процессе) синхронизации.
+    Метрики воркера синхронизации отдает сам воркер на SYNC_WORKER_METRICS_PORT.
+    """
+    return Response(content=metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+# Токен для служебных эндпоинтов /admin/*. Если не задан, эндпоинты отключены.
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+# Одновременно снимается только один профиль процесса
+_admin_profile_lock = asyncio.Lock()
+
+def check_admin_token(token: Optional[str]):
+    """Проверяет заголовок X-Admin-Token. Без ADMIN_TOKEN служебные эндпоинты недоступны."""
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not token or not secrets.compare_digest(token, ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail="Неверный токен администратора")
+
+# Профиль работающего процесса API
+@app.post("/admin/profile")
+async def admin_profile(
+    seconds: float = Query(10, ge=1, le=300),
+    x_admin_token: Optional[str] = Header(None)
+):
+    """
+    Семплирует event loop процесса API в течение seconds секунд и возвращает стеки
+    в формате folded (flamegraph.pl, speedscope). Требует заголовок X-Admin-Token.
+    """
+    check_admin_token(x_admin_token)
+    if _admin_profile_lock.locked():
+        raise HTTPException(status_code=409, detail="Профиль уже снимается")
+    async with _admin_profile_lock:
+        logger.info(f"Снятие профиля процесса API на {seconds}с по запросу администратора.")
+        profiler = profiling.SamplingProfiler()
+        profiler.start()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            profiler.stop()
+    filename = f"api_profile_{datetime.datetime.now():%Y%m%d-%H%M%S}.folded"
+    return Response(
+        content=profiler.folded(),
+        media_type="text/plain; charset=utf-8",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
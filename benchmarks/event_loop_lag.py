@@ -0,0 +1,96 @@
+"""
+Бенчмарк задержки event loop при разборе и валидации данных SD.
+
+Имитирует этап оборудования: разбор большого JSON-ответа find и валидацию всех записей.
+Параллельно работает "тикер", который просыпается каждые --tick мс и измеряет, насколько
+позже он был разбужен. Именно такую задержку получают HTTP-запросы к SD, запросы к БД
+и обработчики FastAPI, пока синхронизация занимает event loop.
+
+Запуск: python -m benchmarks.event_loop_lag [--records 50000] [--pool-size 4]
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import statistics
+import time
+
+import sync_offload
+from data_validator import clearify_server_data
+from benchmarks.synthetic import generate_device_records
+
+META_CLASS = 'objectBase$Server'
+
+
+async def ticker(interval: float, lags: list, stop: asyncio.Event):
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        expected = loop.time() + interval
+        await asyncio.sleep(interval)
+        lags.append(max(0.0, loop.time() - expected))
+
+
+async def inline_stage(content: bytes):
+    records = json.loads(content)
+    return [clearify_server_data(record) for record in records]
+
+
+async def offloaded_stage(content: bytes):
+    records = await sync_offload.parse_json(content)
+    return await sync_offload.validate_records(META_CLASS, records)
+
+
+async def measure(stage, content: bytes, interval: float):
+    lags = []
+    stop = asyncio.Event()
+    tick_task = asyncio.create_task(ticker(interval, lags, stop))
+    await asyncio.sleep(interval * 2) # Даем тикеру запуститься
+    started = time.perf_counter()
+    await stage(content)
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await tick_task
+    return elapsed, lags
+
+
+def report(name: str, elapsed: float, lags: list):
+    lags_ms = sorted(lag * 1000 for lag in lags) or [0.0]
+    p99 = lags_ms[min(len(lags_ms) - 1, int(len(lags_ms) * 0.99))]
+    print(f"{name:<10} время этапа {elapsed:.2f}с, лаг event loop: "
+          f"макс {lags_ms[-1]:.1f}мс, p99 {p99:.1f}мс, среднее {statistics.mean(lags_ms):.2f}мс, тиков {len(lags)}")
+
+
+async def main(records: int, pool_size: int, interval: float):
+    content = json.dumps(generate_device_records(META_CLASS, records), ensure_ascii=False).encode('utf-8')
+    print(f"{records} записей {META_CLASS}, JSON {len(content) / 1024 / 1024:.1f} МБ")
+
+    elapsed, lags = await measure(inline_stage, content, interval)
+    report("в loop", elapsed, lags)
+
+    sync_offload.SYNC_PROCESS_POOL_SIZE = pool_size
+    sync_offload.SYNC_OFFLOAD_MIN_BYTES = 0
+    # Прогреваем пул: запуск процессов не относится к стоимости этапа
+    await sync_offload.validate_records(META_CLASS, generate_device_records(META_CLASS, pool_size))
+    try:
+        elapsed, lags = await measure(offloaded_stage, content, interval)
+        report(f"пул x{pool_size}", elapsed, lags)
+    finally:
+        sync_offload.shutdown_process_pool()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Задержка event loop при разборе и валидации данных SD")
+    parser.add_argument("--records", type=int, default=50_000, help="Количество записей в ответе SD")
+    parser.add_argument("--pool-size", type=int, default=4, help="Размер пула процессов")
+    parser.add_argument("--tick", type=float, default=5.0, help="Интервал тикера, мс")
+    args = parser.parse_args()
+
+    service_logger = logging.getLogger("ServiceDeskLogger")
+    service_logger.setLevel(logging.INFO)
+    service_logger.addHandler(logging.NullHandler())
+    service_logger.propagate = False
+    # Предупреждения валидаторов в процессах пула не нужны в выводе бенчмарка
+    os.environ.setdefault("SYNC_WORKER_LOG_LEVEL", "ERROR")
+
+    asyncio.run(main(args.records, args.pool_size, args.tick / 1000))
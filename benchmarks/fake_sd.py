@@ -0,0 +1,230 @@
+"""
+Локальная замена REST API ServiceDesk для нагрузочных прогонов синхронизации.
+
+ASGI-приложение отвечает на те же запросы, что делает ServiceDeskService:
+    POST /services/rest/find/{metaClass}                  - список (fetch_entity_list)
+    POST /services/rest/find/{metaClass}/{"UUID": [...]}  - пачка деталей (fetch_entity_details_batch)
+    POST /services/rest/find/{metaClass}/{"owner": [...]} - фильтр по ссылке (выборочная синхронизация)
+    GET  /services/rest/get/{uuid}                        - детали сущности и контракта
+Атрибуты ответа ограничиваются параметром attrs, как в SD.
+
+Служебные эндпоинты для бенчмарка:
+    GET  /__stats             - счетчики запросов по типам
+    POST /__stats/reset       - обнуление счетчиков
+    POST /__mutate?rate=0.05  - "изменить" долю сущностей (новый lastModifiedDate, у половины - и данные),
+                                в ответе - уведомления об изменениях для POST /sync/events
+
+Запуск: python -m benchmarks.fake_sd --companies 2000 --depth 3 --devices 5 --port 8765
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import random
+from collections import Counter
+from typing import Dict, Any, List, Optional
+
+from fastapi import FastAPI
+from fastapi.responses import JSONResponse, Response
+
+from benchmarks.synthetic import (
+    RECORD_FACTORIES, format_sd_date, sd_company_record
+)
+
+COMPANY_META_CLASS = 'ou$company'
+AGREEMENT_META_CLASS = 'agreement$agreement'
+DEVICE_META_CLASSES = list(RECORD_FACTORIES)
+
+# Поле, которое меняется у "реально измененных" сущностей (попадает в очищенные данные)
+MUTABLE_FIELDS = {
+    COMPANY_META_CLASS: 'title',
+    'objectBase$Server': 'DeviceName',
+    'objectBase$Workstation': 'DeviceName',
+    'objectBase$FR': 'LegalName',
+}
+
+
+class FakeServiceDesk:
+    """Набор синтетических сущностей SD и счетчики обращений к ним."""
+
+    def __init__(
+        self,
+        companies: int = 1000,
+        depth: int = 3,
+        devices_per_company: int = 5,
+        active_share: float = 0.8,
+        latency: float = 0.0,
+        throttle_rate: float = 0.0,
+        seed: int = 42
+    ):
+        self.rng = random.Random(seed)
+        self.latency = latency
+        self.throttle_rate = throttle_rate
+        self.stats: Counter = Counter()
+        self.records: Dict[str, Dict[str, Dict[str, Any]]] = {mc: {} for mc in [COMPANY_META_CLASS, *DEVICE_META_CLASSES]}
+        self.by_uuid: Dict[str, Dict[str, Any]] = {}
+        self._generate(companies, max(1, depth), devices_per_company, active_share)
+
+    def _generate(self, companies: int, depth: int, devices_per_company: int, active_share: float):
+        # Компании раскладываются по уровням иерархии: родитель берется с предыдущего уровня
+        levels: List[List[str]] = [[] for _ in range(depth)]
+        for number in range(companies):
+            level = min(depth - 1, number * depth // max(companies, 1))
+            parent_uuid = self.rng.choice(levels[level - 1]) if level > 0 and levels[level - 1] else None
+            record = sd_company_record(self.rng, number, parent_uuid)
+            levels[level].append(record['UUID'])
+            self._add(COMPANY_META_CLASS, record)
+            for agreement in record['recipientAgreements']:
+                state = 'active' if self.rng.random() < active_share else 'closed'
+                self.by_uuid[agreement['UUID']] = {'UUID': agreement['UUID'], 'state': state, 'metaClass': AGREEMENT_META_CLASS}
+
+        # Оборудование: у всех объектов SD общий префикс objectBase, номера не пересекаются
+        number = 1_000_000
+        company_uuids = list(self.records[COMPANY_META_CLASS])
+        for meta_class in DEVICE_META_CLASSES:
+            factory = RECORD_FACTORIES[meta_class]
+            for owner_uuid in company_uuids:
+                for _ in range(devices_per_company):
+                    self._add(meta_class, factory(self.rng, number, owner_uuid))
+                    number += 1
+
+    def _add(self, meta_class: str, record: Dict[str, Any]):
+        record['metaClass'] = meta_class # SD возвращает его, если он есть в attrs
+        self.records[meta_class][record['UUID']] = record
+        self.by_uuid[record['UUID']] = record
+
+    def entity_count(self) -> int:
+        return sum(len(records) for records in self.records.values())
+
+    def mutate(self, rate: float) -> List[Dict[str, str]]:
+        """
+        Меняет lastModifiedDate у доли rate всех сущностей. У половины из них меняется и поле,
+        которое хранится в БД, остальные проверяют путь "изменилась только дата".
+        Возвращает уведомления об измененных сущностях [{"UUID", "metaClass"}].
+        """
+        now = format_sd_date(datetime.datetime.now().replace(microsecond=0))
+        changed = []
+        for meta_class, records in self.records.items():
+            count = int(len(records) * rate)
+            for uuid in self.rng.sample(list(records), count):
+                record = records[uuid]
+                record['lastModifiedDate'] = now
+                if self.rng.random() < 0.5:
+                    record[MUTABLE_FIELDS[meta_class]] = f"{record.get(MUTABLE_FIELDS[meta_class]) or ''} *"
+                changed.append({'UUID': uuid, 'metaClass': meta_class})
+        return changed
+
+    @staticmethod
+    def project(record: Dict[str, Any], attrs: Optional[str]) -> Dict[str, Any]:
+        """Оставляет в записи только запрошенные атрибуты (UUID возвращается всегда)."""
+        if not attrs:
+            return record
+        wanted = set(attrs.split(','))
+        wanted.add('UUID')
+        return {key: value for key, value in record.items() if key in wanted}
+
+    @staticmethod
+    def matches(record: Dict[str, Any], search: Dict[str, Any]) -> bool:
+        """Фильтр find: значение-список означает "любое из", ссылка сравнивается по UUID."""
+        for key, expected in search.items():
+            value = record.get(key)
+            if isinstance(value, dict):
+                value = value.get('UUID')
+            if value not in (expected if isinstance(expected, list) else [expected]):
+                return False
+        return True
+
+    async def before_request(self, kind: str) -> Optional[Response]:
+        """Имитирует задержку и ограничение частоты SD. Возвращает ответ 429 или None."""
+        self.stats[kind] += 1
+        if self.latency:
+            await asyncio.sleep(self.rng.uniform(self.latency * 0.5, self.latency * 1.5))
+        if self.throttle_rate and self.rng.random() < self.throttle_rate:
+            self.stats['throttled'] += 1
+            return Response(status_code=429, headers={'Retry-After': '1'})
+        return None
+
+
+def create_app(fake: FakeServiceDesk) -> FastAPI:
+    app = FastAPI()
+
+    @app.post("/services/rest/find/{meta_class}")
+    async def find(meta_class: str, attrs: Optional[str] = None):
+        throttled = await fake.before_request('find_list')
+        if throttled:
+            return throttled
+        records = fake.records.get(meta_class, {})
+        return JSONResponse([fake.project(record, attrs) for record in records.values()])
+
+    @app.post("/services/rest/find/{meta_class}/{search}")
+    async def find_by_search(meta_class: str, search: str, attrs: Optional[str] = None):
+        try:
+            search_attrs = json.loads(search)
+            uuids = search_attrs.get('UUID') or []
+        except (ValueError, AttributeError):
+            return JSONResponse({'error': 'bad search attrs'}, status_code=400)
+        throttled = await fake.before_request('find_uuids' if list(search_attrs) == ['UUID'] else 'find_search')
+        if throttled:
+            return throttled
+        records = fake.records.get(meta_class, {})
+        if list(search_attrs) == ['UUID']:
+            return JSONResponse([fake.project(records[uuid], attrs) for uuid in uuids if uuid in records])
+        return JSONResponse([fake.project(record, attrs) for record in records.values() if fake.matches(record, search_attrs)])
+
+    @app.get("/services/rest/get/{uuid}")
+    async def get(uuid: str, attrs: Optional[str] = None):
+        record = fake.by_uuid.get(uuid)
+        kind = 'get_agreement' if record and record.get('metaClass') == AGREEMENT_META_CLASS else 'get'
+        throttled = await fake.before_request(kind)
+        if throttled:
+            return throttled
+        if record is None:
+            return JSONResponse({'error': 'not found'}, status_code=404)
+        return JSONResponse(fake.project(record, attrs))
+
+    @app.get("/__stats")
+    async def stats():
+        return {'entities': fake.entity_count(), 'requests': dict(fake.stats)}
+
+    @app.post("/__stats/reset")
+    async def reset_stats():
+        fake.stats.clear()
+        return {'ok': True}
+
+    @app.post("/__mutate")
+    async def mutate(rate: float = 0.05):
+        events = fake.mutate(rate)
+        return {'changed': len(events), 'events': events}
+
+    return app
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Локальная замена REST API ServiceDesk")
+    parser.add_argument("--companies", type=int, default=1000, help="Количество компаний")
+    parser.add_argument("--depth", type=int, default=3, help="Глубина иерархии компаний")
+    parser.add_argument("--devices", type=int, default=5, help="Устройств каждого типа на компанию")
+    parser.add_argument("--active-share", type=float, default=0.8, help="Доля активных контрактов")
+    parser.add_argument("--latency", type=float, default=0.0, help="Средняя задержка ответа, сек")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="Доля запросов, получающих 429")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    return parser
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    args = build_parser().parse_args()
+    fake_sd = FakeServiceDesk(
+        companies=args.companies,
+        depth=args.depth,
+        devices_per_company=args.devices,
+        active_share=args.active_share,
+        latency=args.latency,
+        throttle_rate=args.throttle_rate,
+        seed=args.seed
+    )
+    print(f"Сгенерировано {fake_sd.entity_count()} сущностей SD, слушаем http://{args.host}:{args.port}", flush=True)
+    uvicorn.run(create_app(fake_sd), host=args.host, port=args.port, log_level="warning")
@@ -0,0 +1,140 @@
+"""
+Память под списки SD и снимок дат из БД на время синхронизации.
+
+Сравнивает два представления для --entities сущностей (компании и оборудование трех типов):
+    dicts   - как раньше: разобранный JSON списков целиком и словарь {uuid: datetime};
+    records - sync_records.ListRecord (UUID интернированы, даты - секунды от эпохи),
+              JSON каждого списка освобождается сразу после преобразования.
+Каждый вариант выполняется в отдельном процессе: пиковый RSS (включая момент разбора
+JSON) и RSS после загрузки не смешиваются между вариантами. Результат пересчитывается
+на 100 000 сущностей. Списки строятся генератором benchmarks.synthetic с атрибутами,
+которые синхронизация запрашивает у SD (list_attrs).
+
+Запуск:
+    python -m benchmarks.list_memory [--entities 100000] [--devices 5]
+"""
+import argparse
+import datetime
+import gc
+import json
+import os
+import random
+import subprocess
+import sys
+from typing import Dict, List
+
+from benchmarks.sync_e2e import RssSampler
+
+LIST_ATTRS = {
+    'ou$company': "UUID,lastModifiedDate,title,parent",
+    'objectBase$Server': "UUID,lastModifiedDate,owner,DeviceName",
+    'objectBase$Workstation': "UUID,lastModifiedDate,owner,DeviceName",
+    'objectBase$FR': "UUID,lastModifiedDate,owner,RNKKT",
+}
+
+
+def build_payloads(entities: int, devices: int, seed_value: int) -> Dict[str, bytes]:
+    """JSON-ответы find/{metaClass} для каждого метакласса, как их возвращает SD."""
+    from benchmarks.synthetic import RECORD_FACTORIES, sd_company_record
+
+    rng = random.Random(seed_value)
+    companies = max(1, entities // (1 + devices * len(RECORD_FACTORIES)))
+    lists = {meta_class: [] for meta_class in LIST_ATTRS}
+    company_uuids = []
+    for number in range(companies):
+        parent = rng.choice(company_uuids) if company_uuids and rng.random() < 0.7 else None
+        record = sd_company_record(rng, number, parent)
+        company_uuids.append(record['UUID'])
+        lists['ou$company'].append(record)
+    number = 1_000_000
+    for meta_class, factory in RECORD_FACTORIES.items():
+        for owner_uuid in company_uuids:
+            for _ in range(devices):
+                lists[meta_class].append(factory(rng, number, owner_uuid))
+                number += 1
+
+    payloads = {}
+    for meta_class, records in lists.items():
+        wanted = set(LIST_ATTRS[meta_class].split(','))
+        payloads[meta_class] = json.dumps(
+            [{key: value for key, value in record.items() if key in wanted} for record in records],
+            ensure_ascii=False
+        ).encode()
+    return payloads
+
+
+def db_snapshot_rows(payloads: Dict[str, bytes]) -> Dict[str, List[tuple]]:
+    """Строки (uuid, last_modified_date, content_hash), как их возвращает select из БД."""
+    from data_validator import parse_sd_datetime
+
+    rows = {}
+    for meta_class, payload in payloads.items():
+        rows[meta_class] = [
+            (item['UUID'], parse_sd_datetime(item['lastModifiedDate']) - datetime.timedelta(days=1), '0' * 64)
+            for item in json.loads(payload)
+        ]
+    return rows
+
+
+def load(mode: str, payloads: Dict[str, bytes], rows: Dict[str, List[tuple]]):
+    """Держит в памяти то же, что sync_data_incrementally после этапов db_snapshot и list_fetch."""
+    from sync_records import compact_list, to_epoch
+
+    lists, dates, hashes = {}, {}, {}
+    for meta_class, payload in payloads.items():
+        if mode == 'dicts':
+            dates[meta_class] = {uuid: date for uuid, date, _ in rows[meta_class]}
+            lists[meta_class] = json.loads(payload)
+        else:
+            dates[meta_class] = {sys.intern(uuid): to_epoch(date) for uuid, date, _ in rows[meta_class]}
+            lists[meta_class] = compact_list(meta_class, json.loads(payload))
+        hashes[meta_class] = {uuid: content_hash for uuid, _, content_hash in rows[meta_class]}
+    return lists, dates, hashes
+
+
+def run_mode(args) -> Dict[str, float]:
+    os.environ.setdefault('BASE_URL', 'http://localhost')
+    os.environ.setdefault('SDKEY', 'benchmark')
+    payloads = build_payloads(args.entities, args.devices, args.seed)
+    # Строки снимка БД - отдельные объекты, как у драйвера; в замер не входят
+    rows = db_snapshot_rows(payloads)
+    entities = sum(len(r) for r in rows.values())
+    gc.collect()
+    sampler = RssSampler(interval=0.005)
+    baseline = sampler.current_rss()
+    with sampler:
+        state = load(args.mode, payloads, rows)
+        gc.collect()
+        retained = sampler.current_rss()
+    del state
+    return {'entities': entities, 'peak': sampler.peak - baseline, 'retained': retained - baseline}
+
+
+def main(args):
+    print(f"{'вариант':<10} {'сущностей':>10} {'пик, МБ/100k':>14} {'после загрузки, МБ/100k':>24}")
+    results = {}
+    for mode in ('dicts', 'records'):
+        command = [sys.executable, '-m', 'benchmarks.list_memory', '--mode', mode,
+                   '--entities', str(args.entities), '--devices', str(args.devices), '--seed', str(args.seed)]
+        output = subprocess.run(command, check=True, capture_output=True, text=True).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        scale = 100_000 / result['entities']
+        results[mode] = result
+        print(f"{mode:<10} {result['entities']:>10} {result['peak'] * scale / 1024 / 1024:>14.1f} "
+              f"{result['retained'] * scale / 1024 / 1024:>24.1f}")
+    if results['dicts']['retained']:
+        saved = 1 - results['records']['retained'] / results['dicts']['retained']
+        print(f"\nПосле загрузки памяти меньше на {saved:.0%}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Память под списки SD и снимок дат БД: словари против ListRecord")
+    parser.add_argument("--entities", type=int, default=100_000, help="Примерное число сущностей всех метаклассов")
+    parser.add_argument("--devices", type=int, default=5, help="Устройств каждого типа на компанию")
+    parser.add_argument("--seed", type=int, default=42, help="Зерно генератора")
+    parser.add_argument("--mode", choices=["dicts", "records"], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.mode:
+        print(json.dumps(run_mode(args)))
+    else:
+        main(args)
@@ -0,0 +1,111 @@
+"""
+Бенчмарк стоимости логгирования для event loop.
+
+Замеряет, сколько времени вызывающий код (корутина синхронизации) тратит на 10 000 вызовов
+logger.debug с типичной строкой "на сущность", при разных настройках:
+    - старая схема: синхронный FileHandler на корневом логгере (запись на диск в event loop);
+    - log.setup_logger: QueueHandler, форматирование и запись в фоновом потоке;
+    - log.setup_logger с LOG_LEVEL=INFO: DEBUG-записи отбрасываются на логгере;
+    - log.setup_logger с LOG_FORMAT=json.
+Для очереди отдельно показывается время, за которое фоновый поток дописал все записи.
+--flush-delay-ms имитирует медленный диск (сетевой том, занятый диск): каждый flush файла
+дополнительно ждет указанное время, как ждал бы системный вызов записи.
+
+Запуск: python -m benchmarks.logging_overhead [--calls 10000] [--repeat 5] [--flush-delay-ms 0.05]
+"""
+import argparse
+import asyncio
+import logging
+import os
+import tempfile
+import time
+
+import log
+
+CALLS_PER_REPORT = 10_000
+
+
+def legacy_setup(log_dir: str):
+    """Схема до перехода на очередь: FileHandler уровня DEBUG прямо на корневом логгере."""
+    handler = logging.FileHandler(os.path.join(log_dir, "legacy.log"), encoding='utf-8')
+    handler.setLevel(logging.DEBUG)
+    handler.setFormatter(logging.Formatter(log.TEXT_FORMAT, datefmt=log.DATE_FORMAT))
+    root = logging.getLogger()
+    root.setLevel(logging.DEBUG)
+    root.addHandler(handler)
+
+
+def legacy_teardown():
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+        handler.close()
+
+
+async def emit(calls: int) -> float:
+    """Время, которое event loop занят вызовами логгера."""
+    logger = logging.getLogger("ServiceDeskLogger")
+    started = time.perf_counter()
+    for i in range(calls):
+        uuid = f"objectBase${1_000_000 + i}"
+        logger.debug(f"Сущность objectBase$Server {uuid} актуальна. Пропуск обновления. SD: 2024-05-01 10:00:00, DB: 2024-05-01 10:00:00")
+    return time.perf_counter() - started
+
+
+def run_case(name: str, calls: int, repeat: int, setup, teardown, env=None):
+    best_emit, best_total = None, None
+    for _ in range(repeat):
+        with tempfile.TemporaryDirectory() as log_dir:
+            saved_env = {key: os.environ.get(key) for key in (env or {})}
+            os.environ.update(env or {})
+            os.environ['LOG_DIR'] = log_dir
+            setup(log_dir)
+            try:
+                started = time.perf_counter()
+                emit_time = asyncio.run(emit(calls))
+            finally:
+                teardown() # Для очереди ждет, пока фоновый поток допишет записи
+                total_time = time.perf_counter() - started
+                for key, value in saved_env.items():
+                    if value is None:
+                        os.environ.pop(key, None)
+                    else:
+                        os.environ[key] = value
+        best_emit = emit_time if best_emit is None else min(best_emit, emit_time)
+        best_total = total_time if best_total is None else min(best_total, total_time)
+
+    scale = CALLS_PER_REPORT / calls
+    print(f"{name:<32} event loop {best_emit * scale * 1000:8.1f} мс / 10k вызовов, "
+          f"до записи на диск {best_total * scale * 1000:8.1f} мс")
+
+
+def slow_disk(delay: float):
+    """Добавляет задержку к каждому flush обработчиков-потоков (FileHandler пишет и сбрасывает каждую запись)."""
+    original_flush = logging.StreamHandler.flush
+
+    def flush(self):
+        time.sleep(delay)
+        original_flush(self)
+
+    logging.StreamHandler.flush = flush
+
+
+def main(calls: int, repeat: int, flush_delay_ms: float):
+    logging.disable(logging.NOTSET)
+    if flush_delay_ms:
+        slow_disk(flush_delay_ms / 1000)
+        print(f"Имитация медленного диска: +{flush_delay_ms} мс на каждую запись")
+    run_case("FileHandler (старая схема)", calls, repeat, legacy_setup, legacy_teardown)
+    queued = lambda log_dir: log.setup_logger(console_logging=False, log_name="bench")
+    run_case("QueueHandler, DEBUG, text", calls, repeat, queued, log.shutdown_logging, {'LOG_LEVEL': 'DEBUG', 'LOG_FORMAT': 'text'})
+    run_case("QueueHandler, DEBUG, json", calls, repeat, queued, log.shutdown_logging, {'LOG_LEVEL': 'DEBUG', 'LOG_FORMAT': 'json'})
+    run_case("QueueHandler, INFO", calls, repeat, queued, log.shutdown_logging, {'LOG_LEVEL': 'INFO', 'LOG_FORMAT': 'text'})
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Стоимость логгирования для event loop")
+    parser.add_argument("--calls", type=int, default=CALLS_PER_REPORT, help="Вызовов логгера за прогон")
+    parser.add_argument("--repeat", type=int, default=5, help="Повторов (берется лучший)")
+    parser.add_argument("--flush-delay-ms", type=float, default=0.0, help="Задержка записи на диск, мс")
+    args = parser.parse_args()
+    main(args.calls, args.repeat, args.flush_delay_ms)
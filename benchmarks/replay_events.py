@@ -0,0 +1,113 @@
+"""
+Воспроизведение записанных уведомлений SD на POST /sync/events.
+
+Запись делает сам API: при SYNC_EVENTS_RECORD=events.jsonl каждая принятая пачка дописывается
+в файл строкой {"at": время получения, "events": тело запроса}. Скрипт отправляет пачки
+в том же порядке и с теми же интервалами (--speed ускоряет, 0 - без пауз) и печатает,
+сколько уведомлений принято и за сколько ответил API.
+
+Без SD запись можно получить от benchmarks.fake_sd: --mutate RATE изменяет долю сущностей
+фейкового SD, записывает уведомления о них в --record (пачками по --batch, как их шлет SD)
+и сразу воспроизводит.
+
+Запуск:
+    python -m benchmarks.replay_events events.jsonl --url http://localhost:8000 --token TOKEN [--speed 10]
+    python -m benchmarks.replay_events --mutate 0.01 --sd-url http://127.0.0.1:8765 --record events.jsonl \\
+        --url http://localhost:8000 --token TOKEN
+"""
+import argparse
+import datetime
+import json
+import sys
+import time
+import urllib.error
+import urllib.request
+from typing import Any, Dict, List, Optional
+
+
+def http_post(url: str, body: Any = None, headers: Optional[Dict[str, str]] = None) -> Any:
+    data = json.dumps(body).encode() if body is not None else b''
+    request = urllib.request.Request(url, method='POST', data=data,
+                                     headers={'Content-Type': 'application/json', **(headers or {})})
+    with urllib.request.urlopen(request, timeout=30) as response:
+        return json.loads(response.read() or b'null')
+
+
+def read_recording(path: str) -> List[Dict[str, Any]]:
+    """Пачки из файла записи в порядке получения."""
+    batches = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                batches.append(json.loads(line))
+    return batches
+
+
+def record_fake_sd_changes(sd_url: str, rate: float, path: str, batch: int) -> int:
+    """Изменяет долю rate сущностей benchmarks.fake_sd и записывает уведомления о них пачками по batch."""
+    events = http_post(f"{sd_url.rstrip('/')}/__mutate?rate={rate}")['events']
+    at = datetime.datetime.utcnow()
+    with open(path, 'w', encoding='utf-8') as f:
+        for start in range(0, len(events), batch):
+            # Пачки идут с интервалом 0.1с, как если бы SD отправлял их по мере изменений
+            stamp = (at + datetime.timedelta(seconds=0.1 * (start // batch))).isoformat()
+            f.write(json.dumps({'at': stamp, 'events': events[start:start + batch]}, ensure_ascii=False) + '\n')
+    return len(events)
+
+
+def replay(batches: List[Dict[str, Any]], url: str, token: str, speed: float) -> Dict[str, float]:
+    endpoint = f"{url.rstrip('/')}/sync/events"
+    totals = {'batches': 0, 'accepted': 0, 'ignored': 0, 'errors': 0, 'max_latency': 0.0}
+    started = time.monotonic()
+    first_at = None
+    for batch in batches:
+        at = datetime.datetime.fromisoformat(batch['at'])
+        first_at = first_at or at
+        if speed > 0:
+            delay = (at - first_at).total_seconds() / speed - (time.monotonic() - started)
+            if delay > 0:
+                time.sleep(delay)
+        sent = time.monotonic()
+        try:
+            result = http_post(endpoint, batch['events'], {'X-Events-Token': token})
+        except urllib.error.URLError as e:
+            totals['errors'] += 1
+            print(f"Ошибка отправки пачки от {batch['at']}: {e}", file=sys.stderr)
+            continue
+        totals['max_latency'] = max(totals['max_latency'], time.monotonic() - sent)
+        totals['batches'] += 1
+        totals['accepted'] += result['accepted']
+        totals['ignored'] += result['ignored']
+    totals['seconds'] = time.monotonic() - started
+    return totals
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Воспроизведение уведомлений SD на POST /sync/events")
+    parser.add_argument("recording", nargs="?", help="Файл записи (JSONL, см. SYNC_EVENTS_RECORD)")
+    parser.add_argument("--url", default="http://localhost:8000", help="Адрес API")
+    parser.add_argument("--token", required=True, help="Значение SYNC_EVENTS_TOKEN API")
+    parser.add_argument("--speed", type=float, default=1.0, help="Ускорение относительно записи (0 - без пауз)")
+    parser.add_argument("--mutate", type=float, metavar="RATE", help="Изменить долю сущностей benchmarks.fake_sd и записать уведомления")
+    parser.add_argument("--sd-url", default="http://127.0.0.1:8765", help="Адрес benchmarks.fake_sd для --mutate")
+    parser.add_argument("--record", default="events.jsonl", help="Куда записать уведомления для --mutate")
+    parser.add_argument("--batch", type=int, default=50, help="Уведомлений в пачке для --mutate")
+    args = parser.parse_args()
+    if args.mutate is None and not args.recording:
+        parser.error("нужен файл записи или --mutate")
+
+    path = args.recording
+    if args.mutate is not None:
+        changed = record_fake_sd_changes(args.sd_url, args.mutate, args.record, args.batch)
+        print(f"В fake_sd изменено {changed} сущностей, уведомления записаны в {args.record}")
+        path = args.record
+
+    batches = read_recording(path)
+    totals = replay(batches, args.url, args.token, args.speed)
+    print(f"Отправлено пачек {totals['batches']} из {len(batches)} за {totals['seconds']:.2f}с: "
+          f"принято {totals['accepted']}, пропущено {totals['ignored']}, ошибок {totals['errors']}, "
+          f"наибольшее время ответа {totals['max_latency'] * 1000:.0f}мс")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+"""
+Генератор синтетических данных в формате ответов ServiceDesk API.
+Используется бенчмарками: значения полей похожи на реальные (ID TeamViewer/AnyDesk
+с пробелами и мусором, облачные и локальные адреса, LiteManager в комментариях,
+РН ККТ, даты в формате SD, кириллические названия).
+"""
+import datetime
+import random
+from typing import Dict, Any, List, Optional
+
+SD_DATE_FORMAT = "%Y.%m.%d %H:%M:%S"
+
+COMPANY_WORDS = ["Ресторан", "Кафе", "Бар", "Пиццерия", "Столовая", "Кофейня", "Суши", "Бургерная", "Пекарня", "Трактир"]
+COMPANY_NAMES = ["Ромашка", "Берёзка", "Чайхана", "Пельменная №1", "Уют", "Север", "Волна", "Огонёк", "Самовар", "Теремок", "Мята", "Шафран"]
+CITIES = ["Москва", "Санкт-Петербург", "Казань", "Екатеринбург", "Новосибирск", "Самара", "Тверь", "Сочи"]
+STREETS = ["ул. Ленина", "пр. Мира", "ул. Гагарина", "Невский пр.", "ул. Садовая", "ул. Пушкина"]
+LEGAL_FORMS = ["ООО", "ИП", "АО"]
+KKT_MODELS = ["АТОЛ 30Ф", "АТОЛ 55Ф", "Штрих-М-01Ф", "Эвотор СТ5Ф", "Меркурий-185Ф", "Пирит 2Ф"]
+FFD_VERSIONS = ["1.05", "1.1", "1.2"]
+
+
+def make_uuid(prefix: str, number: int) -> str:
+    """UUID в формате SD: префикс метакласса и числовой идентификатор."""
+    return f"{prefix}${number}"
+
+
+def format_sd_date(value: datetime.datetime) -> str:
+    return value.strftime(SD_DATE_FORMAT)
+
+
+def random_sd_date(rng: random.Random, start_year: int = 2019, end_year: int = 2025) -> str:
+    start = datetime.datetime(start_year, 1, 1)
+    span = (datetime.datetime(end_year, 12, 31) - start).total_seconds()
+    return format_sd_date(start + datetime.timedelta(seconds=rng.randrange(int(span))))
+
+
+def company_title(rng: random.Random) -> str:
+    return f"{rng.choice(COMPANY_WORDS)} \"{rng.choice(COMPANY_NAMES)}\""
+
+
+def remote_access_raw(rng: random.Random) -> Optional[str]:
+    """ID TeamViewer/AnyDesk в том виде, в каком его вводят операторы."""
+    digits = str(rng.randrange(100000000, 9999999999))
+    variant = rng.random()
+    if variant < 0.15:
+        return None
+    if variant < 0.45:
+        return digits
+    if variant < 0.7:
+        return " ".join(digits[i:i + 3] for i in range(0, len(digits), 3))
+    if variant < 0.85:
+        return f"id: {digits} пароль в кипасе"
+    return rng.choice(["нет", "-", "уточнить у клиента", ""])
+
+
+def teamviewer_id(rng: random.Random) -> str:
+    return str(rng.randrange(100000000, 2000000000))
+
+
+def ip_raw(rng: random.Random) -> Optional[str]:
+    variant = rng.random()
+    if variant < 0.1:
+        return None
+    if variant < 0.3:
+        return f"https://{rng.choice(['rest', 'cafe', 'bar'])}-{rng.randrange(1, 9999)}.iiko.it/resto"
+    if variant < 0.4:
+        return f"{rng.choice(['rest', 'cafe'])}-{rng.randrange(1, 9999)}.syrve.online"
+    if variant < 0.8:
+        ip = f"192.168.{rng.randrange(0, 255)}.{rng.randrange(1, 255)}"
+        return ip if rng.random() < 0.5 else f"{ip}:{rng.choice([8080, 9080, 443])}"
+    if variant < 0.95:
+        return f"srv-{rng.randrange(1, 999)}.local:{rng.choice([8080, 9042])}"
+    return "адрес уточнить"
+
+
+def litemanager_id(rng: random.Random) -> str:
+    return f"MH_{rng.randrange(10000, 99999)}"
+
+
+def rn_kkt(rng: random.Random) -> str:
+    return str(rng.randrange(10 ** 15, 10 ** 16 - 1))
+
+
+def sd_company_record(rng: random.Random, number: int, parent_uuid: Optional[str] = None) -> Dict[str, Any]:
+    uuid = make_uuid("ou", number)
+    return {
+        'UUID': uuid,
+        'title': company_title(rng),
+        'adress': f"г. {rng.choice(CITIES)}, {rng.choice(STREETS)}, д. {rng.randrange(1, 200)}",
+        'additionalName': f"{rng.choice(LEGAL_FORMS)} \"{rng.choice(COMPANY_NAMES)}\"",
+        'lastModifiedDate': random_sd_date(rng),
+        'parent': {'UUID': parent_uuid, 'metaClass': 'ou$company'} if parent_uuid else None,
+        'recipientAgreements': [{'UUID': make_uuid("agreement", number), 'metaClass': 'agreement$agreement'}],
+    }
+
+
+def sd_server_record(rng: random.Random, number: int, owner_uuid: str) -> Dict[str, Any]:
+    lm = litemanager_id(rng) if rng.random() < 0.4 else None
+    return {
+        'UUID': make_uuid("objectBase", number),
+        'UniqueID': f"{rng.randrange(100, 999)}-{rng.randrange(100, 999)}-{rng.randrange(100, 999)}" if rng.random() < 0.8 else "неизвестно",
+        'Teamviewer': remote_access_raw(rng),
+        'RDP': remote_access_raw(rng) if rng.random() < 0.3 else None,
+        'AnyDesk': remote_access_raw(rng),
+        'IP': ip_raw(rng),
+        'CabinetLink': f"https://pp.iiko.ru/cabinet?clientId={rng.randrange(1000, 99999)}" if rng.random() < 0.7 else "",
+        'DeviceName': f"SRV-{rng.randrange(1, 9999):04d}",
+        'lastModifiedDate': random_sd_date(rng),
+        'iikoVersion': f"8.{rng.randrange(0, 9)}.{rng.randrange(1000, 9999)}.0",
+        'description': f"Основной сервер. LM {lm}" if lm and rng.random() < 0.5 else "Основной сервер",
+        'nameforclient': company_title(rng),
+        'owner': {'UUID': owner_uuid, 'metaClass': 'ou$company'},
+        'litemanagerID': lm if lm and rng.random() < 0.5 else None,
+    }
+
+
+def sd_workstation_record(rng: random.Random, number: int, owner_uuid: str) -> Dict[str, Any]:
+    lm = litemanager_id(rng) if rng.random() < 0.4 else None
+    return {
+        'UUID': make_uuid("objectBase", number),
+        'Commentariy': f"Касса {rng.randrange(1, 10)}, LM: {lm}" if lm else f"Касса {rng.randrange(1, 10)}",
+        'Teamviewer': remote_access_raw(rng),
+        'AnyDesk': remote_access_raw(rng),
+        'DeviceName': f"POS-{rng.randrange(1, 9999):04d}",
+        'litemanagerID': lm if lm and rng.random() < 0.3 else None,
+        'lastModifiedDate': random_sd_date(rng),
+        'owner': {'UUID': owner_uuid, 'metaClass': 'ou$company'},
+    }
+
+
+def sd_fr_record(rng: random.Random, number: int, owner_uuid: str) -> Dict[str, Any]:
+    return {
+        'UUID': make_uuid("objectBase", number),
+        'ModelKKT': {'UUID': make_uuid("catalog", rng.randrange(1, 50)), 'title': rng.choice(KKT_MODELS)},
+        'lastModifiedDate': random_sd_date(rng),
+        'owner': {'UUID': owner_uuid, 'metaClass': 'ou$company'},
+        'FFD': {'UUID': make_uuid("catalog", rng.randrange(50, 60)), 'title': rng.choice(FFD_VERSIONS)},
+        'FRDownloader': rng.choice(["Да", "Нет", None]),
+        'RNKKT': rn_kkt(rng),
+        'KKTRegDate': random_sd_date(rng, 2018, 2023),
+        'FNExpireDate': random_sd_date(rng, 2024, 2027) if rng.random() < 0.9 else None,
+        'LegalName': f"{rng.choice(LEGAL_FORMS)} \"{rng.choice(COMPANY_NAMES)}\"",
+        'FRSerialNumber': str(rng.randrange(10 ** 13, 10 ** 14 - 1)),
+        'FNNumber': str(rng.randrange(10 ** 15, 10 ** 16 - 1)),
+    }
+
+
+RECORD_FACTORIES = {
+    'objectBase$Server': sd_server_record,
+    'objectBase$Workstation': sd_workstation_record,
+    'objectBase$FR': sd_fr_record,
+}
+
+
+def generate_device_records(meta_class: str, count: int, seed: int = 42, companies: int = 1000) -> List[Dict[str, Any]]:
+    """Генерирует count записей оборудования метакласса, распределенных по companies компаниям."""
+    rng = random.Random(seed)
+    factory = RECORD_FACTORIES[meta_class]
+    return [factory(rng, 1_000_000 + i, make_uuid("ou", rng.randrange(companies))) for i in range(count)]
@@ -0,0 +1,61 @@
+"""
+Бенчмарк валидаторов data_validator.py на синтетических записях SD.
+
+Запуск: python -m benchmarks.validators [--records 100000] [--repeat 3]
+Выводит производительность (записей/сек) clearify_server_data, clearify_pos_data и clearify_fr_data
+и их пакетных вариантов clearify_*_batch на тех же данных. Пакетный вариант замеряется вместе
+с rows_from_columns, как его вызывает sync_offload.py, и его результат сверяется с обычным.
+"""
+import argparse
+import logging
+import time
+
+from data_validator import (
+    clearify_server_data, clearify_pos_data, clearify_fr_data,
+    clearify_server_batch, clearify_pos_batch, clearify_fr_batch, rows_from_columns
+)
+from benchmarks.synthetic import generate_device_records
+
+VALIDATORS = [
+    ('clearify_server_data', 'objectBase$Server', clearify_server_data, clearify_server_batch),
+    ('clearify_pos_data', 'objectBase$Workstation', clearify_pos_data, clearify_pos_batch),
+    ('clearify_fr_data', 'objectBase$FR', clearify_fr_data, clearify_fr_batch),
+]
+
+
+def best_time(func, repeat: int) -> float:
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def run(records: int, repeat: int):
+    for name, meta_class, validator, batch_validator in VALIDATORS:
+        data = generate_device_records(meta_class, records)
+        elapsed = best_time(lambda: [validator(item) for item in data], repeat)
+        print(f"{name:<24} {records} записей: {elapsed:.3f}с, {records / elapsed:,.0f} записей/сек")
+        elapsed = best_time(lambda: rows_from_columns(batch_validator(data)), repeat)
+        print(f"{batch_validator.__name__:<24} {records} записей: {elapsed:.3f}с, {records / elapsed:,.0f} записей/сек")
+        if rows_from_columns(batch_validator(data)) != [validator(item) for item in data]:
+            print(f"{batch_validator.__name__}: результат отличается от {name}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Бенчмарк валидаторов данных SD")
+    parser.add_argument("--records", type=int, default=100_000, help="Количество записей каждого типа")
+    parser.add_argument("--repeat", type=int, default=3, help="Количество повторов (берется лучший)")
+    parser.add_argument("--log-level", default="INFO", help="Уровень логгера ServiceDeskLogger во время замера")
+    args = parser.parse_args()
+
+    # Как в проде: логгер настроен, но DEBUG выключен. Сообщения никуда не пишутся,
+    # чтобы замер показывал стоимость валидации, а не дискового вывода.
+    service_logger = logging.getLogger("ServiceDeskLogger")
+    service_logger.setLevel(args.log_level)
+    service_logger.addHandler(logging.NullHandler())
+    service_logger.propagate = False
+
+    run(args.records, args.repeat)
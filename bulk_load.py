@@ -0,0 +1,150 @@
+import logging
+from typing import Any, Dict, Iterator, List, Tuple
+
+from sqlalchemy import Table, bindparam, text
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncSession
+
+from models import Company, Server, Workstation, FiscalRegister
+
+logger = logging.getLogger("ServiceDeskLogger")
+
+# Массовая загрузка сущностей для первой или полной пересинхронизации (sync_runner.py --full).
+# Вместо session.add по одной строке очищенные данные копируются в промежуточные
+# временные таблицы (в PostgreSQL - COPY через asyncpg) и вливаются в основные таблицы
+# одним INSERT ... ON CONFLICT на таблицу. Все выполняется в одной транзакции:
+# проверки FK отложены до коммита (SET CONSTRAINTS ALL DEFERRED, FK объявлены DEFERRABLE),
+# поэтому порядок компаний по иерархии и порядок таблиц не важны.
+# Сущности со ссылкой на компанию, которой нет ни в БД, ни в загрузке, отбрасываются
+# до слияния, как и при инкрементальной синхронизации.
+
+# Порядок слияния: компании первыми (для читаемости плана, FK все равно проверяются при коммите)
+BULK_TABLES: List[Table] = [Company.__table__, Server.__table__, Workstation.__table__, FiscalRegister.__table__]
+# Колонка со ссылкой на компанию в каждой таблице
+COMPANY_REFERENCE_COLUMNS = {
+    'companies': 'parent_uuid',
+    'servers': 'owner_id',
+    'workstations': 'owner_id',
+    'fiscal_registers': 'owner_id',
+}
+# Размер пачки INSERT в промежуточную таблицу для БД без COPY (SQLite в разработке)
+STAGING_INSERT_BATCH = 5000
+
+
+def staging_name(table: Table) -> str:
+    return f"bulk_{table.name}"
+
+
+def _column_defaults(table: Table) -> Dict[str, Any]:
+    """Скалярные значения по умолчанию колонок (meta_class): COPY их не подставляет."""
+    return {
+        column.name: column.default.arg
+        for column in table.columns
+        if column.default is not None and column.default.is_scalar
+    }
+
+
+def table_records(table: Table, rows: List[Dict[str, Any]]) -> Iterator[Tuple]:
+    """Кортежи значений в порядке колонок таблицы. Лишние ключи очищенных данных отбрасываются."""
+    columns = [column.name for column in table.columns]
+    defaults = _column_defaults(table)
+    for row in rows:
+        yield tuple(row.get(name, defaults.get(name)) for name in columns)
+
+
+async def _create_staging(conn: AsyncConnection, table: Table, is_postgres: bool):
+    name = staging_name(table)
+    if is_postgres:
+        await conn.execute(text(f"CREATE TEMPORARY TABLE {name} (LIKE {table.name} INCLUDING DEFAULTS) ON COMMIT DROP"))
+    else:
+        # В SQLite временные таблицы живут до закрытия соединения, а соединения переиспользуются пулом
+        await conn.execute(text(f"DROP TABLE IF EXISTS temp.{name}"))
+        await conn.execute(text(f"CREATE TEMPORARY TABLE {name} AS SELECT * FROM {table.name} WHERE 0"))
+
+
+async def _copy_rows(conn: AsyncConnection, table: Table, rows: List[Dict[str, Any]], is_postgres: bool):
+    name = staging_name(table)
+    columns = [column.name for column in table.columns]
+    if is_postgres:
+        raw = await conn.get_raw_connection()
+        await raw.driver_connection.copy_records_to_table(name, records=table_records(table, rows), columns=columns)
+        return
+    insert = text(f"INSERT INTO {name} ({', '.join(columns)}) VALUES ({', '.join(':' + c for c in columns)})")
+    # Типы колонок модели (DateTime, Boolean) приводят значения к формату основной таблицы
+    insert = insert.bindparams(*(bindparam(column.name, type_=column.type) for column in table.columns))
+    for start in range(0, len(rows), STAGING_INSERT_BATCH):
+        batch = [dict(zip(columns, values)) for values in table_records(table, rows[start:start + STAGING_INSERT_BATCH])]
+        await conn.execute(insert, batch)
+
+
+async def _drop_dangling_references(conn: AsyncConnection) -> Dict[str, int]:
+    """
+    Удаляет из промежуточных таблиц сущности со ссылкой на компанию, которой нет ни в companies,
+    ни в загрузке. У компаний удаление повторяется, пока есть что удалять: вместе с компанией
+    отбрасываются и ее дочерние. Возвращает {таблица: отброшено строк}.
+    """
+    companies_stage = staging_name(Company.__table__)
+    dropped = {}
+    for table in BULK_TABLES:
+        column = COMPANY_REFERENCE_COLUMNS[table.name]
+        stage = staging_name(table)
+        condition = (
+            f"{column} IS NOT NULL "
+            f"AND NOT EXISTS (SELECT 1 FROM companies c WHERE c.uuid = {stage}.{column}) "
+            f"AND NOT EXISTS (SELECT 1 FROM {companies_stage} p WHERE p.uuid = {stage}.{column})"
+        )
+        if table.name != 'companies':
+            # Оборудование без владельца тоже не сохраняется
+            condition = f"{column} IS NULL OR ({condition})"
+        total = 0
+        while True:
+            deleted = (await conn.execute(text(f"DELETE FROM {stage} WHERE {condition}"))).rowcount
+            total += deleted
+            if not deleted or table.name != 'companies':
+                break
+        if total:
+            logger.warning(f"Массовая загрузка: {total} строк {table.name} ссылаются на отсутствующую компанию и не будут сохранены.")
+        dropped[table.name] = total
+    return dropped
+
+
+async def _merge(conn: AsyncConnection, table: Table) -> int:
+    """INSERT ... ON CONFLICT (uuid) DO UPDATE из промежуточной таблицы. Возвращает число строк."""
+    columns = [column.name for column in table.columns]
+    column_list = ", ".join(columns)
+    updates = ", ".join(f"{name} = excluded.{name}" for name in columns if name != 'uuid')
+    # WHERE true нужен SQLite: без него ON CONFLICT после SELECT разбирается как часть JOIN
+    result = await conn.execute(text(
+        f"INSERT INTO {table.name} ({column_list}) SELECT {column_list} FROM {staging_name(table)} WHERE true "
+        f"ON CONFLICT (uuid) DO UPDATE SET {updates}"
+    ))
+    return result.rowcount
+
+
+async def bulk_upsert(session: AsyncSession, rows_by_table: Dict[str, List[Dict[str, Any]]]) -> Tuple[Dict[str, int], Dict[str, int]]:
+    """
+    Загружает очищенные данные ({имя таблицы: [строки]}) через промежуточные таблицы
+    и вливает их в основные таблицы. Возвращает ({таблица: сохранено строк}, {таблица: отброшено строк}).
+    Коммит выполняет вызывающий код: до него изменения не видны, FK проверяются при коммите.
+    """
+    conn = await session.connection()
+    is_postgres = conn.dialect.name == 'postgresql'
+    if is_postgres:
+        await conn.execute(text("SET CONSTRAINTS ALL DEFERRED"))
+
+    for table in BULK_TABLES:
+        await _create_staging(conn, table, is_postgres)
+        rows = rows_by_table.get(table.name) or []
+        if rows:
+            await _copy_rows(conn, table, rows, is_postgres)
+        logger.info(f"Массовая загрузка: в {staging_name(table)} скопировано {len(rows)} строк.")
+
+    dropped = await _drop_dangling_references(conn)
+
+    saved = {}
+    for table in BULK_TABLES:
+        saved[table.name] = await _merge(conn, table)
+        logger.info(f"Массовая загрузка: в {table.name} вставлено или обновлено {saved[table.name]} строк.")
+        if not is_postgres:
+            await conn.execute(text(f"DROP TABLE temp.{staging_name(table)}"))
+    return saved, dropped
+
@@ -1,7 +1,12 @@
 import re
+import json
+import hashlib
 import logging
 import datetime
-from typing import Optional, Dict, Any
+import functools
+import itertools
+import operator
+from typing import Optional, Dict, Any, List
 
 # Получаем логгер, настроенный в другом месте (например, sync_runner.py или log.py)
 logger = logging.getLogger("ServiceDeskLogger")
@@ -14,6 +19,61 @@ SYRVE_ONLINE_PATTERN = r'^(https?://)?([a-zA-Z0-9-]+\.)?([a-zA-Z0-9-]+\.syrve\.o
 REMOTE_ACCESS_ID_PATTERN = r'(\d\s*){9,10}'
 # Паттерн для поиска LiteManager ID (MH_XXXXX) в произвольном тексте
 LITEMANAGER_RAW_PATTERN = r'MH_\d{5}'
+# Паттерн формата UniqueID (XXX-XXX-XXX)
+UNIQUE_ID_PATTERN = r'^\d{3}-\d{3}-\d{3}$'
+# Паттерны локального IP адреса и локального домена с опциональным портом
+IP_PORT_PATTERN = r'(\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3})(?::(\d+))?'
+DOMAIN_PORT_PATTERN = r'^([a-zA-Z0-9.-]+)(?::(\d+))?$'
+# Строка целиком - локальный IP из цифр ASCII с опциональным портом (быстрый путь пакетной валидации)
+LOCAL_IP_PORT_PATTERN = r'([0-9]{1,3}\.[0-9]{1,3}\.[0-9]{1,3}\.[0-9]{1,3})(?::([0-9]+))?'
+
+# Скомпилированные паттерны: валидаторы вызываются для каждого поля каждой сущности
+IIKO_IT_RE = re.compile(IIKO_IT_PATTERN)
+SYRVE_ONLINE_RE = re.compile(SYRVE_ONLINE_PATTERN)
+REMOTE_ACCESS_ID_RE = re.compile(REMOTE_ACCESS_ID_PATTERN)
+LITEMANAGER_RAW_RE = re.compile(LITEMANAGER_RAW_PATTERN)
+UNIQUE_ID_RE = re.compile(UNIQUE_ID_PATTERN)
+IP_PORT_RE = re.compile(IP_PORT_PATTERN)
+DOMAIN_PORT_RE = re.compile(DOMAIN_PORT_PATTERN)
+LOCAL_IP_PORT_RE = re.compile(LOCAL_IP_PORT_PATTERN)
+
+# Формат дат в ответах ServiceDesk API
+SD_DATETIME_FORMAT = "%Y.%m.%d %H:%M:%S"
+# Маска даты SD для пакетной валидации: цифры ASCII заменяются на '0', остальное как есть
+SD_DATETIME_DIGITS_MASK = bytes.maketrans(b'0123456789', b'0000000000')
+SD_DATETIME_MASK = b'0000.00.00 00:00:00\n'
+
+
+@functools.lru_cache(maxsize=16384)
+def parse_sd_datetime(value: str) -> datetime.datetime:
+    """
+    Разбирает дату SD в формате "YYYY.MM.DD HH:MM:SS".
+    Строки ровно этого вида разбираются через datetime.fromisoformat (реализован на C),
+    все остальное (и ошибки) отдается strptime, поэтому поведение совпадает с ним,
+    включая ValueError на неверный формат. Результаты кэшируются: одни и те же
+    даты (например, окончания ФН) повторяются у многих сущностей.
+    """
+    if (len(value) == 19 and value[4] == '.' and value[7] == '.' and value[10] == ' '
+            and value[13] == ':' and value[16] == ':'):
+        try:
+            # "YYYY.MM.DD HH:MM:SS" -> "YYYY-MM-DD HH:MM:SS"
+            return datetime.datetime.fromisoformat(value.replace('.', '-', 2))
+        except ValueError:
+            pass # Например, 31 февраля: пусть strptime выдаст свою ошибку
+    return datetime.datetime.strptime(value, SD_DATETIME_FORMAT)
+
+# Поля, не влияющие на хеш содержимого: дата изменения меняется в SD при любой правке,
+# в том числе атрибутов, которые мы не храним
+CONTENT_HASH_EXCLUDED_FIELDS = ('last_modified_date', 'content_hash')
+
+def compute_content_hash(cleaned_data: Dict[str, Any]) -> str:
+    """
+    Вычисляет хеш очищенных данных сущности (результат clearify_* / process_company_data).
+    Совпадение хеша с сохраненным в БД означает, что перезаписывать строку не нужно.
+    """
+    content = {k: v for k, v in cleaned_data.items() if k not in CONTENT_HASH_EXCLUDED_FIELDS}
+    serialized = json.dumps(content, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha1(serialized.encode('utf-8')).hexdigest()
 
 # Функция для определения типа компании (iiko/Syrve) по адресу сервера
 def determine_company_type_from_ip(ip_address: Optional[str]) -> str:
@@ -44,13 +104,13 @@ def validate_cabinet_link(cabinet_link_raw: Optional[str], company_type: str) ->
             # Проверяем, что полученная строка состоит только из цифр
             if potential_id_str.isdigit():
                 client_id = potential_id_str
-                logger.debug(f"Извлечен client ID '{client_id}' из ссылки: '{cabinet_link_raw}'")
+                logger.debug("Извлечен client ID '%s' из ссылки: '%s'", client_id, cabinet_link_raw)
             else:
-                logger.warning(f"Найдено '=', но часть после него не является числом: '{potential_id_str}' из '{cabinet_link_raw}'. Использован 'N/A'.")
+                logger.warning("Найдено '=', но часть после него не является числом: '%s' из '%s'. Использован 'N/A'.", potential_id_str, cabinet_link_raw)
         else:
-            logger.warning(f"В строке ссылки на кабинет отсутствует '=': '{cabinet_link_raw}'. Использован 'N/A'.")
+            logger.warning("В строке ссылки на кабинет отсутствует '=': '%s'. Использован 'N/A'.", cabinet_link_raw)
     else:
-        logger.debug(f"Исходная строка ссылки на кабинет пустая или некорректная: '{cabinet_link_raw}'. Использован 'N/A'.")
+        logger.debug("Исходная строка ссылки на кабинет пустая или некорректная: '%s'. Использован 'N/A'.", cabinet_link_raw)
 
 
     # Формируем итоговую ссылку в зависимости от типа компании
@@ -59,7 +119,7 @@ def validate_cabinet_link(cabinet_link_raw: Optional[str], company_type: str) ->
     else: # company_type == 'iiko'
         final_link = f"https://pp.iiko.ru/ru/cabinet/client-area/index.html?clientId={client_id}"
 
-    logger.debug(f"Сформирована итоговая ссылка на кабинет: '{final_link}'")
+    logger.debug("Сформирована итоговая ссылка на кабинет: '%s'", final_link)
     return final_link
 
 
@@ -69,12 +129,15 @@ def validate_unique_id(unique_id: Optional[str]) -> Optional[str]:
     Валидирует формат UniqueID (XXX-XXX-XXX).
     Возвращает UniqueID или None, если формат неверный или отсутствует.
     """
-    if unique_id is None or not isinstance(unique_id, str) or not re.match(r'^\d{3}-\d{3}-\d{3}$', unique_id.strip()):
-        if unique_id and isinstance(unique_id, str) and unique_id.strip():
-             logger.warning(f"UniqueID имеет неверный формат: '{unique_id}'. Возвращено None.")
+    if unique_id is None or not isinstance(unique_id, str):
         return None
-    logger.debug(f"UniqueID корректен: '{unique_id.strip()}'")
-    return unique_id.strip()
+    stripped = unique_id.strip()
+    if not UNIQUE_ID_RE.match(stripped):
+        if stripped:
+             logger.warning("UniqueID имеет неверный формат: '%s'. Возвращено None.", unique_id)
+        return None
+    logger.debug("UniqueID корректен: '%s'", stripped)
+    return stripped
 
 # Функция для очистки удаленных доступов (Teamviewer, AnyDesk)
 def validate_remote_access_id(access_id_raw: Optional[str]) -> Optional[str]:
@@ -85,14 +148,18 @@ def validate_remote_access_id(access_id_raw: Optional[str]) -> Optional[str]:
     if not isinstance(access_id_raw, str) or not access_id_raw.strip():
         return None
 
-    match_id = re.search(REMOTE_ACCESS_ID_PATTERN, access_id_raw)
+    # Самый частый случай - ID уже введен без пробелов: регулярка вернула бы строку целиком
+    if len(access_id_raw) in (9, 10) and access_id_raw.isascii() and access_id_raw.isdigit():
+        logger.debug("ID удаленного доступа корректен: '%s'", access_id_raw)
+        return access_id_raw
+
+    match_id = REMOTE_ACCESS_ID_RE.search(access_id_raw)
     if match_id:
-        access_id = match_id.group(0)
-        cleaned_id = access_id.replace(' ', '') # Удаляем пробелы
-        logger.debug(f"Найден и очищен ID удаленного доступа: '{access_id_raw.strip()}' -> '{cleaned_id}'")
+        cleaned_id = match_id.group(0).replace(' ', '') # Удаляем пробелы
+        logger.debug("Найден и очищен ID удаленного доступа: '%s' -> '%s'", access_id_raw, cleaned_id)
         return cleaned_id
     else:
-        logger.debug(f"Не удалось найти ID удаленного доступа по паттерну: '{access_id_raw.strip()}'. Возвращено None.")
+        logger.debug("Не удалось найти ID удаленного доступа по паттерну: '%s'. Возвращено None.", access_id_raw)
         return None
 
 # Функция для валидации и преобразования IP адреса/домена
@@ -108,22 +175,23 @@ def validate_ip_address(ip_address_raw: Optional[str]) -> Optional[str]:
     ip_address = ip_address_raw.strip()
 
     # 1. Обработка облачных адресов (.iiko.it, .syrve.online)
-    match_cloud_iiko = re.search(IIKO_IT_PATTERN, ip_address)
-    if match_cloud_iiko:
-        domain = match_cloud_iiko.group(3)
-        updated_ip = f"{domain}:443"
-        logger.debug(f"Облачный IP (.iiko.it) преобразован: '{ip_address_raw}' -> '{updated_ip}'")
-        return updated_ip
-
-    match_cloud_syrve = re.search(SYRVE_ONLINE_PATTERN, ip_address)
-    if match_cloud_syrve:
-        domain = match_cloud_syrve.group(3)
-        updated_ip = f"{domain}:443"
-        logger.debug(f"Облачный IP (.syrve.online) преобразован: '{ip_address_raw}' -> '{updated_ip}'")
-        return updated_ip
+    # Паттерны требуют буквального вхождения домена, поэтому регулярку запускаем только при его наличии
+    if '.iiko.it' in ip_address:
+        match_cloud_iiko = IIKO_IT_RE.search(ip_address)
+        if match_cloud_iiko:
+            updated_ip = f"{match_cloud_iiko.group(3)}:443"
+            logger.debug("Облачный IP (.iiko.it) преобразован: '%s' -> '%s'", ip_address_raw, updated_ip)
+            return updated_ip
+
+    if '.syrve.online' in ip_address:
+        match_cloud_syrve = SYRVE_ONLINE_RE.search(ip_address)
+        if match_cloud_syrve:
+            updated_ip = f"{match_cloud_syrve.group(3)}:443"
+            logger.debug("Облачный IP (.syrve.online) преобразован: '%s' -> '%s'", ip_address_raw, updated_ip)
+            return updated_ip
 
     # 2. Обработка локальных IP адресов (x.x.x.x) с опциональным портом
-    match_ip_port = re.search(r'(\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3})(?::(\d+))?', ip_address)
+    match_ip_port = IP_PORT_RE.search(ip_address)
     if match_ip_port:
         ip = match_ip_port.group(1)
         port = match_ip_port.group(2)
@@ -131,28 +199,28 @@ def validate_ip_address(ip_address_raw: Optional[str]) -> Optional[str]:
         try:
             if all(0 <= int(seg) <= 255 for seg in ip.split('.')):
                  updated_ip = f"{ip}:{port if port else '8080'}"
-                 logger.debug(f"Локальный IP преобразован: '{ip_address_raw}' -> '{updated_ip}'")
+                 logger.debug("Локальный IP преобразован: '%s' -> '%s'", ip_address_raw, updated_ip)
                  return updated_ip
             else:
-                 logger.warning(f"Невалидный формат сегментов IP адреса: '{ip_address_raw}'. Возвращено None.")
+                 logger.warning("Невалидный формат сегментов IP адреса: '%s'. Возвращено None.", ip_address_raw)
                  return None
         except ValueError:
-             logger.warning(f"Ошибка при парсинге сегментов IP адреса: '{ip_address_raw}'. Возвращено None.")
+             logger.warning("Ошибка при парсинге сегментов IP адреса: '%s'. Возвращено None.", ip_address_raw)
              return None
 
 
     # 3. Обработка локальных доменов (без http/https, с/без порта)
-    match_domain_port = re.search(r'^([a-zA-Z0-9.-]+)(?::(\d+))?$', ip_address)
+    match_domain_port = DOMAIN_PORT_RE.search(ip_address)
     if match_domain_port:
         domain = match_domain_port.group(1)
         port = match_domain_port.group(2)
         # Можно добавить более строгую проверку домена, но пока оставим простую
         updated_ip = f"{domain}:{port if port else '8080'}"
-        logger.debug(f"Локальный домен преобразован: '{ip_address_raw}' -> '{updated_ip}'")
+        logger.debug("Локальный домен преобразован: '%s' -> '%s'", ip_address_raw, updated_ip)
         return updated_ip
 
     # Если ни один паттерн не совпал
-    logger.warning(f"Не удалось распознать формат IP адреса или домена: '{ip_address_raw}'. Возвращено None.")
+    logger.warning("Не удалось распознать формат IP адреса или домена: '%s'. Возвращено None.", ip_address_raw)
     return None
 
 # Функция для извлечения LiteManager ID
@@ -164,19 +232,21 @@ def extract_litemanager_id(data: Dict[str, Any], fallback_text: Optional[str] =
     # 1. Проверяем прямое поле 'litemanagerID' из данных ServiceDesk
     litemanager_id_direct = data.get('litemanagerID')
     if litemanager_id_direct and isinstance(litemanager_id_direct, str):
+        litemanager_id_direct = litemanager_id_direct.strip()
         # Можно добавить простую валидацию формата MH_\d{5} для прямого поля
-        if re.match(LITEMANAGER_RAW_PATTERN, litemanager_id_direct.strip()):
-             logger.debug(f"Найден LiteManager ID в прямом поле: '{litemanager_id_direct.strip()}'")
-             return litemanager_id_direct.strip()
+        if LITEMANAGER_RAW_RE.match(litemanager_id_direct):
+             logger.debug("Найден LiteManager ID в прямом поле: '%s'", litemanager_id_direct)
+             return litemanager_id_direct
         else:
-             logger.warning(f"Прямое поле litemanagerID имеет неверный формат: '{litemanager_id_direct.strip()}'. Игнорируем прямое поле.")
+             logger.warning("Прямое поле litemanagerID имеет неверный формат: '%s'. Игнорируем прямое поле.", litemanager_id_direct)
 
 
     # 2. Если прямого поля нет или оно невалидно, пытаемся найти по паттерну в fallback_text
-    if fallback_text and isinstance(fallback_text, str):
-        lm_match = re.search(LITEMANAGER_RAW_PATTERN, fallback_text)
+    # Без подстроки 'MH_' паттерн совпасть не может, регулярку не запускаем
+    if fallback_text and isinstance(fallback_text, str) and 'MH_' in fallback_text:
+        lm_match = LITEMANAGER_RAW_RE.search(fallback_text)
         if lm_match:
-            logger.debug(f"Найден LiteManager ID в тексте: '{lm_match[0]}'")
+            logger.debug("Найден LiteManager ID в тексте: '%s'", lm_match[0])
             return lm_match[0]
 
     # Если нигде не найдено
@@ -190,7 +260,7 @@ def clearify_server_data(server_data: Dict[str, Any]) -> Dict[str, Any]:
     Очищает и валидирует данные сервера, полученные из ServiceDesk API.
     Возвращает словарь с данными, готовыми для сохранения в БД (snake_case ключи).
     """
-    logger.debug(f"Начало валидации данных сервера UUID: {server_data.get('UUID')}")
+    logger.debug("Начало валидации данных сервера UUID: %s", server_data.get('UUID'))
 
     cleaned_data = {}
 
@@ -222,10 +292,10 @@ def clearify_server_data(server_data: Dict[str, Any]) -> Dict[str, Any]:
     # Объединяем nameforclient и description из SD в одно поле description в БД
     cleaned_data['description'] = '{} {}'.format(server_data.get('nameforclient', ''), server_data.get('description', '')).strip()
 
-    cleaned_data['last_modified_date'] = datetime.datetime.strptime(server_data['lastModifiedDate'], "%Y.%m.%d %H:%M:%S") if server_data.get('lastModifiedDate') else None
+    cleaned_data['last_modified_date'] = parse_sd_datetime(server_data['lastModifiedDate']) if server_data.get('lastModifiedDate') else None
     cleaned_data['owner_id'] = server_data.get('owner', {}).get('UUID') if server_data.get('owner') else None
 
-    logger.debug(f"Валидация данных сервера UUID {cleaned_data.get('uuid')} завершена.")
+    logger.debug("Валидация данных сервера UUID %s завершена.", cleaned_data['uuid'])
     return cleaned_data
 
 # Функция для валидации и очистки данных рабочей станции (POS) (синхронная)
@@ -234,7 +304,7 @@ def clearify_pos_data(pos_data: Dict[str, Any]) -> Dict[str, Any]:
     Очищает и валидирует данные рабочей станции (POS), полученные из ServiceDesk API.
     Возвращает словарь с данными, готовыми для сохранения в БД (snake_case ключи).
     """
-    logger.debug(f"Начало валидации данных POS UUID: {pos_data.get('UUID')}")
+    logger.debug("Начало валидации данных POS UUID: %s", pos_data.get('UUID'))
 
     cleaned_data = {}
 
@@ -254,10 +324,10 @@ def clearify_pos_data(pos_data: Dict[str, Any]) -> Dict[str, Any]:
     # Commentary из SD соответствует полю description в нашей модели Workstation
     cleaned_data['description'] = pos_data.get('Commentariy', '')
 
-    cleaned_data['last_modified_date'] = datetime.datetime.strptime(pos_data['lastModifiedDate'], "%Y.%m.%d %H:%M:%S") if pos_data.get('lastModifiedDate') else None
+    cleaned_data['last_modified_date'] = parse_sd_datetime(pos_data['lastModifiedDate']) if pos_data.get('lastModifiedDate') else None
     cleaned_data['owner_id'] = pos_data.get('owner', {}).get('UUID') if pos_data.get('owner') else None
 
-    logger.debug(f"Валидация данных POS UUID {cleaned_data.get('uuid')} завершена.")
+    logger.debug("Валидация данных POS UUID %s завершена.", cleaned_data['uuid'])
     return cleaned_data
 
 # Функция для валидации и очистки данных фискального регистратора (ФР) (синхронная)
@@ -266,7 +336,7 @@ def clearify_fr_data(fr_data: Dict[str, Any]) -> Dict[str, Any]:
     Очищает и валидирует данные фискального регистратора (ФР), полученные из ServiceDesk API.
     Возвращает словарь с данными, готовыми для сохранения в БД (snake_case ключи).
     """
-    logger.debug(f"Начало валидации данных ФР UUID: {fr_data.get('UUID')}")
+    logger.debug("Начало валидации данных ФР UUID: %s", fr_data.get('UUID'))
 
     cleaned_data = {}
 
@@ -293,20 +363,324 @@ def clearify_fr_data(fr_data: Dict[str, Any]) -> Dict[str, Any]:
     kkt_reg_date_str = fr_data.get('KKTRegDate')
     if kkt_reg_date_str:
         try:
-            cleaned_data['kkt_reg_date'] = datetime.datetime.strptime(kkt_reg_date_str, "%Y.%m.%d %H:%M:%S")
-        except ValueError:
-            logger.warning(f"Неверный формат KKTRegDate для ФР {cleaned_data.get('uuid')}: '{kkt_reg_date_str}'.")
+            cleaned_data['kkt_reg_date'] = parse_sd_datetime(kkt_reg_date_str)
+        except (TypeError, ValueError):
+            logger.warning("Неверный формат KKTRegDate для ФР %s: '%s'.", cleaned_data['uuid'], kkt_reg_date_str)
 
     cleaned_data['fn_expire_date'] = None
     fn_expire_date_str = fr_data.get('FNExpireDate')
     if fn_expire_date_str:
          try:
-            cleaned_data['fn_expire_date'] = datetime.datetime.strptime(fn_expire_date_str, "%Y.%m.%d %H:%M:%S")
-         except ValueError:
-            logger.warning(f"Неверный формат FNExpireDate для ФР {cleaned_data.get('uuid')}: '{fn_expire_date_str}'.")
+            cleaned_data['fn_expire_date'] = parse_sd_datetime(fn_expire_date_str)
+         except (TypeError, ValueError):
+            logger.warning("Неверный формат FNExpireDate для ФР %s: '%s'.", cleaned_data['uuid'], fn_expire_date_str)
 
-    cleaned_data['last_modified_date'] = datetime.datetime.strptime(fr_data['lastModifiedDate'], "%Y.%m.%d %H:%M:%S") if fr_data.get('lastModifiedDate') else None
+    cleaned_data['last_modified_date'] = parse_sd_datetime(fr_data['lastModifiedDate']) if fr_data.get('lastModifiedDate') else None
     cleaned_data['owner_id'] = fr_data.get('owner', {}).get('UUID') if fr_data.get('owner') else None
 
-    logger.debug(f"Валидация данных ФР UUID {cleaned_data.get('uuid')} завершена.")
+    logger.debug("Валидация данных ФР UUID %s завершена.", cleaned_data['uuid'])
     return cleaned_data
+
+
+# --- Пакетная (колоночная) валидация для полных пересинхронизаций ---
+# Функции clearify_*_batch принимают список сырых записей SD и возвращают словарь колонок
+# {имя_поля: [значения]} с теми же ключами и значениями, что и clearify_*_data для каждой записи.
+# Частые формы значений (ID удаленного доступа из цифр и пробелов, UniqueID нужного формата,
+# облачный или локальный адрес, ссылка на кабинет с числовым clientId, LiteManager, пустые поля)
+# разбираются прямо в проходе по колонке, без вызова validate_* и его отладочных сообщений,
+# а колонка дат SD проверяется и разбирается целиком.
+# Остальные значения отдаются validate_* один раз на уникальное значение (таблица мемоизации),
+# поэтому предупреждения о неверных форматах пишутся, как и раньше, но без повторов.
+# Записи, на которых clearify_*_data выбросил бы исключение (неверный lastModifiedDate
+# или owner), в результат не попадают.
+
+def _memo_get(func, value: Any, memo: Dict[Any, Any]) -> Any:
+    """func(value) через таблицу мемоизации; нехешируемые значения вычисляются без нее."""
+    try:
+        result = memo.get(value, memo)
+    except TypeError:
+        return func(value)
+    if result is memo:
+        result = memo[value] = func(value)
+    return result
+
+
+def _remote_access_column(values: List[Any], memo: Dict[Any, Any]) -> List[Optional[str]]:
+    """validate_remote_access_id для колонки."""
+    result = []
+    append = result.append
+    for value in values:
+        if value is None:
+            append(None)
+            continue
+        if value.__class__ is str:
+            # 9-10 цифр, возможно разделенных пробелами: регулярка нашла бы их все, пробелы удаляются
+            compact = value.replace(' ', '')
+            if 9 <= len(compact) <= 10 and compact.isascii() and compact.isdigit():
+                append(compact)
+                continue
+        append(_memo_get(validate_remote_access_id, value, memo))
+    return result
+
+
+def _unique_id_column(values: List[Any]) -> List[Optional[str]]:
+    """validate_unique_id для колонки."""
+    memo = {}
+    result = []
+    append = result.append
+    for value in values:
+        # Строка из 11 символов, совпавшая с паттерном, не содержит пробелов по краям
+        if value.__class__ is str and len(value) == 11 and UNIQUE_ID_RE.match(value):
+            append(value)
+        else:
+            append(_memo_get(validate_unique_id, value, memo))
+    return result
+
+
+def _ip_column(values: List[Any]) -> List[Optional[str]]:
+    """validate_ip_address для колонки."""
+    memo = {}
+    result = []
+    append = result.append
+    for value in values:
+        if value.__class__ is str:
+            address = value.strip()
+            # Те же проверки и в том же порядке, что в validate_ip_address
+            if '.iiko.it' in address:
+                match = IIKO_IT_RE.search(address)
+                if match:
+                    append(f"{match.group(3)}:443")
+                    continue
+            if '.syrve.online' in address:
+                match = SYRVE_ONLINE_RE.search(address)
+                if match:
+                    append(f"{match.group(3)}:443")
+                    continue
+            match = LOCAL_IP_PORT_RE.fullmatch(address)
+            if match:
+                ip, port = match.groups()
+                if all(int(segment) <= 255 for segment in ip.split('.')):
+                    append(f"{ip}:{port if port else '8080'}")
+                    continue
+        append(_memo_get(validate_ip_address, value, memo))
+    return result
+
+
+def _cabinet_link_column(links: List[Any], ips: List[Optional[str]]) -> List[str]:
+    """validate_cabinet_link для колонки; тип компании определяется по уже очищенному IP, как determine_company_type_from_ip."""
+    memo = {}
+    result = []
+    append = result.append
+    for link, ip in zip(links, ips):
+        company_type = 'syrve' if ip and 'syrve' in ip.lower() else 'iiko'
+        if link.__class__ is str and '=' in link:
+            client_id = link.rpartition('=')[2].strip()
+            if client_id.isdigit():
+                if company_type == 'syrve':
+                    append(f"https://pp.syrve.com/en/cabinet/client-area/index.html?clientId={client_id}")
+                else:
+                    append(f"https://pp.iiko.ru/ru/cabinet/client-area/index.html?clientId={client_id}")
+                continue
+        append(_memo_get(lambda pair: validate_cabinet_link(*pair), (link, company_type), memo))
+    return result
+
+
+def _litemanager_column(direct_values: List[Any], texts: List[Any]) -> List[Optional[str]]:
+    """extract_litemanager_id для колонки прямых полей litemanagerID и текстов для поиска."""
+    result = []
+    append = result.append
+    for direct, text in zip(direct_values, texts):
+        if direct:
+            stripped = direct.strip() if direct.__class__ is str else None
+            if stripped is not None and LITEMANAGER_RAW_RE.match(stripped):
+                append(stripped)
+            else:
+                # Неверное прямое поле: пусть extract_litemanager_id предупредит о нем
+                append(extract_litemanager_id({'litemanagerID': direct}, text))
+        elif text.__class__ is str and 'MH_' in text:
+            match = LITEMANAGER_RAW_RE.search(text)
+            append(match[0] if match else None)
+        else:
+            append(None)
+    return result
+
+
+def _date_column(values: List[Any]) -> List[Optional[datetime.datetime]]:
+    """
+    parse_sd_datetime для колонки. Если все непустые значения - даты SD из цифр ASCII,
+    колонка проверяется целиком по маске склеенной строки и разбирается fromisoformat
+    через map, как в быстром пути parse_sd_datetime; иначе значения разбираются по одному.
+    """
+    present = [value for value in values if value]
+    parsed = None
+    try:
+        joined = '\n'.join(present) + '\n'
+        # Совпадение маски исключает и другие символы, и переводы строки внутри значений
+        if joined.encode('ascii').translate(SD_DATETIME_DIGITS_MASK) == SD_DATETIME_MASK * len(present):
+            parts = joined.replace('.', '-').split('\n')
+            parts.pop()
+            parsed = list(map(datetime.datetime.fromisoformat, parts))
+    except (TypeError, ValueError): # Не строка, не ASCII или, например, 31 февраля
+        parsed = None
+    if parsed is None:
+        return [parse_sd_datetime(value) if value else None for value in values]
+    if len(parsed) == len(values):
+        return parsed
+    parsed = iter(parsed)
+    return [next(parsed) if value else None for value in values]
+
+
+def _date_column_safe(values: List[Any]) -> List[Optional[datetime.datetime]]:
+    """Как в clearify_fr_data для KKTRegDate/FNExpireDate: неверный формат превращается в None."""
+    try:
+        return _date_column(values)
+    except (TypeError, ValueError):
+        pass
+    result = []
+    for value in values:
+        try:
+            result.append(parse_sd_datetime(value) if value else None)
+        except (TypeError, ValueError):
+            logger.warning("Неверный формат даты ФР: '%s'.", value)
+            result.append(None)
+    return result
+
+
+def _split_valid_records(records: List[Dict[str, Any]], kind: str):
+    """
+    Отбирает записи, которые clearify_*_data обработал бы без исключения.
+    Возвращает (записи, колонку last_modified_date, колонку owner_id).
+    """
+    try:
+        # Обычный случай: все записи корректны, колонки считаются целиком
+        dates = _date_column([record.get('lastModifiedDate') for record in records])
+        owners = [owner.get('UUID') if owner else None for owner in [record.get('owner') for record in records]]
+        return records, dates, owners
+    except (AttributeError, TypeError, ValueError):
+        pass
+
+    # Есть некорректные записи: отбираем по одной
+    valid, dates, owners = [], [], []
+    for record in records:
+        try:
+            owner = record.get('owner')
+            owner_id = owner.get('UUID') if owner else None
+            last_modified_date = parse_sd_datetime(record['lastModifiedDate']) if record.get('lastModifiedDate') else None
+        except (AttributeError, TypeError, ValueError) as e:
+            logger.error("Ошибка пакетной валидации %s UUID %s: %s", kind, record.get('UUID') if isinstance(record, dict) else None, e)
+            continue
+        valid.append(record)
+        dates.append(last_modified_date)
+        owners.append(owner_id)
+    return valid, dates, owners
+
+
+def _raw_columns(records: List[Dict[str, Any]], keys: tuple, empty: tuple = ()) -> List[List[Any]]:
+    """
+    Колонки сырых полей records: для каждого ключа [record.get(key) ...],
+    для ключей из empty - record.get(key, '').
+    """
+    try:
+        # Обычный случай: SD вернул все поля, map с itemgetter проходит по записям без интерпретатора
+        return [list(map(operator.itemgetter(key), records)) for key in keys]
+    except KeyError:
+        return [[record.get(key, '' if key in empty else None) for record in records] for key in keys]
+
+
+def _title_column(values: List[Any]) -> List[Optional[str]]:
+    return [value.get('title') if isinstance(value, dict) else None for value in values]
+
+
+def clearify_server_batch(records: List[Dict[str, Any]]) -> Dict[str, List[Any]]:
+    """Пакетный вариант clearify_server_data. Возвращает колонки очищенных данных серверов."""
+    records, last_modified_dates, owner_ids = _split_valid_records(records, "сервера")
+    (uuids, unique_ids, raw_ips, cabinet_links, teamviewers, rdps, anydesks, litemanager_ids,
+     device_names, iiko_versions, descriptions, names_for_client) = _raw_columns(
+        records,
+        ('UUID', 'UniqueID', 'IP', 'CabinetLink', 'Teamviewer', 'RDP', 'AnyDesk', 'litemanagerID',
+         'DeviceName', 'iikoVersion', 'description', 'nameforclient'),
+        empty=('description', 'nameforclient')
+    )
+    remote_access_memo = {} # Общая для Teamviewer, RDP и AnyDesk
+
+    ips = _ip_column(raw_ips)
+    return {
+        'uuid': uuids,
+        'unique_id': _unique_id_column(unique_ids),
+        'ip': ips,
+        'cabinet_link': _cabinet_link_column(cabinet_links, ips),
+        'teamviewer': _remote_access_column(teamviewers, remote_access_memo),
+        'rdp': _remote_access_column(rdps, remote_access_memo),
+        'anydesk': _remote_access_column(anydesks, remote_access_memo),
+        'litemanager': _litemanager_column(
+            litemanager_ids,
+            [f"{description} {name}" for description, name in zip(descriptions, names_for_client)]
+        ),
+        'device_name': device_names,
+        'iiko_version': iiko_versions,
+        'description': [f"{name} {description}".strip() for name, description in zip(names_for_client, descriptions)],
+        'last_modified_date': last_modified_dates,
+        'owner_id': owner_ids,
+    }
+
+
+def clearify_pos_batch(records: List[Dict[str, Any]]) -> Dict[str, List[Any]]:
+    """Пакетный вариант clearify_pos_data. Возвращает колонки очищенных данных рабочих станций."""
+    records, last_modified_dates, owner_ids = _split_valid_records(records, "POS")
+    uuids, teamviewers, anydesks, litemanager_ids, device_names, comments = _raw_columns(
+        records, ('UUID', 'Teamviewer', 'AnyDesk', 'litemanagerID', 'DeviceName', 'Commentariy'), empty=('Commentariy',)
+    )
+    remote_access_memo = {}
+
+    return {
+        'uuid': uuids,
+        'teamviewer': _remote_access_column(teamviewers, remote_access_memo),
+        'anydesk': _remote_access_column(anydesks, remote_access_memo),
+        # Пустой Commentariy вместо отсутствующего не меняет результат: LiteManager в пустом тексте не ищется
+        'litemanager': _litemanager_column(litemanager_ids, comments),
+        'device_name': device_names,
+        'description': comments,
+        'last_modified_date': last_modified_dates,
+        'owner_id': owner_ids,
+    }
+
+
+def clearify_fr_batch(records: List[Dict[str, Any]]) -> Dict[str, List[Any]]:
+    """Пакетный вариант clearify_fr_data. Возвращает колонки очищенных данных ФР."""
+    records, last_modified_dates, owner_ids = _split_valid_records(records, "ФР")
+    (uuids, models_kkt, ffds, fr_downloaders, rn_kkts, legal_names, fr_serial_numbers, fn_numbers,
+     kkt_reg_dates, fn_expire_dates) = _raw_columns(
+        records,
+        ('UUID', 'ModelKKT', 'FFD', 'FRDownloader', 'RNKKT', 'LegalName', 'FRSerialNumber', 'FNNumber',
+         'KKTRegDate', 'FNExpireDate')
+    )
+
+    return {
+        'uuid': uuids,
+        'model_kkt': _title_column(models_kkt),
+        'ffd': _title_column(ffds),
+        'fr_downloader': fr_downloaders,
+        'rn_kkt': rn_kkts,
+        'legal_name': legal_names,
+        'fr_serial_number': fr_serial_numbers,
+        'fn_number': fn_numbers,
+        'kkt_reg_date': _date_column_safe(kkt_reg_dates),
+        'fn_expire_date': _date_column_safe(fn_expire_dates),
+        'last_modified_date': last_modified_dates,
+        'owner_id': owner_ids,
+    }
+
+
+# Пакетные валидаторы по метаклассам SD
+BATCH_VALIDATORS = {
+    'objectBase$Server': clearify_server_batch,
+    'objectBase$Workstation': clearify_pos_batch,
+    'objectBase$FR': clearify_fr_batch,
+}
+
+
+def rows_from_columns(columns: Dict[str, List[Any]]) -> List[Dict[str, Any]]:
+    """Преобразует результат clearify_*_batch обратно в список словарей, как у clearify_*_data."""
+    names = list(columns.keys())
+    # map вместо генератора списка: строки собираются без шага интерпретатора на каждую
+    return list(map(dict, map(zip, itertools.repeat(names), zip(*columns.values()))))
@@ -1,8 +1,122 @@
+import atexit
+import datetime
+import json
 import logging
+import logging.handlers
 import os
-from datetime import datetime
+import queue
+import re
+import time
+from typing import Dict, Optional
 
-def setup_logger(console_logging=True):
+# Настройки логгирования (переменные окружения):
+# LOG_DIR              - каталог логов (logs)
+# LOG_FILE             - имя файла лога; по умолчанию <log_name>.log, где log_name передает процесс (app, sync_runner)
+# LOG_LEVEL            - уровень корневого логгера (DEBUG)
+# LOG_LEVELS           - уровни отдельных логгеров: "ServiceDeskLogger=INFO,sqlalchemy.engine=WARNING"
+# LOG_FORMAT           - text или json (одна JSON-запись в строке)
+# LOG_ROTATE_WHEN      - ротация по времени (midnight, H, D, W0...); если не задано - ротация по размеру
+# LOG_MAX_BYTES        - размер файла для ротации по размеру (50 МБ)
+# LOG_BACKUP_COUNT     - сколько ротированных файлов хранить (14)
+# LOG_RETENTION_DAYS   - через сколько дней удалять старые логи формата "дата_время.log" (14)
+# CONSOLE_LOG_LEVEL    - уровень вывода в консоль (ERROR)
+# DISABLE_FILE_LOGGING - "1" полностью отключает логгирование
+
+TEXT_FORMAT = '%(asctime)s.%(msecs)04d - %(levelname)s - %(module)s - %(message)s'
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+# Соединения httpcore на уровне DEBUG пишут несколько строк на каждый запрос к SD
+DEFAULT_LOG_LEVELS = "httpcore=INFO"
+# Логи, которые создавались до ротации: новый файл на каждый запуск процесса
+LEGACY_LOG_NAME_RE = re.compile(r"^\d{4}-\d{2}-\d{2}_\d{2}-\d{2}-\d{2}\.log$")
+
+# Атрибуты LogRecord, которые не переносятся в JSON как дополнительные поля
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime", "taskName"}
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+class JsonFormatter(logging.Formatter):
+    """Форматирует запись в одну строку JSON. Поля из extra=... попадают в запись как есть."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            'time': datetime.datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'module': record.module,
+            'process': record.process,
+            'message': record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS and not key.startswith('_'):
+                data[key] = value
+        if record.exc_info:
+            data['exc_info'] = self.formatException(record.exc_info)
+        if record.stack_info:
+            data['stack_info'] = self.formatStack(record.stack_info)
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class LoopQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler для очереди внутри процесса. Стандартный prepare форматирует и копирует запись
+    в вызывающем потоке; здесь запись не сериализуется, поэтому в event loop только подставляются
+    аргументы (чтобы изменяемые объекты не поменялись до записи), остальное делает QueueListener.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        if record.args:
+            record.msg = record.getMessage()
+            record.args = None
+        return record
+
+
+def parse_log_levels(value: Optional[str]) -> Dict[str, str]:
+    """Разбирает строку вида "logger=LEVEL,logger2=LEVEL" в словарь. Некорректные элементы пропускаются."""
+    levels = {}
+    for item in (value or "").split(','):
+        name, _, level = item.partition('=')
+        name, level = name.strip(), level.strip().upper()
+        if name and level in logging.getLevelNamesMapping():
+            levels[name] = level
+    return levels
+
+
+def _build_formatter() -> logging.Formatter:
+    if os.getenv("LOG_FORMAT", "text").lower() == "json":
+        return JsonFormatter()
+    return logging.Formatter(TEXT_FORMAT, datefmt=DATE_FORMAT)
+
+
+def _build_file_handler(log_dir: str, log_name: str) -> logging.Handler:
+    log_filepath = os.path.join(log_dir, os.getenv("LOG_FILE", f"{log_name}.log"))
+    backup_count = int(os.getenv("LOG_BACKUP_COUNT", "14"))
+    rotate_when = os.getenv("LOG_ROTATE_WHEN")
+    if rotate_when:
+        return logging.handlers.TimedRotatingFileHandler(log_filepath, when=rotate_when, backupCount=backup_count, encoding='utf-8')
+    max_bytes = int(os.getenv("LOG_MAX_BYTES", str(50 * 1024 * 1024)))
+    return logging.handlers.RotatingFileHandler(log_filepath, maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8')
+
+
+def _remove_legacy_logs(log_dir: str, retention_days: float):
+    """Удаляет логи старого формата (файл на каждый запуск), которые старше retention_days."""
+    deadline = time.time() - retention_days * 86400
+    for name in os.listdir(log_dir):
+        path = os.path.join(log_dir, name)
+        try:
+            if LEGACY_LOG_NAME_RE.match(name) and os.path.getmtime(path) < deadline:
+                os.remove(path)
+        except OSError:
+            pass
+
+
+def setup_logger(console_logging=True, log_name: str = "servicedesk"):
+    """
+    Настраивает корневой логгер: записи через очередь передаются фоновому потоку
+    (QueueListener), который форматирует их и пишет в файл с ротацией и в консоль.
+    Вызывающий код (event loop) только кладет запись в очередь.
+    """
+    global _listener
     if len(logging.getLogger().handlers) > 0:
         # Логгер уже настроен, выходим
         return
@@ -11,36 +125,57 @@ def setup_logger(console_logging=True):
     if os.getenv("DISABLE_FILE_LOGGING") == "1":
         # Полное отключение логирования
         logging.disable(logging.CRITICAL)
-    else:
-        # Получаем текущее время для имени файла лога
-        log_filename = datetime.now().strftime("%Y-%m-%d_%H-%M-%S.log")
+        return
+
+    # Создаем директорию для логов, если ее еще нет
+    log_dir = os.getenv("LOG_DIR", "logs")
+    os.makedirs(log_dir, exist_ok=True)
+    _remove_legacy_logs(log_dir, float(os.getenv("LOG_RETENTION_DAYS", "14")))
+
+    formatter = _build_formatter()
+    handlers = []
+
+    # Обработчик для записи лога в файл с ротацией. Уровни фильтруются на логгерах.
+    file_handler = _build_file_handler(log_dir, log_name)
+    file_handler.setFormatter(formatter)
+    handlers.append(file_handler)
+
+    # Обработчик для вывода лога в консоль
+    if console_logging:
+        console_handler = logging.StreamHandler()
+        console_handler.setLevel(os.getenv("CONSOLE_LOG_LEVEL", "ERROR").upper())
+        console_handler.setFormatter(formatter)
+        handlers.append(console_handler)
 
-        # Создаем директорию для логов, если ее еще нет
-        log_dir = "logs"
-        if not os.path.exists(log_dir):
-            os.makedirs(log_dir)
+    # Очередь без ограничения: при всплеске записей не теряем их и не блокируем event loop
+    log_queue = queue.SimpleQueue()
+    _listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    atexit.register(shutdown_logging)
 
-        log_filepath = os.path.join(log_dir, log_filename)
+    logger = logging.getLogger()
+    logger.setLevel(os.getenv("LOG_LEVEL", "DEBUG").upper())
+    logger.addHandler(LoopQueueHandler(log_queue))
 
-        # Настраиваем логгер
-        logger = logging.getLogger()
-        logger.setLevel(logging.DEBUG)
+    levels = parse_log_levels(DEFAULT_LOG_LEVELS)
+    levels.update(parse_log_levels(os.getenv("LOG_LEVELS")))
+    for name, level in levels.items():
+        logging.getLogger(name).setLevel(level)
 
-        # Создаем форматтер
-        formatter = logging.Formatter('%(asctime)s.%(msecs)04d - %(levelname)s - %(module)s - %(message)s', datefmt='%Y-%m-%d %H:%M:%S')
 
-        # Создаем обработчик для записи лога в файл
-        file_handler = logging.FileHandler(log_filepath, encoding='utf-8')
-        file_handler.setLevel(logging.DEBUG)
-        file_handler.setFormatter(formatter)
-        logger.addHandler(file_handler)
+def shutdown_logging():
+    """Дописывает записи из очереди, останавливает фоновый поток и снимает обработчики корневого логгера."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        if isinstance(handler, logging.handlers.QueueHandler):
+            root.removeHandler(handler)
 
-        # Создаем обработчик для вывода лога в консоль
-        if console_logging:
-            console_handler = logging.StreamHandler()
-            console_handler.setLevel(logging.ERROR)
-            console_handler.setFormatter(formatter)
-            logger.addHandler(console_handler)
 
 # Пример использования логгера
 if __name__ == "__main__":
@@ -50,4 +185,4 @@ if __name__ == "__main__":
     logger.debug("Это сообщение для отладки.")
     logger.warning("Это предупреждающее сообщение.")
     logger.error("Это сообщение об ошибке.")
-    logger.critical("Это критическое сообщение.")
\ No newline at end of file
+    logger.critical("Это критическое сообщение.")
@@ -0,0 +1,215 @@
+import asyncio
+import bisect
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger("ServiceDeskLogger")
+
+# Метрики в текстовом формате Prometheus (exposition format 0.0.4).
+# Своя легкая реализация: счетчики, gauge и гистограммы с метками, без внешних зависимостей.
+# Метрики живут в памяти процесса: API отдает их на /metrics, воркер синхронизации -
+# на отдельном порту (см. start_metrics_server).
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Границы корзин по умолчанию (секунды): от быстрых запросов к БД до долгих запросов к SD
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+# Для длительности синхронизации целиком
+SYNC_DURATION_BUCKETS = (10.0, 30.0, 60.0, 120.0, 300.0, 600.0, 1200.0, 1800.0, 3600.0, 7200.0)
+
+_registry: List["_Metric"] = []
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(f'{extra[0]}="{extra[1]}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    metric_type = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"Метрика {self.name} ожидает метки {self.labelnames}, переданы {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.metric_type}"]
+        lines.extend(self._samples())
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    """Монотонно растущий счетчик."""
+    metric_type = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}" for key, value in items]
+
+
+class Gauge(_Metric):
+    """Значение, которое может как расти, так и уменьшаться."""
+    metric_type = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}" for key, value in items]
+
+
+class Histogram(_Metric):
+    """Гистограмма с кумулятивными корзинами, суммой и количеством наблюдений."""
+    metric_type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # {метки: [счетчики по корзинам (последняя - +Inf), сумма]}
+        self._values: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            state[0][index] += 1
+            state[1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        """Контекстный менеджер: наблюдает длительность блока в секундах."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = [(key, list(counts), total) for key, (counts, total) in self._values.items()]
+        lines = []
+        for key, counts, total in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, ('le', _format_value(bound)))} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+
+def render() -> str:
+    """Все метрики процесса в текстовом формате Prometheus."""
+    return "\n".join(metric.render() for metric in _registry) + "\n"
+
+
+async def start_metrics_server(port: int, host: str = "0.0.0.0") -> asyncio.AbstractServer:
+    """
+    Минимальный HTTP-сервер, отдающий render() на любой GET.
+    Нужен процессам без FastAPI (воркер синхронизации), чтобы Prometheus мог их опрашивать.
+    """
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            # Читаем заголовки запроса до пустой строки, тело не ожидается
+            while (await reader.readline()).strip():
+                pass
+            body = render().encode('utf-8')
+            writer.write(
+                b"HTTP/1.1 200 OK\r\n"
+                + f"Content-Type: {CONTENT_TYPE}\r\nContent-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode('ascii')
+                + body
+            )
+            await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError) as e:
+            logger.debug(f"Ошибка соединения при отдаче метрик: {e}")
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(handle, host, port)
+    logger.info(f"Метрики доступны на http://{host}:{port}/metrics")
+    return server
+
+
+# --- Метрики приложения ---
+
+SEARCH_REQUEST_SECONDS = Histogram(
+    "search_request_duration_seconds", "Длительность обработки /api/search целиком"
+)
+SEARCH_CATEGORY_SECONDS = Histogram(
+    "search_category_duration_seconds", "Длительность поиска по одной категории сущностей", ["category"]
+)
+SD_REQUEST_SECONDS = Histogram(
+    "sd_request_duration_seconds", "Длительность запроса к API ServiceDesk (одна попытка)", ["operation"]
+)
+SD_REQUESTS = Counter(
+    "sd_requests_total", "Запросы к API ServiceDesk по операциям и статусам ответа", ["operation", "status"]
+)
+SD_LIMITER_WAIT_SECONDS = Histogram(
+    "sd_limiter_wait_seconds", "Ожидание разрешения адаптивного ограничителя перед запросом к SD",
+    buckets=(0.001, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+)
+SD_LIMITER_RATE = Gauge(
+    "sd_limiter_rate", "Текущая частота запросов к SD, разрешенная ограничителем (запросов/сек)"
+)
+DB_COMMIT_SECONDS = Histogram(
+    "db_commit_duration_seconds", "Длительность коммита сохранения сущности", ["meta_class"]
+)
+DB_TOUCHED_ROWS = Counter(
+    "db_touched_rows_total", "Строки, у которых массово обновлена только дата изменения", ["table"]
+)
+SYNC_ENTITIES = Counter(
+    "sync_entities_total", "Сущности, обработанные синхронизацией, по метаклассам и результату", ["meta_class", "result"]
+)
+SYNC_DURATION_SECONDS = Histogram(
+    "sync_duration_seconds", "Длительность полной синхронизации", buckets=SYNC_DURATION_BUCKETS
+)
+SYNC_LAST_SUCCESS = Gauge(
+    "sync_last_success_timestamp_seconds", "Время окончания последней успешной синхронизации (unix time)"
+)
@@ -0,0 +1,333 @@
+import argparse
+import asyncio
+import datetime
+import logging
+import time
+from typing import Awaitable, Callable, Dict, List, Sequence, Tuple
+
+from sqlalchemy import Column, DateTime, Float, Integer, MetaData, String, Table, inspect, insert, select, text
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine
+
+from models import Base, SdPayload, SdRateBudget, SyncCheckpoint, SyncEvent, SyncPartition, engine
+
+logger = logging.getLogger("ServiceDeskLogger")
+
+# Миграции схемы БД.
+# Base.metadata.create_all создает только отсутствующие таблицы и не трогает существующие:
+# новые колонки и индексы на работающей БД не появляются. Поэтому изменения схемы
+# оформляются миграциями с номером версии; примененные версии хранятся в schema_migrations.
+#
+# Правила для новых миграций:
+#   - миграция должна быть идемпотентной (IF NOT EXISTS, проверка колонок), она может
+#     выполниться на БД, где объект уже создан через create_all;
+#   - индексы на существующих таблицах создаются через create_index (CONCURRENTLY в PostgreSQL),
+#     чтобы не блокировать запись синхронизации и чтение поиска;
+#   - то же изменение отражается в models.py, чтобы новая БД сразу получала актуальную схему;
+#   - миграции, меняющие данные или ключи, объявляются транзакционными: выполняются в одной
+#     транзакции вместе с записью в schema_migrations и откатываются целиком при ошибке.
+#
+# Миграции выполняются при старте API и воркера синхронизации (под advisory lock, поэтому
+# процессы не применяют их одновременно) или вручную: python migrations.py [--status]
+
+# Ключ advisory lock, под которым применяются миграции
+MIGRATIONS_LOCK_KEY = 774_201_001
+# Пауза между попытками взять advisory lock, сек.
+# Блокирующий pg_advisory_lock нельзя: ожидающий процесс держит снимок, а CREATE INDEX CONCURRENTLY
+# у владельца блокировки ждет завершения всех снимков - взаимная блокировка
+MIGRATIONS_LOCK_POLL = 0.5
+
+_migrations_metadata = MetaData()
+schema_migrations = Table(
+    'schema_migrations', _migrations_metadata,
+    Column('version', Integer, primary_key=True),
+    Column('description', String, nullable=False),
+    Column('applied_at', DateTime, nullable=False),
+    Column('duration_seconds', Float, nullable=True),
+)
+
+
+def _add_missing_columns(connection, columns: Sequence[Tuple[str, str, str]]):
+    """Добавляет колонки (таблица, колонка, тип), которых еще нет. Для run_sync."""
+    inspector = inspect(connection)
+    for table, column, column_type in columns:
+        existing = {info['name'] for info in inspector.get_columns(table)}
+        if column not in existing:
+            connection.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {column_type}"))
+            logger.info(f"Миграция: добавлена колонка {table}.{column}.")
+
+
+async def create_index(conn: AsyncConnection, name: str, table: str, columns: Sequence[str]):
+    """
+    Создает индекс, если его нет. В PostgreSQL - CREATE INDEX CONCURRENTLY (без блокировки записи);
+    невалидный индекс, оставшийся от прерванного построения, пересоздается.
+    conn должен работать в режиме AUTOCOMMIT: CONCURRENTLY нельзя выполнять в транзакции.
+    """
+    column_list = ", ".join(columns)
+    if conn.dialect.name != 'postgresql':
+        await conn.execute(text(f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({column_list})"))
+        return
+
+    invalid = (await conn.execute(
+        text("SELECT NOT i.indisvalid FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid "
+             "WHERE c.relname = :name AND pg_table_is_visible(c.oid)"),
+        {'name': name}
+    )).scalar()
+    if invalid:
+        logger.warning(f"Миграция: индекс {name} невалиден (прерванное построение), пересоздаем.")
+        await conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+    started = time.monotonic()
+    await conn.execute(text(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {table} ({column_list})"))
+    logger.info(f"Миграция: индекс {name} на {table}({column_list}) готов за {time.monotonic() - started:.1f}с.")
+
+
+# --- Миграции ---
+
+async def _baseline(conn: AsyncConnection):
+    """Таблицы моделей и колонки content_hash, которые раньше добавлялись SCHEMA_PATCHES."""
+    await conn.run_sync(Base.metadata.create_all)
+    await conn.run_sync(_add_missing_columns, [
+        ('companies', 'content_hash', 'VARCHAR'),
+        ('servers', 'content_hash', 'VARCHAR'),
+        ('workstations', 'content_hash', 'VARCHAR'),
+        ('fiscal_registers', 'content_hash', 'VARCHAR'),
+    ])
+
+
+# Имена совпадают с теми, что SQLAlchemy дает индексам index=True в models.py
+LOOKUP_INDEXES = [
+    # Поиск (JOIN оборудования с компанией), get_company_details, get_by_owner_uuid
+    ('ix_servers_owner_id', 'servers', ['owner_id']),
+    ('ix_workstations_owner_id', 'workstations', ['owner_id']),
+    ('ix_fiscal_registers_owner_id', 'fiscal_registers', ['owner_id']),
+    # Загрузка иерархии компаний: children и компании верхнего уровня
+    ('ix_companies_parent_uuid', 'companies', ['parent_uuid']),
+    # Выборки изменений по дате
+    ('ix_companies_last_modified_date', 'companies', ['last_modified_date']),
+    ('ix_servers_last_modified_date', 'servers', ['last_modified_date']),
+    ('ix_workstations_last_modified_date', 'workstations', ['last_modified_date']),
+    ('ix_fiscal_registers_last_modified_date', 'fiscal_registers', ['last_modified_date']),
+]
+
+
+async def _lookup_indexes(conn: AsyncConnection):
+    for name, table, columns in LOOKUP_INDEXES:
+        await create_index(conn, name, table, columns)
+
+
+# Таблицы сущностей SD; companies первой, на нее ссылаются остальные
+ENTITY_TABLES = ['companies', 'servers', 'workstations', 'fiscal_registers']
+# FK на companies.uuid: (таблица, колонка)
+COMPANY_FOREIGN_KEYS = [
+    ('companies', 'parent_uuid'),
+    ('servers', 'owner_id'),
+    ('workstations', 'owner_id'),
+    ('fiscal_registers', 'owner_id'),
+]
+
+
+def _inspect_entity_keys(connection) -> Dict[str, Dict]:
+    """Для каждой таблицы сущностей: есть ли колонка id, уникальные ограничения на uuid, FK на companies."""
+    inspector = inspect(connection)
+    info = {}
+    for table in ENTITY_TABLES:
+        info[table] = {
+            'has_id': 'id' in {column['name'] for column in inspector.get_columns(table)},
+            'uuid_unique': [item['name'] for item in inspector.get_unique_constraints(table) if item['column_names'] == ['uuid'] and item['name']],
+            'company_fks': [item['name'] for item in inspector.get_foreign_keys(table) if item['referred_table'] == 'companies' and item['name']],
+        }
+    return info
+
+
+async def _uuid_primary_keys(conn: AsyncConnection):
+    """
+    UUID из SD становится первичным ключом, суррогатная колонка id удаляется.
+    Строки без uuid (на них не могли ссылаться FK, синхронизация их не создает) удаляются.
+    В PostgreSQL DROP COLUMN не переписывает таблицу: место id освобождает VACUUM FULL
+    (см. benchmarks/schema_footprint.py).
+    """
+    info = await conn.run_sync(_inspect_entity_keys)
+    if not any(table_info['has_id'] for table_info in info.values()):
+        return
+    if conn.dialect.name != 'postgresql':
+        await _rebuild_entity_tables(conn)
+        return
+
+    # FK опираются на уникальное ограничение companies.uuid, которое заменяется первичным ключом
+    for table in ENTITY_TABLES:
+        for name in info[table]['company_fks']:
+            await conn.execute(text(f"ALTER TABLE {table} DROP CONSTRAINT {name}"))
+    for table in ENTITY_TABLES:
+        if not info[table]['has_id']:
+            continue
+        deleted = (await conn.execute(text(f"DELETE FROM {table} WHERE uuid IS NULL"))).rowcount
+        if deleted:
+            logger.warning(f"Миграция: из {table} удалено {deleted} строк без uuid.")
+        # Первичный ключ по id удаляется вместе с колонкой
+        await conn.execute(text(f"ALTER TABLE {table} DROP COLUMN id"))
+        for name in info[table]['uuid_unique']:
+            await conn.execute(text(f"ALTER TABLE {table} DROP CONSTRAINT {name}"))
+        await conn.execute(text(f"ALTER TABLE {table} ADD PRIMARY KEY (uuid)"))
+        logger.info(f"Миграция: первичный ключ {table} - uuid.")
+    for table, column in COMPANY_FOREIGN_KEYS:
+        await conn.execute(text(
+            f"ALTER TABLE {table} ADD CONSTRAINT {table}_{column}_fkey FOREIGN KEY ({column}) REFERENCES companies (uuid)"
+        ))
+
+
+async def _rebuild_entity_tables(conn: AsyncConnection):
+    """
+    SQLite (локальные прогоны, бенчмарки) не умеет менять первичный ключ:
+    таблицы сущностей пересоздаются по моделям с копированием данных.
+    """
+    # Имена индексов в SQLite общие для всей БД, новым таблицам нужны те же имена
+    for name, _, _ in LOOKUP_INDEXES:
+        await conn.execute(text(f"DROP INDEX IF EXISTS {name}"))
+    for table in ENTITY_TABLES:
+        await conn.execute(text(f"ALTER TABLE {table} RENAME TO {table}_old"))
+    await conn.run_sync(Base.metadata.create_all, tables=[Base.metadata.tables[table] for table in ENTITY_TABLES])
+    for table in ENTITY_TABLES:
+        columns = ", ".join(column.name for column in Base.metadata.tables[table].columns)
+        await conn.execute(text(f"INSERT INTO {table} ({columns}) SELECT {columns} FROM {table}_old WHERE uuid IS NOT NULL"))
+    for table in reversed(ENTITY_TABLES):
+        await conn.execute(text(f"DROP TABLE {table}_old"))
+    logger.info("Миграция: таблицы сущностей пересозданы с первичным ключом uuid.")
+
+
+async def _deferrable_company_foreign_keys(conn: AsyncConnection):
+    """
+    FK на companies.uuid становятся DEFERRABLE INITIALLY IMMEDIATE: обычные транзакции проверяются
+    как раньше, а массовая загрузка (bulk_load.py) откладывает проверку до коммита.
+    В SQLite FK не проверяются (PRAGMA foreign_keys выключен), миграция ничего не делает.
+    """
+    if conn.dialect.name != 'postgresql':
+        return
+    info = await conn.run_sync(_inspect_entity_keys)
+    for table in ENTITY_TABLES:
+        for name in info[table]['company_fks']:
+            await conn.execute(text(f"ALTER TABLE {table} ALTER CONSTRAINT {name} DEFERRABLE INITIALLY IMMEDIATE"))
+    logger.info("Миграция: FK на companies объявлены DEFERRABLE.")
+
+
+async def _sync_checkpoints(conn: AsyncConnection):
+    """Таблица контрольных точек синхронизации (sync_checkpoint.py)."""
+    await conn.run_sync(Base.metadata.create_all, tables=[SyncCheckpoint.__table__])
+
+
+async def _sync_partitions(conn: AsyncConnection):
+    """Части запуска для нескольких воркеров, общий бюджет запросов к SD и корзины в контрольной точке."""
+    await conn.run_sync(Base.metadata.create_all, tables=[SyncPartition.__table__, SdRateBudget.__table__])
+    await conn.run_sync(_add_missing_columns, [('sync_checkpoints', 'bucket', 'INTEGER NOT NULL DEFAULT 0')])
+    await create_index(conn, 'ix_sync_checkpoints_run_id_bucket', 'sync_checkpoints', ['run_id', 'bucket'])
+
+
+async def _sync_events(conn: AsyncConnection):
+    """Очередь уведомлений SD об изменении сущностей (sync_events.py)."""
+    await conn.run_sync(Base.metadata.create_all, tables=[SyncEvent.__table__])
+
+
+
+async def _sd_payloads(conn: AsyncConnection):
+    """Архив сырых ответов SD для повторной очистки данных (sd_archive.py)."""
+    await conn.run_sync(Base.metadata.create_all, tables=[SdPayload.__table__])
+
+
+# (версия, описание, функция, транзакционная). Версии только добавляются в конец и никогда не меняются.
+# Нетранзакционные миграции выполняются в режиме AUTOCOMMIT (нужно для CREATE INDEX CONCURRENTLY).
+MIGRATIONS: List[Tuple[int, str, Callable[[AsyncConnection], Awaitable[None]], bool]] = [
+    (1, "Базовая схема: таблицы моделей и колонки content_hash", _baseline, True),
+    (2, "Индексы по owner_id, parent_uuid и last_modified_date", _lookup_indexes, False),
+    (3, "UUID из SD - первичный ключ сущностей, без суррогатного id", _uuid_primary_keys, True),
+    (4, "Отложенная проверка FK на companies для массовой загрузки", _deferrable_company_foreign_keys, True),
+    (5, "Контрольные точки синхронизации", _sync_checkpoints, True),
+    (6, "Синхронизация несколькими воркерами: части запуска и общий бюджет запросов", _sync_partitions, False),
+    (7, "Уведомления SD об изменении сущностей", _sync_events, True),
+    (8, "Архив сырых ответов SD", _sd_payloads, True),
+]
+
+
+async def applied_versions(conn: AsyncConnection, create_table: bool = True) -> List[int]:
+    """Версии из schema_migrations. Без create_table на новой БД возвращает пустой список."""
+    if create_table:
+        await conn.run_sync(_migrations_metadata.create_all)
+    elif not await conn.run_sync(lambda sync_conn: inspect(sync_conn).has_table('schema_migrations')):
+        return []
+    return list((await conn.execute(select(schema_migrations.c.version).order_by(schema_migrations.c.version))).scalars())
+
+
+async def _record_migration(conn: AsyncConnection, version: int, description: str, started: float):
+    await conn.execute(insert(schema_migrations).values(
+        version=version, description=description,
+        applied_at=datetime.datetime.utcnow(), duration_seconds=round(time.monotonic() - started, 3)
+    ))
+
+
+async def _acquire_migrations_lock(conn: AsyncConnection):
+    """Берет advisory lock миграций, опрашивая pg_try_advisory_lock: между попытками снимок не держится."""
+    waiting_since = None
+    while not (await conn.execute(text("SELECT pg_try_advisory_lock(:key)"), {'key': MIGRATIONS_LOCK_KEY})).scalar():
+        if waiting_since is None:
+            waiting_since = time.monotonic()
+            logger.info("Миграции применяет другой процесс, ожидание блокировки...")
+        await asyncio.sleep(MIGRATIONS_LOCK_POLL)
+    if waiting_since is not None:
+        logger.info(f"Блокировка миграций получена через {time.monotonic() - waiting_since:.1f}с.")
+
+
+async def run_migrations(db_engine: AsyncEngine = engine) -> List[int]:
+    """
+    Применяет еще не примененные миграции по порядку. Возвращает список примененных сейчас версий.
+    Ошибка миграции пробрасывается: запускать приложение на неполной схеме нельзя.
+    """
+    applied_now = []
+    async with db_engine.connect() as conn:
+        conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+        use_lock = conn.dialect.name == 'postgresql'
+        if use_lock:
+            await _acquire_migrations_lock(conn)
+        try:
+            applied = set(await applied_versions(conn))
+            for version, description, migrate, transactional in MIGRATIONS:
+                if version in applied:
+                    continue
+                logger.info(f"Применение миграции {version}: {description}")
+                started = time.monotonic()
+                if transactional:
+                    async with db_engine.begin() as tx_conn:
+                        await migrate(tx_conn)
+                        await _record_migration(tx_conn, version, description, started)
+                else:
+                    await migrate(conn)
+                    await _record_migration(conn, version, description, started)
+                duration = round(time.monotonic() - started, 3)
+                applied_now.append(version)
+                logger.info(f"Миграция {version} применена за {duration}с.")
+        finally:
+            if use_lock:
+                await conn.execute(text("SELECT pg_advisory_unlock(:key)"), {'key': MIGRATIONS_LOCK_KEY})
+    if not applied_now:
+        logger.info("Схема БД актуальна, новых миграций нет.")
+    return applied_now
+
+
+if __name__ == "__main__":
+    from log import setup_logger
+
+    parser = argparse.ArgumentParser(description="Миграции схемы БД")
+    parser.add_argument("--status", action="store_true", help="Показать примененные и ожидающие миграции, ничего не меняя")
+    args = parser.parse_args()
+    setup_logger(console_logging=True, log_name="migrations")
+
+    async def main():
+        try:
+            if args.status:
+                async with engine.connect() as conn:
+                    applied = set(await applied_versions(conn, create_table=False))
+                for version, description, _, _ in MIGRATIONS:
+                    print(f"{version:>4} {'применена' if version in applied else 'ожидает':<10} {description}")
+            else:
+                versions = await run_migrations()
+                print(f"Применены миграции: {versions}" if versions else "Новых миграций нет.")
+        finally:
+            await engine.dispose()
+
+    asyncio.run(main())
@@ -0,0 +1,227 @@
+import asyncio
+import datetime
+import logging
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger("ServiceDeskLogger")
+
+# Семплирующий профилировщик для кода на asyncio, без внешних зависимостей.
+# Фоновый поток раз в PROFILE_INTERVAL секунд снимает стек потока event loop и складывает
+# стеки в формате "folded" (строка "корень;...;функция количество"), который понимают
+# flamegraph.pl, inferno и speedscope.
+#
+# Учет asyncio:
+#   - если в момент замера выполняется корутина, записывается ее стек (CPU);
+#   - если event loop ждет в select, записываются цепочки await ожидающих задач под корнем
+#     "<await>", поэтому видно, где задачи ждут: ответ SD, ограничитель запросов, БД;
+#   - при профилировании одной задачи (поиск) учитывается только она: ее стек, когда она
+#     выполняется, и ее цепочка await, когда она ждет.
+# Под корнем "<await>" в режиме всего event loop счетчик - это "задача-замеры": одновременно
+# ожидающие задачи дают по замеру каждая (не более PROFILE_MAX_TASKS задач на замер).
+#
+# Переменные окружения:
+# PROFILE_SYNC               - "1" профилировать каждую синхронизацию (или sync_runner.py --profile)
+# PROFILE_SEARCH             - "1" профилировать запросы /api/search
+# PROFILE_SEARCH_MIN_SECONDS - сохранять профиль поиска, только если запрос шел не меньше (0.5)
+# PROFILE_INTERVAL           - интервал между замерами, сек (0.005)
+# PROFILE_MAX_TASKS          - сколько ожидающих задач учитывать в одном замере (200)
+# PROFILE_DIR                - каталог для файлов *.folded (profiles)
+PROFILE_SYNC = os.getenv("PROFILE_SYNC") == "1"
+PROFILE_SEARCH = os.getenv("PROFILE_SEARCH") == "1"
+PROFILE_SEARCH_MIN_SECONDS = float(os.getenv("PROFILE_SEARCH_MIN_SECONDS", "0.5"))
+PROFILE_INTERVAL = float(os.getenv("PROFILE_INTERVAL", "0.005"))
+PROFILE_MAX_TASKS = int(os.getenv("PROFILE_MAX_TASKS", "200"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+
+AWAIT_ROOT = "<await>"
+EVENT_LOOP_ROOT = "<event loop>"
+IDLE_ROOT = "<idle>"
+
+_CO_COROUTINE = 0x80  # inspect.CO_COROUTINE
+
+# Элемент стека: объект кода функции или готовая метка (тип ожидаемого Future и т.п.)
+StackItem = object
+
+
+def _label(item: StackItem, cache: Dict[object, str]) -> str:
+    label = cache.get(item)
+    if label is None:
+        if isinstance(item, str):
+            label = item
+        else:
+            name = getattr(item, 'co_qualname', item.co_name)
+            label = f"{name} ({os.path.basename(item.co_filename)})"
+        # ";" разделяет кадры в формате folded
+        label = cache[item] = label.replace(';', ':')
+    return label
+
+
+def _thread_stack(frame) -> List:
+    """Кадры потока от внешнего к внутреннему."""
+    frames = []
+    while frame is not None:
+        frames.append(frame)
+        frame = frame.f_back
+    frames.reverse()
+    return frames
+
+
+def _await_stack(coro) -> List[StackItem]:
+    """Цепочка await приостановленной корутины: от корутины задачи до ожидаемого Future."""
+    stack = []
+    while coro is not None:
+        frame = getattr(coro, 'cr_frame', None) or getattr(coro, 'gi_frame', None)
+        if frame is None:
+            # Дошли до Future/Task, которого ждет цепочка
+            name = type(coro).__name__
+            # await на Future в C-реализации asyncio виден как FutureIter
+            stack.append("<Future>" if name == 'FutureIter' else f"<{name}>")
+            break
+        stack.append(frame.f_code)
+        coro = getattr(coro, 'cr_await', None) or getattr(coro, 'gi_yieldfrom', None)
+    return stack
+
+
+class SamplingProfiler:
+    """
+    Семплирует поток event loop из фонового потока. start() вызывается из event loop.
+    Если передана task, профилируется только эта задача, иначе весь event loop.
+    """
+
+    def __init__(self, interval: float = PROFILE_INTERVAL, max_tasks: int = PROFILE_MAX_TASKS):
+        self.interval = interval
+        self.max_tasks = max_tasks
+        self.samples: Counter = Counter()
+        self.sample_count = 0
+        self.started_at: Optional[float] = None
+        self.duration = 0.0
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._task: Optional[asyncio.Task] = None
+        self._thread_id: Optional[int] = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self, task: Optional[asyncio.Task] = None):
+        self._loop = asyncio.get_running_loop()
+        self._task = task
+        self._thread_id = threading.get_ident()
+        self.started_at = time.perf_counter()
+        self._thread = threading.Thread(target=self._run, name="SamplingProfiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self.started_at is not None:
+            self.duration = time.perf_counter() - self.started_at
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self._sample()
+            except Exception as e:
+                # Стек меняется во время обхода; один неудачный замер не важен
+                logger.debug(f"Пропущен замер профилировщика: {e}")
+
+    def _sample(self):
+        frame = sys._current_frames().get(self._thread_id)
+        if frame is None:
+            return
+        frames = _thread_stack(frame)
+        self.sample_count += 1
+
+        if self._task is not None:
+            coro = self._task.get_coro()
+            task_frame = getattr(coro, 'cr_frame', None)
+            for i, f in enumerate(frames):
+                if f is task_frame:
+                    self.samples[tuple(f.f_code for f in frames[i:])] += 1
+                    return
+            if not self._task.done():
+                self.samples[(AWAIT_ROOT, *_await_stack(coro))] += 1
+            return
+
+        # Первый кадр корутины: с него начинается стек выполняемой задачи
+        coro_index = next((i for i, f in enumerate(frames) if f.f_code.co_flags & _CO_COROUTINE), None)
+        if coro_index is not None:
+            self.samples[tuple(f.f_code for f in frames[coro_index:])] += 1
+            return
+
+        innermost = frames[-1].f_code
+        if os.path.basename(innermost.co_filename) != 'selectors.py':
+            # Колбэки event loop вне задач (транспорты, таймеры)
+            self.samples[(EVENT_LOOP_ROOT, *(f.f_code for f in frames[-8:]))] += 1
+            return
+
+        # Event loop ждет в select: записываем, чего ждут задачи
+        tasks = [task for task in asyncio.all_tasks(self._loop) if not task.done()]
+        if not tasks:
+            self.samples[(IDLE_ROOT,)] += 1
+            return
+        if len(tasks) > self.max_tasks:
+            tasks = random.sample(tasks, self.max_tasks)
+        for task in tasks:
+            self.samples[(AWAIT_ROOT, *_await_stack(task.get_coro()))] += 1
+
+    def folded(self) -> str:
+        """Стеки в формате folded, самые частые первыми."""
+        cache: Dict[object, str] = {}
+        lines = [
+            f"{';'.join(_label(item, cache) for item in stack)} {count}"
+            for stack, count in self.samples.most_common()
+        ]
+        return "\n".join(lines) + "\n" if lines else ""
+
+    def top(self, limit: int = 5) -> List[Tuple[str, int]]:
+        """Самые частые листовые функции: для краткой сводки в логе."""
+        cache: Dict[object, str] = {}
+        leaves: Counter = Counter()
+        for stack, count in self.samples.items():
+            leaves[_label(stack[-1], cache)] += count
+        return leaves.most_common(limit)
+
+    def dump(self, name: str, directory: str = PROFILE_DIR) -> Optional[str]:
+        """Сохраняет профиль в <directory>/<name>_<время>.folded. Возвращает путь или None при ошибке."""
+        timestamp = datetime.datetime.now().strftime("%Y%m%d-%H%M%S-%f")
+        path = os.path.join(directory, f"{name}_{timestamp}.folded")
+        try:
+            os.makedirs(directory, exist_ok=True)
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(self.folded())
+        except OSError as e:
+            logger.error(f"Не удалось сохранить профиль {path}: {e}")
+            return None
+        return path
+
+
+@contextmanager
+def profiled(name: str, enabled: bool, task_only: bool = False, min_seconds: float = 0.0) -> Iterator[Optional[SamplingProfiler]]:
+    """
+    Профилирует блок, если enabled, и сохраняет профиль в PROFILE_DIR.
+    task_only - профилировать только текущую задачу (для обработчиков запросов, которые
+    выполняются в общем event loop). Профиль блока короче min_seconds не сохраняется.
+    """
+    if not enabled:
+        yield None
+        return
+    profiler = SamplingProfiler()
+    profiler.start(asyncio.current_task() if task_only else None)
+    try:
+        yield profiler
+    finally:
+        profiler.stop()
+        if profiler.duration >= min_seconds:
+            path = profiler.dump(name)
+            if path:
+                top = ", ".join(f"{label}={count}" for label, count in profiler.top())
+                logger.info(f"Профиль {name} сохранен: {path} ({profiler.sample_count} замеров за "
+                            f"{profiler.duration:.2f}с). Чаще всего: {top}")
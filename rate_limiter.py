@@ -0,0 +1,161 @@
+import asyncio
+import contextlib
+import contextvars
+import logging
+import time
+from collections import deque
+from typing import Optional
+
+logger = logging.getLogger("ServiceDeskLogger")
+
+# Запросы, выполняемые внутри `with limiter.priority()`, идут в приоритетную очередь
+# и берут токены внешнего бюджета с приоритетом (external_budget.acquire(priority=True)).
+# Флаг живет в контексте задачи asyncio, поэтому наследуется всеми вызовами внутри нее.
+_priority: contextvars.ContextVar[bool] = contextvars.ContextVar("sd_limiter_priority", default=False)
+
+
+class AdaptiveLimiter:
+    """
+    Адаптивный ограничитель частоты запросов к ServiceDesk API (AIMD).
+
+    Запросы выпускаются строго по очереди с интервалом 1/rate. Текущая частота
+    медленно растет (аддитивно) пока SD отвечает быстро и без ошибок, и резко
+    снижается (мультипликативно) при 429/5xx, таймаутах или высокой задержке.
+    Заголовок Retry-After приостанавливает выпуск запросов на указанное время.
+
+    Используется так же, как AsyncLimiter: `async with limiter: ...`
+    Запросы оператора (обновление сущности из интерфейса) выполняются внутри
+    `with limiter.priority():`: в своем процессе они выпускаются раньше остальных, а из общего
+    бюджета (external_budget) могут брать резерв, который не расходуют воркеры синхронизации.
+    Частота и паузы процесса от этого не меняются.
+    """
+
+    def __init__(
+            self,
+            max_rate: float,
+            min_rate: float = 1.0,
+            start_rate: Optional[float] = None,
+            latency_target: float = 2.0,
+            increase_step: float = 1.0,
+            decrease_factor: float = 0.5,
+            decrease_cooldown: float = 1.0):
+        self.max_rate = max_rate
+        self.min_rate = min(min_rate, max_rate)
+        self.rate = start_rate if start_rate else max_rate
+        # Порог задержки ответа, выше которого считаем SD перегруженным
+        self.latency_target = latency_target
+        # На сколько запросов/сек вырастает частота за ~секунду успешных ответов
+        self.increase_step = increase_step
+        self.decrease_factor = decrease_factor
+        # Не снижаем частоту чаще, чем раз в decrease_cooldown секунд:
+        # на одну перегрузку SD обычно отвечает ошибками сразу на несколько запросов "в полете"
+        self.decrease_cooldown = decrease_cooldown
+
+        self._queue = deque()
+        self._priority_queue = deque()
+        self._next_release = 0.0
+        self._pause_until = 0.0
+        self._last_decrease = 0.0
+        self._dispatcher: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        # Внешний бюджет запросов с методом async acquire(priority), общий для нескольких процессов
+        # (sync_partitions.DbRateBudget). Запрос выпускается после получения токена из него.
+        self.external_budget = None
+
+    async def __aenter__(self):
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        return None
+
+    @staticmethod
+    @contextlib.contextmanager
+    def priority():
+        """Запросы внутри блока выпускаются раньше обычной очереди."""
+        token = _priority.set(True)
+        try:
+            yield
+        finally:
+            _priority.reset(token)
+
+    async def acquire(self) -> float:
+        """Ожидает свой слот для запроса. Возвращает время ожидания в секундах."""
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # Лимитер модульный и может пережить event loop (например, несколько asyncio.run подряд)
+            self._loop = loop
+            self._queue.clear()
+            self._priority_queue.clear()
+            self._dispatcher = None
+
+        waiter = loop.create_future()
+        (self._priority_queue if _priority.get() else self._queue).append(waiter)
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = loop.create_task(self._dispatch())
+
+        started = time.monotonic()
+        await waiter
+        return time.monotonic() - started
+
+    async def _dispatch(self):
+        """Выпускает ожидающие запросы по одному с текущей частотой, приоритетные - первыми."""
+        while self._priority_queue or self._queue:
+            queue = self._priority_queue or self._queue
+            waiter = queue[0]
+            if waiter.done():
+                # Ожидавшая задача была отменена
+                queue.popleft()
+                continue
+
+            now = time.monotonic()
+            release_at = max(self._next_release, self._pause_until)
+            if release_at > now:
+                # После сна пересчитываем: частота или пауза могли измениться
+                await asyncio.sleep(release_at - now)
+                continue
+
+            if self.external_budget is not None:
+                try:
+                    await self.external_budget.acquire(priority=queue is self._priority_queue)
+                except Exception as e:
+                    # Ошибка бюджета не должна останавливать выпуск: ожидающие запросы повисли бы навсегда.
+                    # Запрос выпускается по локальной частоте, как при недоступном бюджете
+                    logger.error(f"Ошибка общего бюджета запросов к SD, запрос выпущен без него: {e}")
+                # Пока ждали общий бюджет, мог прийти приоритетный запрос: токен достается ему
+                queue = self._priority_queue or self._queue
+                while queue and queue[0].done():
+                    queue.popleft()
+                if not queue:
+                    continue # Все ожидавшие отменены: токен пропадает, потолок не превышается
+            queue.popleft().set_result(None)
+            self._next_release = time.monotonic() + 1.0 / self.rate
+
+    def record_success(self, latency: float):
+        """Учитывает успешный ответ SD и его задержку."""
+        if latency > self.latency_target:
+            self._decrease(f"задержка ответа {latency:.2f}с")
+            return
+        if self.rate < self.max_rate:
+            self.rate = min(self.max_rate, self.rate + self.increase_step / self.rate)
+
+    def record_throttle(self, retry_after: Optional[float] = None):
+        """Учитывает ответ 429/503 от SD. Retry-After приостанавливает все запросы."""
+        self._decrease("ограничение частоты со стороны SD")
+        if retry_after:
+            self._pause_until = max(self._pause_until, time.monotonic() + retry_after)
+            logger.warning(f"ServiceDesk попросил повторить позже. Запросы приостановлены на {retry_after:.1f}с.")
+
+    def record_failure(self):
+        """Учитывает таймаут, сетевую ошибку или 5xx от SD."""
+        self._decrease("ошибка или таймаут запроса")
+
+    def _decrease(self, reason: str):
+        now = time.monotonic()
+        if now - self._last_decrease < self.decrease_cooldown:
+            return
+        self._last_decrease = now
+        new_rate = max(self.min_rate, self.rate * self.decrease_factor)
+        if new_rate < self.rate:
+            logger.info(f"Частота запросов к SD снижена: {self.rate:.1f} -> {new_rate:.1f} запр/с ({reason}).")
+        self.rate = new_rate
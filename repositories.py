@@ -1,16 +1,71 @@
-from sqlalchemy import select, update, delete # Импортируем delete
+from sqlalchemy import select, update, delete, bindparam, func, or_ # Импортируем delete
+from sqlalchemy.dialects import postgresql, sqlite
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.exc import SQLAlchemyError
-from models import Company, Server, Workstation, FiscalRegister
+from models import (
+    Company, Server, Workstation, FiscalRegister, SyncJob, SyncRun, SyncCheckpoint, SyncPartition, SdRateBudget, SyncEvent, SdPayload,
+    SYNC_JOB_QUEUED, SYNC_JOB_RUNNING, SYNC_JOB_DONE, SYNC_JOB_FAILED, SYNC_RUN_RUNNING, SYNC_RUN_DONE,
+    CHECKPOINT_PENDING, CHECKPOINT_DONE, CHECKPOINT_FAILED
+)
 from typing import Optional, List, Dict, Any
+import datetime
 import logging
 
+from metrics import DB_TOUCHED_ROWS
+from tracing import traced
+
 logger = logging.getLogger("ServiceDeskLogger")
 
+
+# Атрибуты span'ов create/update: у оборудования компания - владелец, у компании - она сама
+def _create_span_attributes(self, data: dict) -> Dict[str, Any]:
+    return {'uuid': data.get('uuid'), 'company': data.get('owner_id', data.get('uuid'))}
+
+
+def _update_span_attributes(self, uuid: str, data: dict) -> Dict[str, Any]:
+    return {'uuid': uuid, 'company': data.get('owner_id', uuid)}
+
+
+async def _bulk_touch_last_modified(session: AsyncSession, model, items: List[Dict[str, Any]]) -> int:
+    """
+    Одним executemany обновляет только last_modified_date для списка сущностей.
+    items: [{'b_uuid': ..., 'b_last_modified_date': ...}]. Коммит выполняет вызывающий код.
+    """
+    if not items:
+        return 0
+    table = model.__table__
+    await session.execute(
+        update(table)
+        .where(table.c.uuid == bindparam('b_uuid'))
+        .values(last_modified_date=bindparam('b_last_modified_date')),
+        items
+    )
+    DB_TOUCHED_ROWS.inc(len(items), table=table.name)
+    return len(items)
+
+async def _bulk_update_rows(session: AsyncSession, model, rows: List[Dict[str, Any]]) -> int:
+    """
+    Одним executemany переписывает строки целиком по очищенным данным (ключи - колонки модели).
+    Все строки должны иметь одинаковый набор ключей, как у результатов одного clearify_*.
+    Коммит выполняет вызывающий код.
+    """
+    if not rows:
+        return 0
+    table = model.__table__
+    columns = [name for name in rows[0] if name in table.c and name != 'uuid']
+    await session.execute(
+        update(table)
+        .where(table.c.uuid == bindparam('b_uuid'))
+        .values({name: bindparam(f'b_{name}') for name in columns}),
+        [{'b_uuid': row['uuid'], **{f'b_{name}': row.get(name) for name in columns}} for row in rows]
+    )
+    return len(rows)
+
 class CompanyRepository:
     def __init__(self, session: AsyncSession):
         self.session = session
 
+    @traced(attributes=_create_span_attributes)
     async def create(self, company_data: dict) -> Optional[Company]:
         """Создает новую запись о компании в БД."""
         try:
@@ -27,7 +82,8 @@ class CompanyRepository:
                 active_contract=company_data.get('active_contract'),
                 last_modified_date=company_data.get('last_modified_date'),
                 additional_name=company_data.get('additional_name'),
-                parent_uuid=company_data.get('parent_uuid')
+                parent_uuid=company_data.get('parent_uuid'),
+                content_hash=company_data.get('content_hash')
             )
             self.session.add(company)
             # Коммит происходит в сервисе после успешной обработки сущности
@@ -45,6 +101,7 @@ class CompanyRepository:
              return None
 
 
+    @traced(attributes=_update_span_attributes)
     async def update(self, uuid: str, company_data: dict) -> Optional[Company]:
         """Обновляет запись о компании в БД по UUID."""
         try:
@@ -103,6 +160,15 @@ class CompanyRepository:
              return False
 
 
+    async def touch_last_modified(self, items: List[Dict[str, Any]]) -> int:
+        """Обновляет только last_modified_date для компаний, содержимое которых не изменилось."""
+        try:
+            return await _bulk_touch_last_modified(self.session, Company, items)
+        except SQLAlchemyError as e:
+            logger.error(f"Ошибка при массовом обновлении дат изменения компаний: {e}", exc_info=True)
+            return 0
+
+
     async def get_by_uuid(self, uuid: str) -> Optional[Company]:
         """Получает компанию по ее UUID."""
         try:
@@ -135,6 +201,7 @@ class ServerRepository:
     def __init__(self, session: AsyncSession):
         self.session = session
 
+    @traced(attributes=_create_span_attributes)
     async def create(self, server_data: dict) -> Optional[Server]:
         """Создает новую запись о сервере в БД."""
         try:
@@ -160,6 +227,7 @@ class ServerRepository:
                 litemanager=server_data.get('litemanager'),
                 iiko_version=server_data.get('iiko_version'),
                 description=server_data.get('description'),
+                content_hash=server_data.get('content_hash'),
                 owner_id=owner_uuid
             )
             self.session.add(server)
@@ -175,6 +243,7 @@ class ServerRepository:
              return None
 
 
+    @traced(attributes=_update_span_attributes)
     async def update(self, uuid: str, server_data: dict) -> Optional[Server]:
         """Обновляет запись о сервере в БД по UUID."""
         try:
@@ -205,6 +274,24 @@ class ServerRepository:
              return None
 
 
+    async def touch_last_modified(self, items: List[Dict[str, Any]]) -> int:
+        """Обновляет только last_modified_date для серверов, содержимое которых не изменилось."""
+        try:
+            return await _bulk_touch_last_modified(self.session, Server, items)
+        except SQLAlchemyError as e:
+            logger.error(f"Ошибка при массовом обновлении дат изменения серверов: {e}", exc_info=True)
+            return 0
+
+
+    async def update_many(self, rows: List[Dict[str, Any]]) -> Optional[int]:
+        """Переписывает строки серверов по очищенным данным (sync_runner.py --revalidate). None - ошибка БД."""
+        try:
+            return await _bulk_update_rows(self.session, Server, rows)
+        except SQLAlchemyError as e:
+            logger.error(f"Ошибка при массовом обновлении серверов: {e}", exc_info=True)
+            return None
+
+
     async def get_by_uuid(self, uuid: str) -> Optional[Server]:
         """Получает сервер по его UUID."""
         try:
@@ -218,6 +305,7 @@ class WorkstationRepository:
     def __init__(self, session: AsyncSession):
         self.session = session
 
+    @traced(attributes=_create_span_attributes)
     async def create(self, workstation_data: dict) -> Optional[Workstation]:
         """Создает новую запись о рабочей станции в БД."""
         try:
@@ -238,6 +326,7 @@ class WorkstationRepository:
                 last_modified_date=workstation_data.get('last_modified_date'), # Используем snake_case
                 litemanager=workstation_data.get('litemanager'),
                 description=workstation_data.get('description'), # Commentary из SD
+                content_hash=workstation_data.get('content_hash'),
                 owner_id=owner_uuid # Берем owner_id из processed_data
             )
             self.session.add(workstation)
@@ -256,6 +345,7 @@ class WorkstationRepository:
              return None
 
 
+    @traced(attributes=_update_span_attributes)
     async def update(self, uuid: str, workstation_data: dict) -> Optional[Workstation]:
         """Обновляет запись о рабочей станции в БД по UUID."""
         try:
@@ -286,6 +376,24 @@ class WorkstationRepository:
              return None
 
 
+    async def touch_last_modified(self, items: List[Dict[str, Any]]) -> int:
+        """Обновляет только last_modified_date для рабочих станций, содержимое которых не изменилось."""
+        try:
+            return await _bulk_touch_last_modified(self.session, Workstation, items)
+        except SQLAlchemyError as e:
+            logger.error(f"Ошибка при массовом обновлении дат изменения рабочих станций: {e}", exc_info=True)
+            return 0
+
+
+    async def update_many(self, rows: List[Dict[str, Any]]) -> Optional[int]:
+        """Переписывает строки рабочих станций по очищенным данным (sync_runner.py --revalidate). None - ошибка БД."""
+        try:
+            return await _bulk_update_rows(self.session, Workstation, rows)
+        except SQLAlchemyError as e:
+            logger.error(f"Ошибка при массовом обновлении рабочих станций: {e}", exc_info=True)
+            return None
+
+
     async def get_by_uuid(self, uuid: str) -> Optional[Workstation]:
         """Получает рабочую станцию по ее UUID."""
         try:
@@ -300,6 +408,7 @@ class FiscalRegisterRepository:
     def __init__(self, session: AsyncSession): # Принимаем асинхронную сессию
         self.session = session
 
+    @traced(attributes=_create_span_attributes)
     async def create(self, fr_data: dict) -> Optional[FiscalRegister]:
         """Создает новую запись о фискальном регистраторе в БД."""
         try:
@@ -326,6 +435,7 @@ class FiscalRegisterRepository:
                 kkt_reg_date=fr_data.get('kkt_reg_date'), # Даты уже в формате datetime после валидатора
                 fn_expire_date=fr_data.get('fn_expire_date'),
                 last_modified_date=fr_data.get('last_modified_date'), # Дата последнего изменения
+                content_hash=fr_data.get('content_hash'),
                 owner_id=owner_uuid
             )
             self.session.add(fr)
@@ -344,6 +454,7 @@ class FiscalRegisterRepository:
              return None
 
 
+    @traced(attributes=_update_span_attributes)
     async def update(self, uuid: str, fr_data: dict) -> Optional[FiscalRegister]:
         """Обновляет запись о фискальном регистраторе в БД по UUID."""
         try:
@@ -375,6 +486,24 @@ class FiscalRegisterRepository:
              return None
 
 
+    async def touch_last_modified(self, items: List[Dict[str, Any]]) -> int:
+        """Обновляет только last_modified_date для ФР, содержимое которых не изменилось."""
+        try:
+            return await _bulk_touch_last_modified(self.session, FiscalRegister, items)
+        except SQLAlchemyError as e:
+            logger.error(f"Ошибка при массовом обновлении дат изменения ФР: {e}", exc_info=True)
+            return 0
+
+
+    async def update_many(self, rows: List[Dict[str, Any]]) -> Optional[int]:
+        """Переписывает строки ФР по очищенным данным (sync_runner.py --revalidate). None - ошибка БД."""
+        try:
+            return await _bulk_update_rows(self.session, FiscalRegister, rows)
+        except SQLAlchemyError as e:
+            logger.error(f"Ошибка при массовом обновлении ФР: {e}", exc_info=True)
+            return None
+
+
     async def get_by_uuid(self, uuid: str) -> Optional[FiscalRegister]:
         """Получает фискальный регистратор по его UUID."""
         try:
@@ -436,4 +565,663 @@ class FiscalRegisterRepository:
         #     return False # Компания не найдена
 
         # Пока просто возвращаем False, так как логика не реализована
-        return False
\ No newline at end of file
+        return False
+
+
+class SyncJobRepository:
+    """
+    Очередь заданий синхронизации в таблице sync_jobs.
+    Коммит выполняет вызывающий код: забор задания и смена статуса должны попасть в одну транзакцию.
+    """
+    def __init__(self, session: AsyncSession):
+        self.session = session
+
+    async def enqueue(self, job_type: str) -> Optional[SyncJob]:
+        """
+        Добавляет задание в очередь. Если задание этого типа уже ждет в очереди,
+        возвращает его: повторные нажатия не копят одинаковые синхронизации.
+        """
+        try:
+            result = await self.session.execute(
+                select(SyncJob)
+                .filter(SyncJob.job_type == job_type, SyncJob.status == SYNC_JOB_QUEUED)
+                .order_by(SyncJob.created_at)
+                .limit(1)
+            )
+            job = result.scalars().first()
+            if job:
+                logger.debug(f"Задание синхронизации {job_type} уже в очереди: {job.id}")
+                return job
+
+            job = SyncJob(job_type=job_type, status=SYNC_JOB_QUEUED, created_at=datetime.datetime.utcnow())
+            self.session.add(job)
+            await self.session.flush()
+            logger.debug(f"Задание синхронизации {job_type} добавлено в очередь: {job.id}")
+            return job
+        except SQLAlchemyError as e:
+            logger.error(f"Ошибка при добавлении задания синхронизации {job_type} в очередь: {e}", exc_info=True)
+            return None
+
+    async def claim_next(self, worker_id: str) -> Optional[SyncJob]:
+        """
+        Забирает самое старое задание из очереди и помечает его выполняемым.
+        FOR UPDATE SKIP LOCKED: несколько воркеров не заберут одно и то же задание.
+        """
+        try:
+            result = await self.session.execute(
+                select(SyncJob)
+                .filter(SyncJob.status == SYNC_JOB_QUEUED)
+                .order_by(SyncJob.created_at)
+                .limit(1)
+                .with_for_update(skip_locked=True)
+            )
+            job = result.scalars().first()
+            if not job:
+                return None
+
+            now = datetime.datetime.utcnow()
+            job.status = SYNC_JOB_RUNNING
+            job.worker_id = worker_id
+            job.started_at = now
+            job.heartbeat_at = now
+            job.finished_at = None
+            job.error = None
+            job.attempts = (job.attempts or 0) + 1
+            return job
+        except SQLAlchemyError as e:
+            logger.error(f"Ошибка при получении задания синхронизации из очереди: {e}", exc_info=True)
+            return None
+
+    async def heartbeat(self, job_id: int, worker_id: str) -> bool:
+        """Обновляет heartbeat_at выполняемого задания. False - задание больше не принадлежит воркеру."""
+        try:
+            result = await self.session.execute(
+                update(SyncJob)
+                .where(SyncJob.id == job_id, SyncJob.worker_id == worker_id, SyncJob.status == SYNC_JOB_RUNNING)
+                .values(heartbeat_at=datetime.datetime.utcnow())
+            )
+            return result.rowcount > 0
+        except SQLAlchemyError as e:
+            logger.error(f"Ошибка при обновлении heartbeat задания синхронизации {job_id}: {e}", exc_info=True)
+            return False
+
+    async def finish(self, job_id: int, error: Optional[str] = None) -> bool:
+        """Помечает задание выполненным или, если передан error, завершенным с ошибкой."""
+        try:
+            result = await self.session.execute(
+                update(SyncJob)
+                .where(SyncJob.id == job_id)
+                .values(
+                    status=SYNC_JOB_FAILED if error else SYNC_JOB_DONE,
+                    finished_at=datetime.datetime.utcnow(),
+                    error=error
+                )
+            )
+            return result.rowcount > 0
+        except SQLAlchemyError as e:
+            logger.error(f"Ошибка при завершении задания синхронизации {job_id}: {e}", exc_info=True)
+            return False
+
+    async def release(self, job_id: int, worker_id: str) -> bool:
+        """Возвращает выполняемое задание в очередь (воркер останавливается и не успел его завершить)."""
+        try:
+            result = await self.session.execute(
+                update(SyncJob)
+                .where(SyncJob.id == job_id, SyncJob.worker_id == worker_id, SyncJob.status == SYNC_JOB_RUNNING)
+                .values(status=SYNC_JOB_QUEUED, worker_id=None)
+            )
+            return result.rowcount > 0
+        except SQLAlchemyError as e:
+            logger.error(f"Ошибка при возврате задания синхронизации {job_id} в очередь: {e}", exc_info=True)
+            return False
+
+    async def requeue_stale(self, stale_after: datetime.timedelta, max_attempts: int) -> int:
+        """
+        Возвращает в очередь задания, воркер которых перестал присылать heartbeat
+        (процесс убит или перезапущен). Задания, исчерпавшие max_attempts, помечаются ошибкой.
+        """
+        try:
+            deadline = datetime.datetime.utcnow() - stale_after
+            stale = (SyncJob.status == SYNC_JOB_RUNNING, SyncJob.heartbeat_at < deadline)
+            failed = await self.session.execute(
+                update(SyncJob)
+                .where(*stale, SyncJob.attempts >= max_attempts)
+                .values(
+                    status=SYNC_JOB_FAILED,
+                    finished_at=datetime.datetime.utcnow(),
+                    error="Воркер перестал отвечать, попытки исчерпаны"
+                )
+            )
+            requeued = await self.session.execute(
+                update(SyncJob)
+                .where(*stale)
+                .values(status=SYNC_JOB_QUEUED, worker_id=None)
+            )
+            if failed.rowcount or requeued.rowcount:
+                logger.warning(f"Зависшие задания синхронизации: возвращено в очередь {requeued.rowcount}, завершено с ошибкой {failed.rowcount}.")
+            return requeued.rowcount
+        except SQLAlchemyError as e:
+            logger.error(f"Ошибка при возврате зависших заданий синхронизации в очередь: {e}", exc_info=True)
+            return 0
+
+    async def get_by_id(self, job_id: int) -> Optional[SyncJob]:
+        """Получает задание синхронизации по id."""
+        try:
+            return await self.session.get(SyncJob, job_id)
+        except SQLAlchemyError as e:
+            logger.error(f"Ошибка при получении задания синхронизации {job_id}: {e}", exc_info=True)
+            return None
+
+
+class SyncRunRepository:
+    """Отчеты о запусках синхронизации (таблица sync_runs). Коммит выполняет вызывающий код."""
+    def __init__(self, session: AsyncSession):
+        self.session = session
+
+    async def create(self, started_at: datetime.datetime) -> Optional[SyncRun]:
+        """Создает запись о начавшейся синхронизации."""
+        try:
+            run = SyncRun(status=SYNC_RUN_RUNNING, started_at=started_at)
+            self.session.add(run)
+            await self.session.flush()
+            return run
+        except SQLAlchemyError as e:
+            logger.error(f"Ошибка при создании записи о запуске синхронизации: {e}", exc_info=True)
+            return None
+
+    async def finish(self, run_id: int, report: Dict[str, Any]) -> bool:
+        """Записывает итоги синхронизации (status, finished_at, stats и т.д.)."""
+        try:
+            result = await self.session.execute(
+                update(SyncRun)
+                .where(SyncRun.id == run_id)
+                .values({k: v for k, v in report.items() if hasattr(SyncRun, k)})
+            )
+            return result.rowcount > 0
+        except SQLAlchemyError as e:
+            logger.error(f"Ошибка при сохранении итогов синхронизации {run_id}: {e}", exc_info=True)
+            return False
+
+    async def list(self, limit: int = 20, offset: int = 0) -> List[SyncRun]:
+        """Запуски синхронизации, начиная с последнего."""
+        try:
+            result = await self.session.execute(
+                select(SyncRun).order_by(SyncRun.started_at.desc(), SyncRun.id.desc()).limit(limit).offset(offset)
+            )
+            return list(result.scalars().all())
+        except SQLAlchemyError as e:
+            logger.error(f"Ошибка при получении списка запусков синхронизации: {e}", exc_info=True)
+            return []
+
+    async def count(self) -> int:
+        """Общее количество запусков синхронизации."""
+        try:
+            return (await self.session.execute(select(func.count()).select_from(SyncRun))).scalar_one()
+        except SQLAlchemyError as e:
+            logger.error(f"Ошибка при подсчете запусков синхронизации: {e}", exc_info=True)
+            return 0
+
+    async def save_progress(self, run_id: int, stats: Dict[str, Any]) -> bool:
+        """Промежуточные счетчики еще идущей синхронизации (для продолжения прерванного запуска)."""
+        try:
+            result = await self.session.execute(update(SyncRun).where(SyncRun.id == run_id).values(stats=stats))
+            return result.rowcount > 0
+        except SQLAlchemyError as e:
+            logger.error(f"Ошибка при сохранении прогресса синхронизации {run_id}: {e}", exc_info=True)
+            return False
+
+    async def get(self, run_id: int) -> Optional[SyncRun]:
+        try:
+            return await self.session.get(SyncRun, run_id)
+        except SQLAlchemyError as e:
+            logger.error(f"Ошибка при получении запуска синхронизации {run_id}: {e}", exc_info=True)
+            return None
+
+
+class SyncCheckpointRepository:
+    """
+    Контрольные точки синхронизации (таблица sync_checkpoints). Коммит выполняет вызывающий код.
+    Методы записи пробрасывают ошибки БД: статусы пишутся пачками, и пачку откатывает вызывающий код.
+    """
+    # Сколько UUID обновлять одним запросом с IN (...)
+    UUID_CHUNK_SIZE = 500
+
+    def __init__(self, session: AsyncSession):
+        self.session = session
+
+    async def find_resumable(self, max_age: datetime.timedelta, idle: datetime.timedelta) -> Optional[int]:
+        """
+        Последний незавершенный запуск с необработанными сущностями, который можно продолжить:
+        контрольная точка обновлялась не раньше max_age назад, а запуск упал с ошибкой
+        или (если процесс был убит и статус остался running) не обновлял ее дольше idle.
+        """
+        now = datetime.datetime.utcnow()
+        last_update = func.max(SyncCheckpoint.updated_at)
+        try:
+            row = (await self.session.execute(
+                select(SyncCheckpoint.run_id, last_update, SyncRun.status)
+                .join(SyncRun, SyncRun.id == SyncCheckpoint.run_id)
+                .where(SyncCheckpoint.status == CHECKPOINT_PENDING, SyncRun.status != SYNC_RUN_DONE)
+                .group_by(SyncCheckpoint.run_id, SyncRun.status)
+                .order_by(last_update.desc())
+                .limit(1)
+            )).first()
+        except SQLAlchemyError as e:
+            logger.error(f"Ошибка при поиске прерванной синхронизации: {e}", exc_info=True)
+            return None
+        if row is None:
+            return None
+        run_id, updated_at, status = row
+        if updated_at < now - max_age:
+            return None
+        if status == SYNC_RUN_RUNNING and updated_at > now - idle:
+            return None # Запуск, возможно, еще идет в другом процессе
+        return run_id
+
+    async def list_by_status(self, status: str, run_id: Optional[int] = None) -> List[SyncCheckpoint]:
+        try:
+            query = select(SyncCheckpoint).where(SyncCheckpoint.status == status)
+            if run_id is not None:
+                query = query.where(SyncCheckpoint.run_id == run_id)
+            return list((await self.session.execute(query)).scalars().all())
+        except SQLAlchemyError as e:
+            logger.error(f"Ошибка при получении контрольной точки ({status}): {e}", exc_info=True)
+            return []
+
+    async def list_pending(self, run_id: int, buckets: List[int], meta_classes: List[str]) -> List[SyncCheckpoint]:
+        """Необработанные сущности запуска из указанных корзин (часть запуска для одного воркера)."""
+        try:
+            return list((await self.session.execute(
+                select(SyncCheckpoint).where(
+                    SyncCheckpoint.run_id == run_id,
+                    SyncCheckpoint.status == CHECKPOINT_PENDING,
+                    SyncCheckpoint.bucket.in_(buckets),
+                    SyncCheckpoint.meta_class.in_(meta_classes)
+                )
+            )).scalars().all())
+        except SQLAlchemyError as e:
+            logger.error(f"Ошибка при получении части контрольной точки запуска {run_id}: {e}", exc_info=True)
+            return []
+
+    async def adopt(self, old_run_id: int, new_run_id: int) -> int:
+        """Передает необработанные сущности прерванного запуска новому запуску."""
+        result = await self.session.execute(
+            update(SyncCheckpoint)
+            .where(SyncCheckpoint.run_id == old_run_id, SyncCheckpoint.status == CHECKPOINT_PENDING)
+            .values(run_id=new_run_id, updated_at=datetime.datetime.utcnow())
+        )
+        return result.rowcount
+
+    async def clear_finished(self, failed_expired_before: datetime.datetime, live_since: datetime.datetime) -> int:
+        """
+        Удаляет строки прошлых запусков, кроме неудачных: они нужны для задержки повторов.
+        Неудачные удаляются, если их давно пора было повторить, но ни один запуск их не взял
+        (сущность удалена из SD или уже актуальна в БД).
+        Строки запусков, которые, возможно, еще идут в другом процессе (статус running и контрольная
+        точка обновлялась позже live_since), не трогаются, как и в find_resumable.
+        """
+        live_runs = (
+            select(SyncCheckpoint.run_id)
+            .join(SyncRun, SyncRun.id == SyncCheckpoint.run_id)
+            .where(SyncRun.status == SYNC_RUN_RUNNING)
+            .group_by(SyncCheckpoint.run_id)
+            .having(func.max(SyncCheckpoint.updated_at) > live_since)
+        )
+        result = await self.session.execute(delete(SyncCheckpoint).where(
+            (SyncCheckpoint.status != CHECKPOINT_FAILED) | (SyncCheckpoint.next_attempt_at < failed_expired_before),
+            SyncCheckpoint.run_id.not_in(live_runs)
+        ))
+        return result.rowcount
+
+    async def add_pending(self, run_id: int, rows: List[Dict[str, Any]]):
+        """Новые сущности в работе: rows - [{meta_class, uuid, sd_modified, ref_uuid}]."""
+        if not rows:
+            return
+        now = datetime.datetime.utcnow()
+        await self.session.execute(
+            SyncCheckpoint.__table__.insert(),
+            [{**row, 'run_id': run_id, 'status': CHECKPOINT_PENDING, 'attempts': 0, 'updated_at': now} for row in rows]
+        )
+
+    async def retake_failed(self, run_id: int, rows: List[Dict[str, Any]]):
+        """Неудачные сущности прошлых запусков снова в работе; счетчик попыток сохраняется."""
+        if not rows:
+            return
+        table = SyncCheckpoint.__table__
+        await self.session.execute(
+            update(table)
+            .where(table.c.meta_class == bindparam('b_meta_class'), table.c.uuid == bindparam('b_uuid'))
+            .values(run_id=run_id, status=CHECKPOINT_PENDING, sd_modified=bindparam('b_sd_modified'),
+                    ref_uuid=bindparam('b_ref_uuid'), bucket=bindparam('b_bucket'), updated_at=datetime.datetime.utcnow()),
+            [{'b_' + key: value for key, value in row.items()} for row in rows]
+        )
+
+    async def mark_done(self, meta_class: str, uuids: List[str]):
+        now = datetime.datetime.utcnow()
+        for start in range(0, len(uuids), self.UUID_CHUNK_SIZE):
+            await self.session.execute(
+                update(SyncCheckpoint)
+                .where(SyncCheckpoint.meta_class == meta_class, SyncCheckpoint.uuid.in_(uuids[start:start + self.UUID_CHUNK_SIZE]))
+                .values(status=CHECKPOINT_DONE, attempts=0, next_attempt_at=None, error=None, updated_at=now)
+            )
+
+    async def mark_failed(self, items: List[Dict[str, Any]]):
+        """items: [{meta_class, uuid, attempts, next_attempt_at, error}]."""
+        if not items:
+            return
+        table = SyncCheckpoint.__table__
+        await self.session.execute(
+            update(table)
+            .where(table.c.meta_class == bindparam('b_meta_class'), table.c.uuid == bindparam('b_uuid'))
+            .values(status=CHECKPOINT_FAILED, attempts=bindparam('b_attempts'), next_attempt_at=bindparam('b_next_attempt_at'),
+                    error=bindparam('b_error'), updated_at=datetime.datetime.utcnow()),
+            [{'b_' + key: value for key, value in item.items()} for item in items]
+        )
+
+    async def finish_run(self, run_id: int) -> int:
+        """Завершенный запуск: обработанные и не взятые в работу сущности больше не нужны."""
+        result = await self.session.execute(
+            delete(SyncCheckpoint).where(SyncCheckpoint.run_id == run_id, SyncCheckpoint.status != CHECKPOINT_FAILED)
+        )
+        return result.rowcount
+
+
+class SyncPartitionRepository:
+    """
+    Части запуска синхронизации для нескольких воркеров (таблица sync_partitions).
+    Коммит выполняет вызывающий код: забор части и смена статуса должны попасть в одну транзакцию.
+    """
+    def __init__(self, session: AsyncSession):
+        self.session = session
+
+    async def create_all(self, run_id: int, partitions: int) -> bool:
+        """Создает части 0..partitions-1 запуска в статусе queued."""
+        try:
+            self.session.add_all([
+                SyncPartition(run_id=run_id, partition=number, partitions=partitions, status=SYNC_JOB_QUEUED, attempts=0)
+                for number in range(partitions)
+            ])
+            await self.session.flush()
+            return True
+        except SQLAlchemyError as e:
+            logger.error(f"Ошибка при создании частей запуска синхронизации {run_id}: {e}", exc_info=True)
+            return False
+
+    async def claim_next(self, run_id: int, worker_id: str) -> Optional[SyncPartition]:
+        """Забирает следующую часть запуска из очереди. FOR UPDATE SKIP LOCKED, как у заданий."""
+        try:
+            result = await self.session.execute(
+                select(SyncPartition)
+                .filter(SyncPartition.run_id == run_id, SyncPartition.status == SYNC_JOB_QUEUED)
+                .order_by(SyncPartition.partition)
+                .limit(1)
+                .with_for_update(skip_locked=True)
+            )
+            partition = result.scalars().first()
+            if not partition:
+                return None
+            now = datetime.datetime.utcnow()
+            partition.status = SYNC_JOB_RUNNING
+            partition.worker_id = worker_id
+            partition.started_at = now
+            partition.heartbeat_at = now
+            partition.attempts = (partition.attempts or 0) + 1
+            return partition
+        except SQLAlchemyError as e:
+            logger.error(f"Ошибка при получении части запуска синхронизации {run_id}: {e}", exc_info=True)
+            return None
+
+    async def heartbeat(self, partition_id: int, worker_id: str) -> bool:
+        try:
+            result = await self.session.execute(
+                update(SyncPartition)
+                .where(SyncPartition.id == partition_id, SyncPartition.worker_id == worker_id, SyncPartition.status == SYNC_JOB_RUNNING)
+                .values(heartbeat_at=datetime.datetime.utcnow())
+            )
+            return result.rowcount > 0
+        except SQLAlchemyError as e:
+            logger.error(f"Ошибка при обновлении heartbeat части синхронизации {partition_id}: {e}", exc_info=True)
+            return False
+
+    async def finish(self, partition_id: int, report: Dict[str, Any], error: Optional[str] = None) -> bool:
+        try:
+            result = await self.session.execute(
+                update(SyncPartition)
+                .where(SyncPartition.id == partition_id)
+                .values(status=SYNC_JOB_FAILED if error else SYNC_JOB_DONE, finished_at=datetime.datetime.utcnow(),
+                        report=report, error=error)
+            )
+            return result.rowcount > 0
+        except SQLAlchemyError as e:
+            logger.error(f"Ошибка при завершении части синхронизации {partition_id}: {e}", exc_info=True)
+            return False
+
+    async def requeue_stale(self, run_id: int, stale_after: datetime.timedelta, max_attempts: int) -> int:
+        """Возвращает в очередь части, воркер которых перестал присылать heartbeat. Исчерпавшие попытки - failed."""
+        try:
+            deadline = datetime.datetime.utcnow() - stale_after
+            stale = (SyncPartition.run_id == run_id, SyncPartition.status == SYNC_JOB_RUNNING, SyncPartition.heartbeat_at < deadline)
+            failed = await self.session.execute(
+                update(SyncPartition)
+                .where(*stale, SyncPartition.attempts >= max_attempts)
+                .values(status=SYNC_JOB_FAILED, finished_at=datetime.datetime.utcnow(), error="Воркер перестал отвечать, попытки исчерпаны")
+            )
+            requeued = await self.session.execute(
+                update(SyncPartition).where(*stale).values(status=SYNC_JOB_QUEUED, worker_id=None)
+            )
+            if failed.rowcount or requeued.rowcount:
+                logger.warning(f"Зависшие части запуска {run_id}: возвращено в очередь {requeued.rowcount}, завершено с ошибкой {failed.rowcount}.")
+            return requeued.rowcount
+        except SQLAlchemyError as e:
+            logger.error(f"Ошибка при возврате зависших частей запуска {run_id} в очередь: {e}", exc_info=True)
+            return 0
+
+    async def list_by_run(self, run_id: int) -> List[SyncPartition]:
+        try:
+            result = await self.session.execute(
+                select(SyncPartition).filter(SyncPartition.run_id == run_id).order_by(SyncPartition.partition)
+            )
+            return list(result.scalars().all())
+        except SQLAlchemyError as e:
+            logger.error(f"Ошибка при получении частей запуска синхронизации {run_id}: {e}", exc_info=True)
+            return []
+
+    async def find_open_run(self) -> Optional[int]:
+        """Последний идущий запуск, у которого есть части в очереди (для воркера с другого хоста)."""
+        try:
+            result = await self.session.execute(
+                select(SyncPartition.run_id)
+                .join(SyncRun, SyncRun.id == SyncPartition.run_id)
+                .filter(SyncPartition.status == SYNC_JOB_QUEUED, SyncRun.status == SYNC_RUN_RUNNING)
+                .order_by(SyncPartition.run_id.desc())
+                .limit(1)
+            )
+            return result.scalars().first()
+        except SQLAlchemyError as e:
+            logger.error(f"Ошибка при поиске запуска синхронизации с частями в очереди: {e}", exc_info=True)
+            return None
+
+
+class SdRateBudgetRepository:
+    """Общий бюджет запросов к SD (таблица sd_rate_budget). Коммит выполняет вызывающий код."""
+    def __init__(self, session: AsyncSession):
+        self.session = session
+
+    async def configure(self, name: str, rate: float, capacity: float, now: float) -> bool:
+        """Создает бюджет или меняет его частоту. Накопленные токены сохраняются (не больше capacity)."""
+        try:
+            budget = await self.session.get(SdRateBudget, name, with_for_update=True)
+            if budget is None:
+                self.session.add(SdRateBudget(name=name, rate=rate, capacity=capacity, tokens=capacity, refilled_at=now))
+            else:
+                budget.rate, budget.capacity = rate, capacity
+                budget.tokens = min(budget.tokens, capacity)
+            await self.session.flush()
+            return True
+        except SQLAlchemyError as e:
+            logger.error(f"Ошибка при настройке бюджета запросов {name}: {e}", exc_info=True)
+            return False
+
+    async def take(self, name: str, wanted: float, now: float, reserve: float = 0.0) -> Optional[float]:
+        """
+        Пополняет бюджет за прошедшее время и забирает до wanted токенов, оставляя в бюджете
+        не меньше reserve (резерв для приоритетных запросов, они берут с reserve=0).
+        Строка блокируется до коммита (FOR UPDATE), поэтому процессы не берут одни и те же токены.
+        Возвращает выданное число токенов (может быть дробным и нулевым) или None, если бюджета нет.
+        """
+        try:
+            budget = await self.session.get(SdRateBudget, name, with_for_update=True, populate_existing=True)
+            if budget is None:
+                return None
+            tokens = min(budget.capacity, budget.tokens + max(0.0, now - budget.refilled_at) * budget.rate)
+            granted = min(wanted, max(0.0, tokens - reserve))
+            budget.tokens = tokens - granted
+            budget.refilled_at = max(now, budget.refilled_at)
+            await self.session.flush()
+            return granted
+        except SQLAlchemyError as e:
+            logger.error(f"Ошибка при получении токенов бюджета запросов {name}: {e}", exc_info=True)
+            return None
+
+
+class SyncEventRepository:
+    """
+    Уведомления SD об изменении сущностей (таблица sync_events). Коммит выполняет вызывающий код:
+    забор сущностей и отметка воркера должны попасть в одну транзакцию.
+    """
+    def __init__(self, session: AsyncSession):
+        self.session = session
+
+    async def add(self, events: List[Dict[str, str]]) -> Optional[int]:
+        """
+        Добавляет уведомления [{meta_class, uuid}]. Уведомление о сущности, которая уже ждет
+        обработки, сдвигает last_event_at и снимает отметку воркера. Возвращает число уведомлений.
+        """
+        if not events:
+            return 0
+        now = datetime.datetime.utcnow()
+        dialect = postgresql if self.session.bind.dialect.name == 'postgresql' else sqlite
+        statement = dialect.insert(SyncEvent.__table__)
+        statement = statement.on_conflict_do_update(
+            index_elements=['meta_class', 'uuid'],
+            set_={'last_event_at': statement.excluded.last_event_at, 'events': SyncEvent.__table__.c.events + 1,
+                  'claimed_by': None, 'claimed_at': None}
+        )
+        try:
+            await self.session.execute(statement, [
+                {'meta_class': event['meta_class'], 'uuid': event['uuid'], 'received_at': now, 'last_event_at': now,
+                 'events': 1, 'attempts': 0}
+                for event in events
+            ])
+            return len(events)
+        except SQLAlchemyError as e:
+            logger.error(f"Ошибка при сохранении {len(events)} уведомлений SD: {e}", exc_info=True)
+            return None
+
+    async def claim(self, worker_id: str, quiet_since: datetime.datetime, overdue_since: datetime.datetime,
+                    stale_claim_since: datetime.datetime, limit: int) -> List[SyncEvent]:
+        """
+        Забирает до limit сущностей, о которых не было уведомлений с quiet_since (окно схлопывания)
+        или которые ждут дольше, чем с overdue_since. Сущности, забранные воркером раньше
+        stale_claim_since, считаются брошенными. FOR UPDATE SKIP LOCKED, как у заданий.
+        """
+        now = datetime.datetime.utcnow()
+        try:
+            result = await self.session.execute(
+                select(SyncEvent)
+                .where(
+                    or_(SyncEvent.claimed_at.is_(None), SyncEvent.claimed_at < stale_claim_since),
+                    or_(SyncEvent.last_event_at <= quiet_since, SyncEvent.received_at <= overdue_since),
+                    or_(SyncEvent.next_attempt_at.is_(None), SyncEvent.next_attempt_at <= now)
+                )
+                .order_by(SyncEvent.received_at)
+                .limit(limit)
+                .with_for_update(skip_locked=True)
+            )
+            events = list(result.scalars().all())
+            for event in events:
+                event.claimed_by = worker_id
+                event.claimed_at = now
+            await self.session.flush()
+            return events
+        except SQLAlchemyError as e:
+            logger.error(f"Ошибка при получении уведомлений SD воркером {worker_id}: {e}", exc_info=True)
+            return []
+
+    async def finish(self, worker_id: str) -> int:
+        """Удаляет обработанные воркером сущности. Получившие новое уведомление остаются в очереди."""
+        try:
+            result = await self.session.execute(delete(SyncEvent).where(SyncEvent.claimed_by == worker_id))
+            return result.rowcount
+        except SQLAlchemyError as e:
+            logger.error(f"Ошибка при удалении обработанных уведомлений SD воркера {worker_id}: {e}", exc_info=True)
+            return 0
+
+    async def release(self, worker_id: str, items: List[Dict[str, Any]]) -> int:
+        """Возвращает в очередь сущности, которые не удалось обработать: items - [{meta_class, uuid, attempts, next_attempt_at, error}]."""
+        if not items:
+            return 0
+        table = SyncEvent.__table__
+        try:
+            result = await self.session.execute(
+                update(table)
+                .where(table.c.meta_class == bindparam('b_meta_class'), table.c.uuid == bindparam('b_uuid'),
+                       table.c.claimed_by == worker_id)
+                .values(claimed_by=None, claimed_at=None, attempts=bindparam('b_attempts'),
+                        next_attempt_at=bindparam('b_next_attempt_at'), error=bindparam('b_error')),
+                [{'b_' + key: value for key, value in item.items()} for item in items]
+            )
+            return result.rowcount
+        except SQLAlchemyError as e:
+            logger.error(f"Ошибка при возврате уведомлений SD воркера {worker_id} в очередь: {e}", exc_info=True)
+            return 0
+
+
+class SdPayloadRepository:
+    """Архив сырых ответов SD (таблица sd_payloads). Коммит выполняет вызывающий код."""
+    def __init__(self, session: AsyncSession):
+        self.session = session
+
+    async def add(self, rows: List[Dict[str, Any]]) -> Optional[int]:
+        """
+        Сохраняет ответы [{uuid, sd_modified, meta_class, payload, fetched_at}]. Повторно полученная
+        версия перезаписывается, более старые версии тех же сущностей удаляются. Возвращает число строк.
+        """
+        if not rows:
+            return 0
+        dialect = postgresql if self.session.bind.dialect.name == 'postgresql' else sqlite
+        statement = dialect.insert(SdPayload.__table__)
+        statement = statement.on_conflict_do_update(
+            index_elements=['uuid', 'sd_modified'],
+            set_={'payload': statement.excluded.payload, 'fetched_at': statement.excluded.fetched_at}
+        )
+        table = SdPayload.__table__
+        try:
+            await self.session.execute(statement, rows)
+            await self.session.execute(
+                delete(table).where(table.c.uuid == bindparam('b_uuid'), table.c.sd_modified < bindparam('b_sd_modified')),
+                [{'b_uuid': row['uuid'], 'b_sd_modified': row['sd_modified']} for row in rows]
+            )
+            return len(rows)
+        except SQLAlchemyError as e:
+            logger.error(f"Ошибка при сохранении {len(rows)} ответов SD в архив: {e}", exc_info=True)
+            return None
+
+    async def page(self, meta_class: str, model, after_uuid: str, limit: int) -> List[Any]:
+        """
+        Следующая страница архива метакласса по UUID вместе с content_hash и last_modified_date
+        строки из таблицы model (None, если строки нет). Строки (uuid, sd_modified, payload, content_hash, last_modified_date),
+        у сущности с несколькими версиями первой идет последняя.
+        """
+        try:
+            result = await self.session.execute(
+                select(SdPayload.uuid, SdPayload.sd_modified, SdPayload.payload, model.content_hash, model.last_modified_date)
+                .outerjoin(model, model.uuid == SdPayload.uuid)
+                .where(SdPayload.meta_class == meta_class, SdPayload.uuid > after_uuid)
+                .order_by(SdPayload.uuid, SdPayload.sd_modified.desc())
+                .limit(limit)
+            )
+            return list(result.all())
+        except SQLAlchemyError as e:
+            logger.error(f"Ошибка при чтении архива ответов SD {meta_class}: {e}", exc_info=True)
+            return []
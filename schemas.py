@@ -1,5 +1,5 @@
 from pydantic import BaseModel
-from typing import List, Optional
+from typing import List, Optional, Dict, Any
 import datetime
 
 # Модель для результата поиска компании
@@ -68,3 +68,52 @@ class SearchResultResponse(BaseModel):
     servers: List[ServerSearchResult]
     workstations: List[WorkstationSearchResult]
     fiscal_registers: List[FiscalRegisterSearchResult]
+
+
+# Ответ на пачку уведомлений SD об изменении сущностей (POST /sync/events)
+class SyncEventsResponse(BaseModel):
+    accepted: int
+    ignored: int
+
+
+# Модель задания синхронизации (очередь sync_jobs)
+class SyncJobResponse(BaseModel):
+    id: int
+    job_type: str
+    status: str
+    created_at: datetime.datetime
+    started_at: Optional[datetime.datetime] = None
+    finished_at: Optional[datetime.datetime] = None
+    heartbeat_at: Optional[datetime.datetime] = None
+    worker_id: Optional[str] = None
+    attempts: int = 0
+    error: Optional[str] = None
+
+    class Config:
+        from_attributes = True
+
+
+# Модель отчета о запуске синхронизации (таблица sync_runs)
+class SyncRunResponse(BaseModel):
+    id: int
+    status: str
+    started_at: datetime.datetime
+    finished_at: Optional[datetime.datetime] = None
+    duration_seconds: Optional[float] = None
+    stats: Optional[Dict[str, Dict[str, int]]] = None
+    http_requests: Optional[int] = None
+    bytes_downloaded: Optional[int] = None
+    stage_timings: Optional[Dict[str, float]] = None
+    slowest_entities: Optional[List[Dict[str, Any]]] = None
+    error: Optional[str] = None
+
+    class Config:
+        from_attributes = True
+
+
+# Страница отчетов о синхронизации
+class SyncRunListResponse(BaseModel):
+    total: int
+    limit: int
+    offset: int
+    items: List[SyncRunResponse]
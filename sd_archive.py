@@ -0,0 +1,177 @@
+import asyncio
+import datetime
+import json
+import logging
+import os
+import zlib
+from collections import Counter
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from data_validator import clearify_server_data, clearify_pos_data, clearify_fr_data, compute_content_hash, parse_sd_datetime
+from models import Server, Workstation, FiscalRegister
+from repositories import SdPayloadRepository, ServerRepository, WorkstationRepository, FiscalRegisterRepository
+from sync_offload import validate_records
+
+logger = logging.getLogger("ServiceDeskLogger")
+
+# Архив сырых ответов SD.
+# Детали оборудования, полученные синхронизацией (по одной, пачкой, полным списком при --full)
+# и обновлением по запросу оператора, сохраняются в sd_payloads сжатыми zlib, с ключом
+# UUID + lastModifiedDate. Хранится последняя версия сущности: более старые удаляются при записи.
+# После исправления правил data_validator sync_runner.py --revalidate прогоняет архив через
+# clearify_* без запросов к SD и переписывает только строки, у которых изменился content_hash.
+# Компании не архивируются: их очистка требует запросов контрактов к SD.
+#
+# Переменные окружения:
+# SD_ARCHIVE                - "0" не сохранять ответы SD (по умолчанию сохраняются)
+# SD_ARCHIVE_BATCH          - сколько ответов копить перед записью в БД (500)
+# SD_ARCHIVE_COMPRESS_LEVEL - уровень сжатия zlib, 1-9 (6)
+# SD_REVALIDATE_PAGE        - сколько сущностей --revalidate читает и переписывает за раз (1000)
+SD_ARCHIVE = os.getenv("SD_ARCHIVE", "1") != "0"
+SD_ARCHIVE_BATCH = int(os.getenv("SD_ARCHIVE_BATCH", "500"))
+SD_ARCHIVE_COMPRESS_LEVEL = int(os.getenv("SD_ARCHIVE_COMPRESS_LEVEL", "6"))
+SD_REVALIDATE_PAGE = int(os.getenv("SD_REVALIDATE_PAGE", "1000"))
+
+# Архивируемые метаклассы: валидатор, модель и репозиторий
+ARCHIVED_META_CLASSES = {
+    'objectBase$Server': (clearify_server_data, Server, ServerRepository),
+    'objectBase$Workstation': (clearify_pos_data, Workstation, WorkstationRepository),
+    'objectBase$FR': (clearify_fr_data, FiscalRegister, FiscalRegisterRepository),
+}
+
+
+def compress_payload(payload: Dict[str, Any]) -> bytes:
+    return zlib.compress(json.dumps(payload, ensure_ascii=False, separators=(',', ':')).encode('utf-8'), SD_ARCHIVE_COMPRESS_LEVEL)
+
+
+def decompress_payload(data: bytes) -> Dict[str, Any]:
+    return json.loads(zlib.decompress(data))
+
+
+def archive_item(meta_class: str, payload: Dict[str, Any], fallback_modified: Optional[datetime.datetime] = None) -> Optional[Dict[str, Any]]:
+    """
+    Ответ SD для архива (еще не сжатый) или None, если метакласс не архивируется.
+    Версия - lastModifiedDate ответа, как в last_modified_date строки; без нее - fallback_modified.
+    """
+    if not SD_ARCHIVE or meta_class not in ARCHIVED_META_CLASSES or not payload.get('UUID'):
+        return None
+    modified = parse_sd_datetime(payload['lastModifiedDate']) if payload.get('lastModifiedDate') else None
+    modified = modified or fallback_modified
+    if modified is None:
+        return None
+    return {'uuid': payload['UUID'], 'sd_modified': modified, 'meta_class': meta_class, 'payload': payload}
+
+
+def _compress_items(items: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    fetched_at = datetime.datetime.utcnow()
+    return [{**item, 'payload': compress_payload(item['payload']), 'fetched_at': fetched_at} for item in items]
+
+
+async def write_payloads(session_factory: async_sessionmaker, items: List[Dict[str, Any]]) -> int:
+    """
+    Сжимает (в потоке, чтобы не держать event loop) и записывает ответы в архив пачками
+    по SD_ARCHIVE_BATCH. Ошибка записи не прерывает синхронизацию: архив лишь теряет версии.
+    """
+    written = 0
+    for start in range(0, len(items), SD_ARCHIVE_BATCH):
+        rows = await asyncio.to_thread(_compress_items, items[start:start + SD_ARCHIVE_BATCH])
+        async with session_factory() as session:
+            try:
+                added = await SdPayloadRepository(session).add(rows)
+                if added is None:
+                    await session.rollback()
+                    continue
+                await session.commit()
+                written += added
+            except Exception as e:
+                logger.error(f"Ошибка записи {len(rows)} ответов SD в архив: {e}", exc_info=True)
+                await session.rollback()
+    if written:
+        logger.debug(f"В архив ответов SD записано {written} сущностей.")
+    return written
+
+
+async def _clean_page(meta_class: str, payloads: List[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    """Очищает ответы тем же способом, что и синхронизация: пакетно в пуле процессов, если он включен."""
+    validated = await validate_records(meta_class, payloads)
+    if validated is not None:
+        return validated
+    clearify = ARCHIVED_META_CLASSES[meta_class][0]
+    cleaned = {}
+    for payload in payloads:
+        try:
+            data = clearify(payload)
+        except Exception as e:
+            logger.error(f"Ошибка очистки {meta_class} {payload.get('UUID', 'N/A')} из архива: {e}", exc_info=True)
+            continue
+        if data and data.get('uuid'):
+            cleaned[data['uuid']] = data
+    return cleaned
+
+
+async def revalidate(session_factory: async_sessionmaker) -> Dict[str, Counter]:
+    """
+    Повторная очистка архива (sync_runner.py --revalidate): без запросов к SD.
+    Переписываются строки, у которых content_hash очищенных данных отличается от сохраненного.
+    Версии архива старше строки в БД (архив был выключен) и сущности, которых нет в БД, пропускаются.
+    Возвращает счетчики {meta_class: Counter(archived, unchanged, changed, outdated, missing_in_db, failed)}.
+    """
+    stats: Dict[str, Counter] = {}
+    for meta_class, (_, model, repo_class) in ARCHIVED_META_CLASSES.items():
+        counter = stats.setdefault(meta_class, Counter())
+        after_uuid = ''
+        while True:
+            async with session_factory() as session:
+                rows = await SdPayloadRepository(session).page(meta_class, model, after_uuid, SD_REVALIDATE_PAGE)
+            if not rows:
+                break
+            after_uuid = rows[-1].uuid
+
+            payloads, db_hashes = [], {}
+            for row in rows:
+                if row.uuid in db_hashes:
+                    continue # Более старая версия той же сущности
+                counter['archived'] += 1
+                db_hashes[row.uuid] = row.content_hash
+                if row.last_modified_date is None:
+                    counter['missing_in_db'] += 1
+                elif row.sd_modified < row.last_modified_date:
+                    counter['outdated'] += 1
+                else:
+                    payloads.append(decompress_payload(row.payload))
+            del rows
+
+            cleaned = await _clean_page(meta_class, payloads)
+            counter['failed'] += len(payloads) - len(cleaned)
+            changed = []
+            for uuid, data in cleaned.items():
+                data['content_hash'] = compute_content_hash(data)
+                if data['content_hash'] == db_hashes.get(uuid):
+                    counter['unchanged'] += 1
+                else:
+                    changed.append(data)
+            if not changed:
+                continue
+
+            async with session_factory() as session:
+                try:
+                    updated = await repo_class(session).update_many(changed)
+                    if updated is None:
+                        await session.rollback()
+                        counter['failed'] += len(changed)
+                        continue
+                    await session.commit()
+                    counter['changed'] += updated
+                except Exception as e:
+                    logger.error(f"Ошибка записи {len(changed)} очищенных заново {meta_class}: {e}", exc_info=True)
+                    await session.rollback()
+                    counter['failed'] += len(changed)
+
+        logger.info(
+            f"Повторная очистка {meta_class}: в архиве {counter['archived']}, переписано {counter['changed']}, "
+            f"без изменений {counter['unchanged']}, версия архива старше БД {counter['outdated']}, "
+            f"нет в БД {counter['missing_in_db']}, ошибок {counter['failed']}."
+        )
+    return stats
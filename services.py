@@ -1,10 +1,18 @@
 import httpx
 import asyncio
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Callable
 import logging
-from aiolimiter import AsyncLimiter
 import os
 import datetime
+import random
+import time
+import email.utils
+import json
+import math
+import sys
+import heapq
+import socket
+from collections import Counter
 
 from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
 from sqlalchemy.exc import SQLAlchemyError
@@ -13,17 +21,144 @@ from sqlalchemy import select, or_, and_
 from sqlalchemy.orm import selectinload
 
 # Импортируем валидаторы, которые теперь возвращают snake_case ключи
-from data_validator import clearify_server_data, clearify_pos_data, clearify_fr_data
-from models import Company, Server, Workstation, FiscalRegister
+from data_validator import clearify_server_data, clearify_pos_data, clearify_fr_data, compute_content_hash, parse_sd_datetime
+from models import Company, Server, Workstation, FiscalRegister, SYNC_RUN_DONE, SYNC_RUN_FAILED, SYNC_JOB_DONE, SYNC_JOB_FAILED
 # Импортируем репозитории
-from repositories import CompanyRepository, ServerRepository, WorkstationRepository, FiscalRegisterRepository
+from repositories import (
+    CompanyRepository, ServerRepository, WorkstationRepository, FiscalRegisterRepository, SyncRunRepository,
+    SyncCheckpointRepository, SyncPartitionRepository
+)
+from rate_limiter import AdaptiveLimiter
+from sync_offload import parse_json, validate_records
+import sync_diff
+import sync_checkpoint
+import sync_partitions
+import sd_archive
+from sync_records import ListRecord, REFERENCE_ATTRS, compact_list, to_epoch, from_epoch
+from sync_target import COMPANY_META_CLASS, SyncTarget, company_subtree, uuid_prefix
+from bulk_load import bulk_upsert
+import profiling
+from tracing import get_tracer, get_current_span, traced
+from metrics import (
+    SEARCH_CATEGORY_SECONDS, SD_REQUEST_SECONDS, SD_REQUESTS, SD_LIMITER_WAIT_SECONDS, SD_LIMITER_RATE,
+    DB_COMMIT_SECONDS, SYNC_ENTITIES, SYNC_DURATION_SECONDS, SYNC_LAST_SUCCESS
+)
 
 logger = logging.getLogger("ServiceDeskLogger")
-# Ограничитель запросов к API ServiceDesk
-limiter = AsyncLimiter(45, 1) # 45 запросов в секунду
+# Адаптивный ограничитель запросов к API ServiceDesk.
+# Стартуем с потолка (45 запросов в секунду) и снижаем частоту, если SD не справляется.
+limiter = AdaptiveLimiter(
+    max_rate=float(os.getenv("SD_RATE_LIMIT", "45")),
+    min_rate=float(os.getenv("SD_RATE_LIMIT_MIN", "2")),
+    latency_target=float(os.getenv("SD_LATENCY_TARGET", "2.0"))
+)
+
+# Коды ответа SD, при которых запрос на чтение имеет смысл повторить
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+# Максимальное число повторов одного запроса и пределы экспоненциальной задержки (сек)
+SD_MAX_RETRIES = int(os.getenv("SD_MAX_RETRIES", "4"))
+SD_BACKOFF_BASE = 0.5
+SD_BACKOFF_MAX = 30.0
+# Пауза перед повторной обработкой сущностей из очереди повторов в конце этапа (сек)
+SD_RETRY_QUEUE_DELAY = float(os.getenv("SD_RETRY_QUEUE_DELAY", "5"))
+
+# Полные наборы атрибутов, запрашиваемые для каждого метакласса при получении деталей
+DETAIL_ATTRS = {
+    'ou$company': "adress,UUID,title,lastModifiedDate,additionalName,parent,recipientAgreements",
+    'objectBase$Server': "UniqueID,Teamviewer,RDP,AnyDesk,UUID,IP,CabinetLink,DeviceName,lastModifiedDate,iikoVersion,description,nameforclient,owner,litemanagerID", # Добавил litemanagerID
+    'objectBase$Workstation': "Commentariy,Teamviewer,AnyDesk,DeviceName,litemanagerID,lastModifiedDate,UUID,owner",
+    'objectBase$FR': "UUID,ModelKKT,lastModifiedDate,owner,FFD,FRDownloader,RNKKT,KKTRegDate,FNExpireDate,LegalName,FRSerialNumber,FNNumber"
+}
+
+# Сколько самых долгих сущностей сохранять в отчете о синхронизации (sync_runs.slowest_entities)
+SYNC_RUN_SLOWEST_ENTITIES = int(os.getenv("SYNC_RUN_SLOWEST_ENTITIES", "10"))
+
+# Сколько UUID запрашивать одним find-запросом с фильтром по UUID (ограничено длиной URL)
+SD_DETAILS_BATCH_SIZE = int(os.getenv("SD_DETAILS_BATCH_SIZE", "50"))
+# Сколько полных записей в ответе "стоят" как один отдельный запрос к SD.
+# Используется для оценки стоимости полного списка с атрибутами против точечных запросов.
+SD_FULL_LIST_RECORDS_PER_REQUEST = int(os.getenv("SD_FULL_LIST_RECORDS_PER_REQUEST", "200"))
+
+# Модели по метаклассам SD
+ENTITY_MODELS = {
+    'ou$company': Company,
+    'objectBase$Server': Server,
+    'objectBase$Workstation': Workstation,
+    'objectBase$FR': FiscalRegister
+}
+
+# Репозитории по метаклассам SD
+REPOSITORY_CLASSES = {
+    'ou$company': CompanyRepository,
+    'objectBase$Server': ServerRepository,
+    'objectBase$Workstation': WorkstationRepository,
+    'objectBase$FR': FiscalRegisterRepository
+}
+
+DETAIL_STRATEGY_SINGLE = 'single' # get/{uuid} для каждой сущности
+DETAIL_STRATEGY_BATCH = 'batch' # find/{metaClass}/{"UUID": [...]} пачками
+DETAIL_STRATEGY_FULL_LIST = 'full_list' # повторный find/{metaClass} со всеми атрибутами
+
+
+tracer = get_tracer(__name__)
+
+
+def sd_company_uuid(meta_class: str, sd_item: ListRecord) -> Optional[str]:
+    """UUID компании, к которой относится сущность SD: сама компания или владелец оборудования."""
+    if meta_class == 'ou$company':
+        return sd_item.uuid
+    return sd_item.ref_uuid
+
+
+def choose_detail_strategy(stale_count: int, total_count: int) -> str:
+    """
+    Выбирает самый дешевый способ получить детали stale_count сущностей из total_count.
+    Стоимость считается в "запросах": пачки find по UUID против одного полного списка,
+    который дополнительно перекачивает все неизмененные записи.
+    """
+    if stale_count <= 1:
+        return DETAIL_STRATEGY_SINGLE
+    batch_cost = math.ceil(stale_count / SD_DETAILS_BATCH_SIZE)
+    full_list_cost = 1 + (total_count - stale_count) / SD_FULL_LIST_RECORDS_PER_REQUEST
+    if full_list_cost < batch_cost:
+        return DETAIL_STRATEGY_FULL_LIST
+    return DETAIL_STRATEGY_BATCH
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Разбирает заголовок Retry-After (секунды или HTTP-дата). Возвращает секунды или None."""
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return min(float(value), SD_BACKOFF_MAX * 4)
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=datetime.timezone.utc)
+    delay = (retry_at - datetime.datetime.now(datetime.timezone.utc)).total_seconds()
+    return min(max(delay, 0.0), SD_BACKOFF_MAX * 4)
+
+
+def backoff_delay(attempt: int) -> float:
+    """Экспоненциальная задержка перед повтором с "джиттером", чтобы повторы не шли пачкой."""
+    delay = min(SD_BACKOFF_MAX, SD_BACKOFF_BASE * (2 ** attempt))
+    return delay * (0.5 + random.random() / 2)
 
 from schemas import SearchResultResponse, CompanySearchResult, ServerSearchResult, WorkstationSearchResult, FiscalRegisterSearchResult
 
+# Категория ответа поиска и ее модель по метаклассу (для POST /api/refresh/{uuid})
+SEARCH_RESULT_CATEGORIES = {
+    'ou$company': ('companies', CompanySearchResult),
+    'objectBase$Server': ('servers', ServerSearchResult),
+    'objectBase$Workstation': ('workstations', WorkstationSearchResult),
+    'objectBase$FR': ('fiscal_registers', FiscalRegisterSearchResult),
+}
+# Сколько отсутствующих в БД компаний выше по иерархии догружать при обновлении сущности из интерфейса
+REFRESH_MAX_OWNER_DEPTH = int(os.getenv("REFRESH_MAX_OWNER_DEPTH", "10"))
+
 class ServiceDeskService:
     # Удаляем session_factory из __init__
     def __init__(self):
@@ -34,7 +169,130 @@ class ServiceDeskService:
              logger.critical("Переменные окружения BASE_URL или SDKEY не установлены. Работа с ServiceDesk API невозможна.")
              # Можно выбросить исключение или обрабатывать ошибки при каждом запросе.
              # Пока просто логгируем, ошибки будут возникать при попытке HTTP запросов.
+        # Очередь сущностей, детали которых не удалось получить. Повторяются в конце этапа синхронизации.
+        self.retry_queue: List[Dict[str, Any]] = []
+        # Хеши содержимого из БД {meta_class: {uuid: content_hash}}, собираются в начале синхронизации
+        self.db_content_hashes: Dict[str, Dict[str, Optional[str]]] = {}
+        # Сущности, у которых изменилась только дата в SD: {meta_class: [{'b_uuid', 'b_last_modified_date'}]}
+        self.pending_touches: Dict[str, List[Dict[str, Any]]] = {}
+        # Полученные детали для архива ответов SD (sd_archive.archive_item), пишутся пачками
+        self.pending_payloads: List[Dict[str, Any]] = []
+        # Счетчики синхронизации по метаклассам: listed, unchanged, fetched, created, updated, content_unchanged, failed
+        self.sync_stats: Dict[str, Counter] = {}
+        # Данные для отчета о запуске (sync_runs): запросы к SD, полученные байты, время этапов, самые долгие сущности
+        self.run_http_requests = 0
+        self.run_bytes_downloaded = 0
+        self.stage_timings: Dict[str, float] = {}
+        self._stage_mark = time.monotonic()
+        self._slowest_entities: List[tuple] = [] # min-куча (секунды, meta_class, uuid)
+        # Запуск sync_runs текущей синхронизации и его контрольная точка (sync_checkpoint.py)
+        self._run_id: Optional[int] = None
+        self._checkpoint: Optional[sync_checkpoint.SyncCheckpoint] = None
+        # Вызывается с id запуска, когда его части готовы для воркеров (sync_runner.py запускает процессы)
+        self.on_partitions: Optional[Callable[[int], None]] = None
+
+    def _count(self, meta_class: str, key: str, amount: int = 1):
+        """Увеличивает счетчик синхронизации для метакласса."""
+        self.sync_stats.setdefault(meta_class, Counter())[key] += amount
+        SYNC_ENTITIES.inc(amount, meta_class=meta_class, result=key)
+
+    def _fail(self, meta_class: str, uuid: str, reason: str):
+        """Сущность не сохранена: счетчик failed и отметка в контрольной точке для повтора в следующих запусках."""
+        self._count(meta_class, 'failed')
+        if self._checkpoint is not None:
+            self._checkpoint.failed(meta_class, uuid, reason)
+
+    def _mark_stage(self, stage: str):
+        """Записывает время этапа синхронизации: от предыдущей отметки до текущего момента."""
+        now = time.monotonic()
+        self.stage_timings[stage] = round(self.stage_timings.get(stage, 0.0) + now - self._stage_mark, 3)
+        # Этап уже прошел, поэтому span создается задним числом с началом в предыдущей отметке
+        end_time = time.time_ns()
+        tracer.start_span('sync.stage', {'stage': stage}, start_time=end_time - int((now - self._stage_mark) * 1e9)).end(end_time)
+        self._stage_mark = now
+
+    def _record_entity_time(self, meta_class: str, uuid: Optional[str], seconds: float):
+        """Оставляет в куче SYNC_RUN_SLOWEST_ENTITIES самых долгих сущностей."""
+        item = (seconds, meta_class, uuid or '')
+        if len(self._slowest_entities) < SYNC_RUN_SLOWEST_ENTITIES:
+            heapq.heappush(self._slowest_entities, item)
+        elif seconds > self._slowest_entities[0][0]:
+            heapq.heapreplace(self._slowest_entities, item)
+
+    def build_run_report(self) -> Dict[str, Any]:
+        """Итоги текущей синхронизации для записи в sync_runs."""
+        return {
+            'stats': {meta_class: dict(stats) for meta_class, stats in self.sync_stats.items()},
+            'http_requests': self.run_http_requests,
+            'bytes_downloaded': self.run_bytes_downloaded,
+            'stage_timings': dict(self.stage_timings),
+            'slowest_entities': [
+                {'meta_class': meta_class, 'uuid': uuid, 'seconds': round(seconds, 3)}
+                for seconds, meta_class, uuid in sorted(self._slowest_entities, reverse=True)
+            ],
+        }
+
+    def log_sync_stats(self):
+        """Пишет в лог итоговую статистику синхронизации по каждому метаклассу."""
+        for meta_class, stats in self.sync_stats.items():
+            bulk = f", массовой загрузкой сохранено {stats['bulk_saved']}, без компании {stats['orphaned']}" if 'bulk_saved' in stats else ""
+            if 'resumed' in stats or 'backed_off' in stats:
+                bulk += f", продолжено после прерывания {stats['resumed']}, отложено после неудач {stats['backed_off']}"
+            logger.info(
+                f"Статистика {meta_class}: в списке SD {stats['listed']}, без изменений {stats['unchanged']}, "
+                f"получено деталей {stats['fetched']}, создано {stats['created']}, обновлено {stats['updated']}, "
+                f"изменилась только дата {stats['content_unchanged']}, ошибок {stats['failed']}{bulk}."
+            )
 
+    async def _request(self, client: httpx.AsyncClient, method: str, url: str, params: Dict[str, Any], operation: str = 'get') -> httpx.Response:
+        """
+        Выполняет запрос на чтение к ServiceDesk через адаптивный лимитер.
+        operation (list, get, batch, agreement) - метка для метрик sd_request_*.
+        При таймаутах, сетевых ошибках, 429 и 5xx повторяет запрос с экспоненциальной
+        задержкой (не более SD_MAX_RETRIES раз), учитывая Retry-After.
+        Используется только для идемпотентных запросов (get и find).
+        Если повторы исчерпаны, пробрасывает последнее исключение httpx.
+        """
+        for attempt in range(SD_MAX_RETRIES + 1):
+            SD_LIMITER_WAIT_SECONDS.observe(await limiter.acquire())
+            SD_LIMITER_RATE.set(limiter.rate)
+            started = time.monotonic()
+            self.run_http_requests += 1
+            try:
+                response = await client.request(method, url, params=params)
+            except httpx.TransportError as e: # Включает httpx.TimeoutException
+                SD_REQUEST_SECONDS.observe(time.monotonic() - started, operation=operation)
+                SD_REQUESTS.inc(operation=operation, status=type(e).__name__)
+                limiter.record_failure()
+                if attempt >= SD_MAX_RETRIES:
+                    raise
+                delay = backoff_delay(attempt)
+                logger.warning(f"Ошибка запроса к SD {url} ({type(e).__name__}). Повтор {attempt + 1}/{SD_MAX_RETRIES} через {delay:.1f}с.")
+                await asyncio.sleep(delay)
+                continue
+
+            latency = time.monotonic() - started
+            self.run_bytes_downloaded += len(response.content)
+            SD_REQUEST_SECONDS.observe(latency, operation=operation)
+            SD_REQUESTS.inc(operation=operation, status=str(response.status_code))
+            if response.status_code in RETRYABLE_STATUS_CODES:
+                retry_after = parse_retry_after(response.headers.get('Retry-After'))
+                if response.status_code in (429, 503):
+                    limiter.record_throttle(retry_after)
+                else:
+                    limiter.record_failure()
+                if attempt >= SD_MAX_RETRIES:
+                    response.raise_for_status() # Выбросит httpx.HTTPStatusError
+                delay = retry_after if retry_after is not None else backoff_delay(attempt)
+                logger.warning(f"SD вернул статус {response.status_code} для {url}. Повтор {attempt + 1}/{SD_MAX_RETRIES} через {delay:.1f}с.")
+                await asyncio.sleep(delay)
+                continue
+
+            limiter.record_success(latency)
+            response.raise_for_status() # Выбросит исключение для остальных кодов 4xx/5xx
+            return response
+
+    @traced('sd.check_agreement_active', lambda self, client, agreement_data: {'agreement': agreement_data.get('UUID')})
     async def check_agreement_active(self, client: httpx.AsyncClient, agreement_data: dict) -> bool:
         """Проверка активности контракта по его UUID."""
         agreement_uuid = agreement_data.get('UUID')
@@ -53,9 +311,8 @@ class ServiceDeskService:
                  logger.error("Отсутствуют ключи доступа к ServiceDesk API. Пропуск проверки контракта.")
                  return False
 
-            async with limiter: # Применяем ограничение частоты запросов
-                response = await client.get(agreement_url, params=agreement_params)
-            response.raise_for_status() # Выбросит исключение для кодов 4xx/5xx
+            # Ограничение частоты и повторы при временных ошибках выполняются в _request
+            response = await self._request(client, "GET", agreement_url, agreement_params, operation='agreement')
             agreement_info = response.json()
             logger.debug(f"Проверка статуса контракта: {agreement_uuid}, статус: {agreement_info.get('state')}")
             return agreement_info.get('state') == 'active'
@@ -69,12 +326,18 @@ class ServiceDeskService:
             logger.error(f"Ошибка при получении контракта {agreement_uuid}: {e}", exc_info=True)
             return False
 
-    async def fetch_entity_list(self, client: httpx.AsyncClient, meta_class: str, attrs: str) -> List[Dict]:
+    @traced('sd.fetch_entity_list', lambda self, client, meta_class, attrs, search=None, raise_errors=False: {'meta_class': meta_class})
+    async def fetch_entity_list(self, client: httpx.AsyncClient, meta_class: str, attrs: str, search: Optional[Dict] = None, raise_errors: bool = False) -> List[Dict]:
         """
         Получение списка сущностей определенного метакласса из ServiceDesk
         с минимальными атрибутами (UUID, lastModifiedDate, owner/parent).
+        search - фильтр find по атрибутам ({'owner': [UUID, ...]}), значение-список означает "любое из".
+        Ошибка запроса пишется в лог, и возвращается пустой список; с raise_errors она пробрасывается,
+        чтобы вызывающий мог отличить ошибку от пустого ответа.
         """
         url = f"{self.base_api_url}find/{meta_class}"
+        if search:
+            url = f"{url}/{json.dumps(search, separators=(',', ':'))}"
         payload = {
             "accessKey": self.access_key,
             "attrs": attrs # Запрашиваем только необходимые атрибуты для инкрементальной проверки
@@ -85,33 +348,100 @@ class ServiceDeskService:
                  logger.error("Отсутствуют ключи доступа к ServiceDesk API. Пропуск получения списка.")
                  return []
 
-            async with limiter: # Применяем ограничение частоты запросов
-                response = await client.post(url, params=payload)
-            response.raise_for_status() # Выбросит исключение для кодов 4xx/5xx
-            logger.info(f"Успешно получен список сущностей для метакласса: {meta_class}, количество: {len(response.json())}")
-            return response.json()
+            # find только читает данные, поэтому его тоже безопасно повторять
+            response = await self._request(client, "POST", url, payload, operation='list')
+            # Списки бывают большими: разбор JSON при включенном пуле выполняется вне event loop
+            entity_list = await parse_json(response.content)
+            get_current_span().set_attribute('count', len(entity_list))
+            logger.info(f"Успешно получен список сущностей для метакласса: {meta_class}, количество: {len(entity_list)}")
+            return entity_list
         except httpx.TimeoutException as e:
             logger.error(f"Таймаут при получении списка {meta_class}: {e}")
+            if raise_errors:
+                raise
             return []
         except httpx.HTTPStatusError as e:
              logger.error(f"Ошибка HTTP при получении списка {meta_class} (Статус: {e.response.status_code}): {e}")
+             if raise_errors:
+                 raise
              return []
         except Exception as e:
             logger.error(f"Произошла ошибка при получении списка {meta_class}: {e}", exc_info=True)
+            if raise_errors:
+                raise
             return []
 
+    async def fetch_list_records(self, client: httpx.AsyncClient, meta_class: str, attrs: str) -> List[ListRecord]:
+        """
+        Список сущностей метакласса в компактном виде (см. sync_records). Разобранный JSON
+        освобождается сразу после преобразования, а не держится до конца синхронизации.
+        """
+        return compact_list(meta_class, await self.fetch_entity_list(client, meta_class, attrs))
+
+    async def fetch_list_records_by(self, client: httpx.AsyncClient, meta_class: str, attrs: str, attr: str, values: List[str]) -> List[ListRecord]:
+        """
+        Список сущностей метакласса, у которых атрибут attr равен одному из values (UUID, владелец).
+        Запросы идут пачками по SD_DETAILS_BATCH_SIZE значений: фильтр передается в URL.
+        Значения пачки, список которой не получен, считаются в failed метакласса: иначе их
+        нельзя отличить от сущностей, которых в SD нет.
+        """
+        records = []
+        for start in range(0, len(values), SD_DETAILS_BATCH_SIZE):
+            chunk = values[start:start + SD_DETAILS_BATCH_SIZE]
+            try:
+                entity_list = await self.fetch_entity_list(client, meta_class, attrs, search={attr: chunk}, raise_errors=True)
+            except Exception:
+                self._count(meta_class, 'failed', len(chunk))
+                continue
+            records.extend(compact_list(meta_class, entity_list))
+        return records
+
+    async def fetch_target_lists(self, client: httpx.AsyncClient, sync_configs: Dict[str, Dict], target: SyncTarget) -> Dict[str, List[ListRecord]]:
+        """
+        Списки SD для выборочной синхронизации (см. sync_target): только метаклассы цели
+        и только сущности цели. Возвращает {meta_class: [ListRecord]}.
+        """
+        list_attrs = {mc: config['list_attrs'] for stage in sync_configs.values() for mc, config in stage['configs'].items()}
+        meta_classes = [mc for stage in sync_configs.values() for mc in stage['meta_classes'] if target.includes(mc)]
+        owners = None
+        if target.company_uuid:
+            # Дочерние компании находятся по полному списку компаний: он небольшой, а find не ищет по иерархии
+            companies = await self.fetch_list_records(client, COMPANY_META_CLASS, list_attrs[COMPANY_META_CLASS])
+            owners = company_subtree(companies, target.company_uuid)
+            if not any(record.uuid == target.company_uuid for record in companies):
+                logger.warning(f"Компания {target.company_uuid} не найдена в списке компаний SD.")
+            companies = [record for record in companies if record.uuid in owners]
+            logger.info(f"Компания {target.company_uuid}: вместе с дочерними {len(companies)} компаний.")
+
+        async def fetch(meta_class: str) -> List[ListRecord]:
+            attrs = list_attrs[meta_class]
+            if owners is not None:
+                if meta_class == COMPANY_META_CLASS:
+                    records = companies
+                else:
+                    records = await self.fetch_list_records_by(client, meta_class, attrs, 'owner', sorted(owners))
+                if target.uuids is not None:
+                    wanted = set(target.uuids)
+                    records = [record for record in records if record.uuid in wanted]
+                return records
+            if target.by_uuid:
+                return await self.fetch_list_records_by(client, meta_class, attrs, 'UUID', target.uuids_for(meta_class))
+            return await self.fetch_list_records(client, meta_class, attrs)
+
+        results = await asyncio.gather(*(fetch(mc) for mc in meta_classes))
+        lists = {}
+        for meta_class, records in zip(meta_classes, results):
+            lists[meta_class] = target.filter_since(records)
+            self._count(meta_class, 'listed', len(lists[meta_class]))
+            logger.info(f"Выборочная синхронизация: {meta_class} - {len(lists[meta_class])} сущностей.")
+        return lists
+
+    @traced('sd.fetch_entity_details', lambda self, client, uuid, meta_class: {'meta_class': meta_class, 'uuid': uuid})
     async def fetch_entity_details(self, client: httpx.AsyncClient, uuid: str, meta_class: str) -> Optional[Dict]:
         """Получение полной информации о конкретной сущности по UUID."""
         url = f"{self.base_api_url}get/{uuid}"
         # Определяем, какие атрибуты нужны для каждого метакласса
-        # Используем словарь аттрибутов
-        attrs_map = {
-            'ou$company': "adress,UUID,title,lastModifiedDate,additionalName,parent,recipientAgreements",
-            'objectBase$Server': "UniqueID,Teamviewer,RDP,AnyDesk,UUID,IP,CabinetLink,DeviceName,lastModifiedDate,iikoVersion,description,nameforclient,owner,litemanagerID", # Добавил litemanagerID
-            'objectBase$Workstation': "Commentariy,Teamviewer,AnyDesk,DeviceName,litemanagerID,lastModifiedDate,UUID,owner",
-            'objectBase$FR': "UUID,ModelKKT,lastModifiedDate,owner,FFD,FRDownloader,RNKKT,KKTRegDate,FNExpireDate,LegalName,FRSerialNumber,FNNumber"
-        }
-        attrs = attrs_map.get(meta_class)
+        attrs = DETAIL_ATTRS.get(meta_class)
         if not attrs:
             logger.warning(f"Неизвестный метакласс для получения деталей: {meta_class}. UUID: {uuid}. Пропуск.")
             return None
@@ -126,9 +456,7 @@ class ServiceDeskService:
                  logger.error(f"Отсутствуют ключи доступа к ServiceDesk API. Пропуск получения деталей для {meta_class} {uuid}.")
                  return None
 
-            async with limiter: # Применяем ограничение частоты запросов
-                response = await client.get(url, params=params)
-            response.raise_for_status() # Выбросит исключение для кодов 4xx/5xx
+            response = await self._request(client, "GET", url, params, operation='get')
             logger.debug(f"Успешно получены детали для {meta_class} {uuid}")
             return response.json()
         except httpx.TimeoutException as e:
@@ -141,6 +469,73 @@ class ServiceDeskService:
             logger.error(f"Ошибка при получении деталей {meta_class} {uuid}: {e}", exc_info=True)
             return None
 
+    @traced('sd.fetch_entity_details_batch', lambda self, client, meta_class, uuids: {'meta_class': meta_class, 'count': len(uuids)})
+    async def fetch_entity_details_batch(self, client: httpx.AsyncClient, meta_class: str, uuids: List[str]) -> Dict[str, Dict]:
+        """
+        Получение полной информации сразу о нескольких сущностях одного метакласса
+        через find с фильтром по UUID. Запросы идут пачками по SD_DETAILS_BATCH_SIZE.
+        Возвращает словарь {uuid: детали}. Сущности из неудавшихся пачек в словарь
+        не попадают, их детали затем запрашиваются по одной через fetch_entity_details.
+        """
+        attrs = DETAIL_ATTRS.get(meta_class)
+        if not attrs or not uuids:
+            return {}
+        if not self.access_key or not self.base_api_url:
+            logger.error(f"Отсутствуют ключи доступа к ServiceDesk API. Пропуск пакетного получения деталей для {meta_class}.")
+            return {}
+
+        details = {}
+        for start in range(0, len(uuids), SD_DETAILS_BATCH_SIZE):
+            chunk = uuids[start:start + SD_DETAILS_BATCH_SIZE]
+            search_attrs = json.dumps({'UUID': chunk}, separators=(',', ':'))
+            url = f"{self.base_api_url}find/{meta_class}/{search_attrs}"
+            params = {
+                "accessKey": self.access_key,
+                "attrs": attrs
+            }
+            try:
+                response = await self._request(client, "POST", url, params, operation='batch')
+                for item in await parse_json(response.content):
+                    if isinstance(item, dict) and item.get('UUID'):
+                        details[item['UUID']] = item
+            except httpx.TimeoutException as e:
+                logger.error(f"Таймаут при пакетном получении деталей {meta_class} ({len(chunk)} UUID): {e}")
+            except httpx.HTTPStatusError as e:
+                logger.error(f"Ошибка HTTP при пакетном получении деталей {meta_class} (Статус: {e.response.status_code}): {e}")
+            except Exception as e:
+                logger.error(f"Ошибка при пакетном получении деталей {meta_class}: {e}", exc_info=True)
+
+        logger.info(f"Пакетно получены детали для {len(details)} из {len(uuids)} сущностей {meta_class}.")
+        return details
+
+    def _entity_needs_update(self, sd_item: ListRecord, db_entity_dates: Dict[str, int]) -> bool:
+        """Быстрая проверка без логирования: отсутствует ли сущность в БД или изменена ли в SD."""
+        db_last_modified = db_entity_dates.get(sd_item.uuid)
+        return db_last_modified is None or db_last_modified < sd_item.modified
+
+    async def prefetch_entity_details(self, client: httpx.AsyncClient, meta_class: str, sd_list: List[ListRecord], db_entity_dates: Dict[str, int], total_count: Optional[int] = None) -> Dict[str, Dict]:
+        """
+        Заранее получает детали всех новых и измененных сущностей метакласса самым
+        дешевым способом (см. choose_detail_strategy). Возвращает словарь {uuid: детали},
+        который передается в process_and_save_entity вместо запросов get/{uuid} по одному.
+        total_count - размер полного списка в SD, если sd_list уже содержит только изменения.
+        """
+        stale_uuids = [item.uuid for item in sd_list if self._entity_needs_update(item, db_entity_dates)]
+        total_count = total_count if total_count is not None else len(sd_list)
+        strategy = choose_detail_strategy(len(stale_uuids), total_count)
+        logger.info(f"Метакласс {meta_class}: изменено {len(stale_uuids)} из {total_count}, способ получения деталей: {strategy}.")
+
+        if strategy == DETAIL_STRATEGY_SINGLE:
+            return {} # Детали будут запрошены по одной в process_and_save_entity
+        if strategy == DETAIL_STRATEGY_BATCH:
+            return await self.fetch_entity_details_batch(client, meta_class, stale_uuids)
+
+        # Доля измененных велика: дешевле один раз выгрузить весь список с полными атрибутами
+        full_list = await self.fetch_entity_list(client, meta_class, DETAIL_ATTRS[meta_class])
+        stale_set = set(stale_uuids)
+        return {item['UUID']: item for item in full_list if isinstance(item, dict) and item.get('UUID') in stale_set}
+
+    @traced('process.company', lambda self, client, data: {'uuid': data.get('UUID'), 'company': data.get('UUID')})
     async def process_company_data(self, client: httpx.AsyncClient, company_data: Dict) -> Optional[Dict]:
         """
         Обработка данных компании: проверка контракта, подготовка данных для репозитория.
@@ -170,7 +565,7 @@ class ServiceDeskService:
                 'title': company_data.get('title'),
                 'address': company_data.get('adress'),
                 # lastModifiedDate парсится здесь
-                'last_modified_date': datetime.datetime.strptime(company_data['lastModifiedDate'], "%Y.%m.%d %H:%M:%S") if company_data.get('lastModifiedDate') else None,
+                'last_modified_date': parse_sd_datetime(company_data['lastModifiedDate']) if company_data.get('lastModifiedDate') else None,
                 'additional_name': company_data.get('additionalName'),
                 # Исправление ошибки: проверяем, что parent не None перед вызовом .get('UUID')
                 'parent_uuid': company_data.get('parent', None).get('UUID') if company_data.get('parent') else None,
@@ -187,6 +582,7 @@ class ServiceDeskService:
     # которые сами добавляют last_modified_date и owner_id в snake_case формате.
     # Эти функции просто вызывают валидаторы.
 
+    @traced('process.server', lambda self, data: {'uuid': data.get('UUID'), 'company': (data.get('owner') or {}).get('UUID')})
     async def process_server_data(self, server_data: Dict) -> Optional[Dict]:
         """
         Обработка данных сервера: валидация, подготовка данных для репозитория.
@@ -202,6 +598,7 @@ class ServiceDeskService:
             logger.error(f"Ошибка при обработке данных сервера {server_data.get('UUID', 'N/A')}: {e}", exc_info=True)
             return None
 
+    @traced('process.workstation', lambda self, data: {'uuid': data.get('UUID'), 'company': (data.get('owner') or {}).get('UUID')})
     async def process_workstation_data(self, workstation_data: Dict) -> Optional[Dict]:
         """
         Обработка данных рабочей станции: валидация, подготовка данных для репозитория.
@@ -217,6 +614,7 @@ class ServiceDeskService:
             logger.error(f"Ошибка при обработке данных рабочей станции {workstation_data.get('UUID', 'N/A')}: {e}", exc_info=True)
             return None
 
+    @traced('process.fr', lambda self, data: {'uuid': data.get('UUID'), 'company': (data.get('owner') or {}).get('UUID')})
     async def process_fr_data(self, fr_data: Dict) -> Optional[Dict]:
         """
         Обработка данных ФР: валидация, подготовка данных для репозитория.
@@ -233,70 +631,202 @@ class ServiceDeskService:
             return None
 
 
+    def _reset_run_state(self):
+        """Сбрасывает очереди, счетчики и замеры перед новым запуском синхронизации."""
+        self.retry_queue = []
+        self.db_content_hashes = {}
+        self.pending_touches = {}
+        self.pending_payloads = []
+        self.sync_stats = {}
+        self.run_http_requests = 0
+        self.run_bytes_downloaded = 0
+        self.stage_timings = {}
+        self._slowest_entities = []
+        self._stage_mark = time.monotonic()
+        self._checkpoint = None
+
+    def build_sync_configs(self) -> Dict[str, Dict]:
+        """Метаклассы по этапам синхронизации, их атрибуты списков, репозитории и функции обработки."""
+        # Определяем, какие метаклассы мы синхронизируем, их атрибуты и функции обработки
+        # Группируем по этапам
+        return {
+            'companies': {
+                'meta_classes': ['ou$company'],
+                'configs': {
+                    'ou$company': {
+                        # Добавил parent в list_attrs для проверки иерархии на этапе списка
+                        'list_attrs': "UUID,lastModifiedDate,title,parent",
+                        'repo_class': CompanyRepository,
+                        'process_func': self.process_company_data,
+                        'db_model_class': Company
+                    }
+                }
+            },
+            'equipment': {
+                'meta_classes': ['objectBase$Server', 'objectBase$Workstation', 'objectBase$FR'],
+                'configs': {
+                    'objectBase$Server': {
+                        'list_attrs': "UUID,lastModifiedDate,owner,DeviceName",
+                        'repo_class': ServerRepository,
+                        'process_func': self.process_server_data,
+                        'db_model_class': Server
+                    },
+                    'objectBase$Workstation': {
+                        'list_attrs': "UUID,lastModifiedDate,owner,DeviceName",
+                        'repo_class': WorkstationRepository,
+                        'process_func': self.process_workstation_data,
+                        'db_model_class': Workstation
+                    },
+                    'objectBase$FR': {
+                        'list_attrs': "UUID,lastModifiedDate,owner,RNKKT",
+                        'repo_class': FiscalRegisterRepository,
+                        'process_func': self.process_fr_data,
+                        'db_model_class': FiscalRegister
+                    }
+                }
+            }
+            # TODO: Добавить другие этапы, если появятся сущности с другими зависимостями
+        }
+
+    async def sync_equipment(self, client: httpx.AsyncClient, session_factory: async_sessionmaker, sync_configs: Dict[str, Dict],
+                             sd_entity_lists_raw: Dict[str, List[ListRecord]], db_uuids_with_dates: Dict[str, Dict[str, int]],
+                             db_company_uuids: set, list_totals: Dict[str, Optional[int]]):
+        """
+        Этап 'Оборудование': детали нового и измененного оборудования, валидация и сохранение.
+        Оборудование сохраняется, только если его владелец есть в db_company_uuids.
+        """
+        # Этап 2: Синхронизация Оборудования (Серверы, Рабочие станции, ФР)
+        logger.info("Начало этапа синхронизации: Оборудование")
+        equipment_meta_classes = sync_configs['equipment']['meta_classes']
+        equipment_update_tasks = []
+
+        # Детали нового и измененного оборудования получаем заранее для всех метаклассов параллельно
+        prefetch_meta_classes = [mc for mc in equipment_meta_classes if sd_entity_lists_raw.get(mc)]
+        prefetch_results = await asyncio.gather(*(
+            self.prefetch_entity_details(client, mc, sd_entity_lists_raw[mc], db_uuids_with_dates.get(mc, {}), total_count=list_totals.get(mc))
+            for mc in prefetch_meta_classes
+        ))
+        prefetched_equipment_details = dict(zip(prefetch_meta_classes, prefetch_results))
+        # Полученные пачкой детали валидируем в пуле процессов (если он включен), не блокируя event loop
+        validation_results = await asyncio.gather(*(
+            validate_records(mc, list(prefetched_equipment_details[mc].values()))
+            for mc in prefetch_meta_classes
+        ))
+        prevalidated_equipment = dict(zip(prefetch_meta_classes, validation_results))
+        self._mark_stage('equipment_prefetch')
+
+        # Итерируем по метаклассам оборудования
+        for meta_class in equipment_meta_classes:
+             # Получаем список сущностей для этого метакласса, если он был успешно получен
+             sd_list = sd_entity_lists_raw.get(meta_class, [])
+             if meta_class not in sd_entity_lists_raw:
+                 continue # Метакласс не входит в выборочную синхронизацию или в продолжаемый запуск
+             if not sd_list:
+                 logger.warning(f"Список сущностей для метакласса {meta_class} пуст или не был получен из SD. Пропуск обработки на этапе 'Оборудование'.")
+                 continue
+
+             # Получаем полную конфигурацию для этого метакласса
+             config = sync_configs['equipment']['configs'].get(meta_class)
+             if not config or not config.get('repo_class') or not config.get('process_func') or not config.get('db_model_class'):
+                  logger.warning(f"Неполная конфигурация для метакласса {meta_class} на этапе 'Оборудование'. Пропуск обработки.")
+                  continue
+
+             # Создаем задачи для обработки и сохранения каждой сущности оборудования
+             for sd_item in sd_list:
+                  item_uuid = sd_item.uuid
+
+                  # Проверка: существует ли владелец этого оборудования в БД?
+                  # Это важно, т.к. оборудование привязывается к компании.
+                  owner_uuid = sd_item.ref_uuid
+
+                  # Пропускаем сущность оборудования, если у нее нет владельца в SD (owner_uuid is None)
+                  # ИЛИ если владелец указан, но не найден в нашем наборе синхронизированных компаний.
+                  if owner_uuid is None:
+                      logger.warning(f"Сущность {meta_class} {item_uuid} не имеет указанного владельца в ServiceDesk. Пропуск обработки.")
+                      continue # Пропускаем эту единицу оборудования
+
+                  if owner_uuid not in db_company_uuids:
+                      # Владелец указан, но не найден в БД после этапа синхронизации компаний.
+                      logger.warning(f"Владелец компании с UUID {owner_uuid} для сущности {meta_class} {item_uuid} указан в SD, но не найден в БД после этапа компаний. Пропуск обработки этой сущности.")
+                      continue # Пропускаем эту единицу оборудования
+
+                  # Если владелец есть в БД (или владелец не указан в SD),
+                  # добавляем задачу на обработку
+                  equipment_update_tasks.append(self.process_and_save_entity(
+                      client,
+                      meta_class,
+                      sd_item,
+                      config,
+                      db_uuids_with_dates.get(meta_class, {}), # Словарь дат для этого метакласса оборудования
+                      session_factory,
+                      prefetched_details=prefetched_equipment_details.get(meta_class),
+                      prevalidated=prevalidated_equipment.get(meta_class)
+                  ))
+
+        # Выполняем все задачи для этапа оборудования параллельно
+        if equipment_update_tasks:
+            logger.info(f"Запущено {len(equipment_update_tasks)} задач синхронизации для этапа 'Оборудование'.")
+            # Собираем результаты, хотя UUID оборудования нам не нужны для дальнейших этапов
+            equipment_results = await asyncio.gather(*equipment_update_tasks)
+            successfully_processed_equipment_count = len([uuid for uuid in equipment_results if uuid is not None])
+            # Повторяем оборудование, детали которого не удалось получить с первой попытки
+            successfully_processed_equipment_count += len(await self.process_retry_queue(client, session_factory, equipment_meta_classes))
+            logger.info(f"Этап синхронизации 'Оборудование' завершен. Успешно сохранено/обновлено: {successfully_processed_equipment_count}")
+        else:
+            logger.info("Нет задач для выполнения на этапе синхронизации 'Оборудование'.")
+        self._mark_stage('equipment')
+
     # Принимаем session_factory в качестве аргумента
-    async def sync_data_incrementally(self, session_factory: async_sessionmaker):
+    async def sync_data_incrementally(self, session_factory: async_sessionmaker, workers: int = 1, target: Optional[SyncTarget] = None):
         """
         Инкрементальная синхронизация данных по этапам:
         1. Компании.
         2. Оборудование (Серверы, Рабочие станции, ФР).
         Это гарантирует наличие компаний-владельцев перед синхронизацией оборудования.
         Использует переданную фабрику сессий для создания сессий внутри.
+        workers > 1 - оборудование делится на части для нескольких воркеров (run_partitions).
+        target - выборочная синхронизация: списки из SD только для цели (fetch_target_lists).
         """
 
         async with httpx.AsyncClient(timeout=httpx.Timeout(60.0)) as client: # Увеличил таймаут
-            logger.info("Начало инкрементальной синхронизации данных (поэтапно)")
-
-            # Определяем, какие метаклассы мы синхронизируем, их атрибуты и функции обработки
-            # Группируем по этапам
-            sync_configs = {
-                'companies': {
-                    'meta_classes': ['ou$company'],
-                    'configs': {
-                        'ou$company': {
-                            # Добавил parent в list_attrs для проверки иерархии на этапе списка
-                            'list_attrs': "UUID,lastModifiedDate,title,parent",
-                            'repo_class': CompanyRepository,
-                            'process_func': self.process_company_data,
-                            'db_model_class': Company
-                        }
-                    }
-                },
-                'equipment': {
-                    'meta_classes': ['objectBase$Server', 'objectBase$Workstation', 'objectBase$FR'],
-                    'configs': {
-                        'objectBase$Server': {
-                            'list_attrs': "UUID,lastModifiedDate,owner,DeviceName",
-                            'repo_class': ServerRepository,
-                            'process_func': self.process_server_data,
-                            'db_model_class': Server
-                        },
-                        'objectBase$Workstation': {
-                            'list_attrs': "UUID,lastModifiedDate,owner,DeviceName",
-                            'repo_class': WorkstationRepository,
-                            'process_func': self.process_workstation_data,
-                            'db_model_class': Workstation
-                        },
-                        'objectBase$FR': {
-                            'list_attrs': "UUID,lastModifiedDate,owner,RNKKT",
-                            'repo_class': FiscalRegisterRepository,
-                            'process_func': self.process_fr_data,
-                            'db_model_class': FiscalRegister
-                        }
-                    }
-                }
-                # TODO: Добавить другие этапы, если появятся сущности с другими зависимостями
-            }
+            logger.info(f"Начало инкрементальной синхронизации данных (поэтапно){f', выборочно: {target.describe()}' if target else ''}")
+            self._reset_run_state()
+
+            sync_configs = self.build_sync_configs()
 
             # Собираем UUID всех сущностей из БД перед синхронизацией
             # Это нужно для быстрой проверки даты изменения без получения полного объекта
             db_uuids_with_dates = {}
             db_all_uuids = {} # Дополнительно собираем все UUID из БД для проверки на удаление (хотя удаление пока отключено)
+            # Прерванный запуск продолжается по его контрольной точке, без повторного получения списков из SD.
+            # Выборочный запуск контрольную точку не ведет и чужую не продолжает
+            resumed = None
+            if sync_checkpoint.SYNC_CHECKPOINTS and self._run_id is not None and target is None:
+                self._checkpoint = sync_checkpoint.SyncCheckpoint(session_factory, self._run_id)
+                resumed = await self._checkpoint.resume()
+                if resumed is None:
+                    await self._checkpoint.load_failures()
+            # Части для воркеров берутся из контрольной точки, без нее делить нечего
+            partitioned = workers > 1 and self._checkpoint is not None
+            if workers > 1 and not partitioned:
+                logger.warning("Синхронизация несколькими воркерами требует контрольных точек (SYNC_CHECKPOINTS). Выполняется одним процессом.")
+            # При поиске изменений в БД (SYNC_DIFF_ENGINE=sql) снимок не загружается:
+            # даты и хеши устаревших сущностей вернет compute_sync_diff после получения списков.
+            # При продолжении списков нет, поэтому нужен снимок. Выборочному запуску снимок всей БД
+            # не нужен: его списки малы, и сравнение во временной таблице всегда дешевле
+            use_sql_diff = (sync_diff.SYNC_DIFF_ENGINE == 'sql' or target is not None) and resumed is None
+            # Компании из БД, на которые ссылаются устаревшие сущности (только для SQL-поиска изменений)
+            known_company_uuids = set()
             logger.info("Сбор текущих UUID и дат изменения из локальной БД.")
             # Используем временную сессию из фабрики для этого чтения
             async with session_factory() as session:
                 # Итерируем по всем метаклассам, которые мы собираемся синхронизировать
                 all_meta_classes = [mc for stage in sync_configs.values() for mc in stage['meta_classes']]
                 for meta_class in all_meta_classes:
+                    if use_sql_diff:
+                        db_uuids_with_dates[meta_class] = {}
+                        db_all_uuids[meta_class] = set()
+                        continue
                     # Находим конфигурацию для этого метакласса
                     config = None
                     for stage in sync_configs.values():
@@ -308,10 +838,14 @@ class ServiceDeskService:
                          try:
                              # Выполняем прямой select запрос к таблице модели для получения UUID и last_modified_date
                              result = await session.execute(
-                                 select(config['db_model_class'].uuid, config['db_model_class'].last_modified_date)
+                                 select(config['db_model_class'].uuid, config['db_model_class'].last_modified_date, config['db_model_class'].content_hash)
                              )
-                             # Сохраняем результаты в словаре {uuid: last_modified_date}
-                             db_uuids_with_dates[meta_class] = {uuid: date for uuid, date in result.all()}
+                             rows = result.all()
+                             # Сохраняем результаты в словаре {uuid: last_modified_date в секундах от эпохи}.
+                             # UUID интернируются: те же объекты строк используются в ListRecord списков SD
+                             db_uuids_with_dates[meta_class] = {sys.intern(uuid): to_epoch(date) for uuid, date, _ in rows}
+                             self.db_content_hashes[meta_class] = {uuid: content_hash for uuid, _, content_hash in rows}
+                             del rows, result
                              db_all_uuids[meta_class] = set(db_uuids_with_dates[meta_class].keys()) # Сохраняем набор UUID
                              logger.debug(f"Собрано {len(db_uuids_with_dates[meta_class])} UUID с датами для {meta_class} из БД.")
                          except Exception as e:
@@ -323,39 +857,79 @@ class ServiceDeskService:
                          db_uuids_with_dates[meta_class] = {}
                          db_all_uuids[meta_class] = set()
 
-
-            # Шаг 1: Получаем списки UUID и дат изменения из SD для всех метаклассов параллельно
-            # Это делается один раз для всех метаклассов перед поэтапной обработкой
-            sd_entity_lists_raw = {} # Словарь для хранения сырых списков {meta_class: [items]}
-            list_fetch_tasks = []
-            # Собираем все метаклассы для запроса списков
-            all_meta_classes_for_fetch = [mc for stage in sync_configs.values() for mc in stage['meta_classes']]
-            for meta_class in all_meta_classes_for_fetch:
-                 # Находим конфигурацию для этого метакласса, чтобы получить list_attrs
-                 config = None
-                 for stage in sync_configs.values():
-                     if meta_class in stage['meta_classes']:
-                         config = stage['configs'].get(meta_class)
-                         break
-                 if config and config.get('list_attrs'):
-                     list_fetch_tasks.append(self.fetch_entity_list(client, meta_class, config['list_attrs']))
-                 else:
-                     logger.warning(f"Для метакласса {meta_class} отсутствует list_attrs в sync_configs. Пропуск получения списка из SD.")
-
-            # Выполняем все задачи получения списков параллельно
-            results = await asyncio.gather(*list_fetch_tasks)
-
-            # Сопоставляем результаты обратно с метаклассами, которые запрашивали списки
-            fetched_meta_classes = [mc for stage in sync_configs.values() for mc in stage['meta_classes'] if stage['configs'].get(mc) and config['list_attrs']] # Исправлена логика сопоставления
-
-            for i, meta_class in enumerate(fetched_meta_classes):
-                 # Проверяем, что индекс i находится в пределах результатов results
-                 if i < len(results):
-                     sd_entity_lists_raw[meta_class] = results[i]
-                     logger.debug(f"Получено {len(results[i])} сущностей для {meta_class} из SD.")
-                 else:
-                     logger.error(f"Несоответствие количества запрошенных списков и полученных результатов. Пропуск обработки метакласса {meta_class}.")
-
+            self._mark_stage('db_snapshot')
+
+            list_totals = {}
+            if target is not None:
+                sd_entity_lists_raw = await self.fetch_target_lists(client, sync_configs, target)
+            elif resumed is not None:
+                old_run_id, sd_entity_lists_raw, old_stats = resumed
+                for meta_class, records in sd_entity_lists_raw.items():
+                    self._count(meta_class, 'resumed', len(records))
+                    # Размер полного списка SD нужен для выбора способа получения деталей
+                    list_totals[meta_class] = old_stats.get(meta_class, {}).get('listed')
+                logger.info(f"Продолжение прерванной синхронизации {old_run_id}: "
+                            f"{sum(len(records) for records in sd_entity_lists_raw.values())} необработанных сущностей.")
+            else:
+                # Шаг 1: Получаем списки UUID и дат изменения из SD для всех метаклассов параллельно
+                # Это делается один раз для всех метаклассов перед поэтапной обработкой
+                sd_entity_lists_raw = {} # Словарь для хранения сырых списков {meta_class: [items]}
+                list_fetch_tasks = []
+                # Собираем все метаклассы для запроса списков
+                all_meta_classes_for_fetch = [mc for stage in sync_configs.values() for mc in stage['meta_classes']]
+                for meta_class in all_meta_classes_for_fetch:
+                     # Находим конфигурацию для этого метакласса, чтобы получить list_attrs
+                     config = None
+                     for stage in sync_configs.values():
+                         if meta_class in stage['meta_classes']:
+                             config = stage['configs'].get(meta_class)
+                             break
+                     if config and config.get('list_attrs'):
+                         list_fetch_tasks.append(self.fetch_list_records(client, meta_class, config['list_attrs']))
+                     else:
+                         logger.warning(f"Для метакласса {meta_class} отсутствует list_attrs в sync_configs. Пропуск получения списка из SD.")
+
+                # Выполняем все задачи получения списков параллельно
+                results = await asyncio.gather(*list_fetch_tasks)
+
+                # Сопоставляем результаты обратно с метаклассами, которые запрашивали списки
+                fetched_meta_classes = [mc for stage in sync_configs.values() for mc in stage['meta_classes'] if stage['configs'].get(mc) and config['list_attrs']] # Исправлена логика сопоставления
+
+                for i, meta_class in enumerate(fetched_meta_classes):
+                     # Проверяем, что индекс i находится в пределах результатов results
+                     if i < len(results):
+                         sd_entity_lists_raw[meta_class] = results[i]
+                         self._count(meta_class, 'listed', len(results[i]))
+                         logger.debug(f"Получено {len(results[i])} сущностей для {meta_class} из SD.")
+                     else:
+                         logger.error(f"Несоответствие количества запрошенных списков и полученных результатов. Пропуск обработки метакласса {meta_class}.")
+                results = None
+
+            self._mark_stage('list_fetch')
+
+            # Списки SD сравниваются с БД во временной таблице, дальше обрабатываются
+            # только новые и измененные сущности, полные списки освобождаются
+            if use_sql_diff:
+                try:
+                    async with session_factory() as session:
+                        diff = await sync_diff.compute_sync_diff(session, sd_entity_lists_raw, partial=target is not None)
+                        await session.rollback() # Временная таблица больше не нужна
+                except Exception as e:
+                    logger.error(f"Ошибка поиска изменений во временной таблице: {e}. Синхронизация прервана.", exc_info=True)
+                    raise
+                for meta_class, delta in diff['meta_classes'].items():
+                    sd_entity_lists_raw[meta_class] = delta['stale']
+                    db_uuids_with_dates[meta_class] = delta['db_dates']
+                    self.db_content_hashes[meta_class] = delta['db_hashes']
+                    list_totals[meta_class] = delta['total']
+                    self._count(meta_class, 'unchanged', delta['unchanged'])
+                known_company_uuids = diff['known_company_uuids']
+                del diff
+                self._mark_stage('sql_diff')
+
+            if self._checkpoint is not None and resumed is None:
+                await self.start_checkpoint(sd_entity_lists_raw, db_uuids_with_dates)
+                self._mark_stage('checkpoint')
 
             # --- Поэтапная синхронизация ---
 
@@ -366,14 +940,22 @@ class ServiceDeskService:
             sd_companies_list = sd_entity_lists_raw.get(company_meta_class, [])
 
             if not sd_companies_list:
-                 logger.warning("Список компаний из SD пуст или не был получен. Пропуск синхронизации компаний.")
+                 if company_meta_class in sd_entity_lists_raw or target is None:
+                     logger.warning("Список компаний из SD пуст или не был получен. Пропуск синхронизации компаний.")
                  # Инициализируем db_company_uuids пустым, если нет компаний из SD
-                 db_company_uuids = set(db_uuids_with_dates.get(company_meta_class, {}).keys())
+                 db_company_uuids = set(db_uuids_with_dates.get(company_meta_class, {}).keys()) | known_company_uuids
             else:
                 # Создаем набор UUID компаний, которые уже есть в БД
-                db_company_uuids = set(db_uuids_with_dates.get(company_meta_class, {}).keys())
+                db_company_uuids = set(db_uuids_with_dates.get(company_meta_class, {}).keys()) | known_company_uuids
                 # Создаем словарь SD компаний по UUID для быстрого доступа
-                sd_companies_dict = {item.get('UUID'): item for item in sd_companies_list if item and item.get('UUID')} # Добавил проверку на None и наличие UUID в элементе списка
+                sd_companies_dict = {item.uuid: item for item in sd_companies_list}
+
+                # Детали всех новых и измененных компаний получаем заранее, до проходов по иерархии
+                prefetched_company_details = await self.prefetch_entity_details(
+                    client, company_meta_class, list(sd_companies_dict.values()), db_uuids_with_dates.get(company_meta_class, {}),
+                    total_count=list_totals.get(company_meta_class)
+                )
+                self._mark_stage('companies_prefetch')
 
                 # Компании, которые еще не обработаны на текущем проходе (их UUID есть в SD списке)
                 remaining_companies_uuids = set(sd_companies_dict.keys())
@@ -398,10 +980,7 @@ class ServiceDeskService:
                             companies_to_process_uuids_this_pass.add(company_uuid) # Считаем пропущенной для этого прохода
                             continue
 
-                        # Safely get parent_uuid
-                        parent_data = company_data.get('parent')
-                        # Исправлено: Проверяем, что parent_data является словарем перед вызовом .get('UUID')
-                        parent_uuid = parent_data.get('UUID') if isinstance(parent_data, dict) else None
+                        parent_uuid = company_data.ref_uuid
 
                         # Условие для обработки на этом проходе:
                         # 1. Это верхнеуровневая компания (нет родителя ИЛИ родитель_uuid пустой строкой).
@@ -421,10 +1000,18 @@ class ServiceDeskService:
                                 company_config,
                                 db_uuids_with_dates.get(company_meta_class, {}),
                                 session_factory,
-                                db_company_uuids # Передаем набор, хотя он не будет обновляться внутри process_and_save_entity
+                                db_company_uuids, # Передаем набор, хотя он не будет обновляться внутри process_and_save_entity
+                                prefetched_details=prefetched_company_details
                             ))
 
                     if not companies_to_process_uuids_this_pass:
+                        # Возможно, оставшиеся компании ждут родителей, которые не были получены из SD.
+                        # Повторяем такие компании из очереди повторов и продолжаем проходы, если удалось.
+                        recovered = await self.process_retry_queue(client, session_factory, [company_meta_class])
+                        if recovered:
+                            db_company_uuids.update(recovered)
+                            logger.info(f"Из очереди повторов сохранено {len(recovered)} компаний. Продолжаем проходы по иерархии.")
+                            continue
                         # Если на этом проходе не удалось найти ни одной компании для обработки,
                         # это означает, что осталась циклическая зависимость или ошибка в данных SD.
                         logger.error(f"На проходе {passes} не найдено компаний для обработки. Возможны циклические зависимости или ошибки в данных SD. Оставшиеся UUID: {remaining_companies_uuids}")
@@ -452,75 +1039,33 @@ class ServiceDeskService:
                     processed_companies_count += len(companies_to_process_uuids_this_pass) # Считаем общее количество попыток обработки
                     logger.info(f"Проход {passes} синхронизации компаний завершен. Успешно сохранено/обновлено: {len(successfully_processed_in_pass)}")
 
+                # Компании, детали которых так и не были получены на проходах, повторяем в конце этапа
+                db_company_uuids.update(await self.process_retry_queue(client, session_factory, [company_meta_class]))
+
+                await self.flush_sync_progress(session_factory)
+
                 logger.info(f"На конец этапа 'Компании' в наборе db_company_uuids {len(db_company_uuids)} UUID.")
                 if remaining_companies_uuids:
                     logger.warning(f"Не удалось обработать все компании после {passes} проходов. Остались UUID: {remaining_companies_uuids}")
 
-
-            # Этап 2: Синхронизация Оборудования (Серверы, Рабочие станции, ФР)
-            logger.info("Начало этапа синхронизации: Оборудование")
-            equipment_meta_classes = sync_configs['equipment']['meta_classes']
-            equipment_update_tasks = []
-
-            # Итерируем по метаклассам оборудования
-            for meta_class in equipment_meta_classes:
-                 # Получаем список сущностей для этого метакласса, если он был успешно получен
-                 sd_list = sd_entity_lists_raw.get(meta_class, [])
-                 if not sd_list:
-                     logger.warning(f"Список сущностей для метакласса {meta_class} пуст или не был получен из SD. Пропуск обработки на этапе 'Оборудование'.")
-                     continue
-
-                 # Получаем полную конфигурацию для этого метакласса
-                 config = sync_configs['equipment']['configs'].get(meta_class)
-                 if not config or not config.get('repo_class') or not config.get('process_func') or not config.get('db_model_class'):
-                      logger.warning(f"Неполная конфигурация для метакласса {meta_class} на этапе 'Оборудование'. Пропуск обработки.")
-                      continue
-
-                 # Создаем задачи для обработки и сохранения каждой сущности оборудования
-                 for sd_item in sd_list:
-                      item_uuid = sd_item.get('UUID')
-                      if not item_uuid:
-                          logger.warning(f"Сущность {meta_class} в списке из SD без UUID. Пропускаем.")
-                          continue
-
-                      # Проверка: существует ли владелец этого оборудования в БД?
-                      # Это важно, т.к. оборудование привязывается к компании.
-                      owner_data = sd_item.get('owner')
-                      # Исправлено: Проверяем, что owner_data является словарем перед вызовом .get('UUID')
-                      owner_uuid = owner_data.get('UUID') if isinstance(owner_data, dict) else None
-
-                      # Пропускаем сущность оборудования, если у нее нет владельца в SD (owner_uuid is None)
-                      # ИЛИ если владелец указан, но не найден в нашем наборе синхронизированных компаний.
-                      if owner_uuid is None:
-                          logger.warning(f"Сущность {meta_class} {item_uuid} не имеет указанного владельца в ServiceDesk. Пропуск обработки.")
-                          continue # Пропускаем эту единицу оборудования
-
-                      if owner_uuid not in db_company_uuids:
-                          # Владелец указан, но не найден в БД после этапа синхронизации компаний.
-                          logger.warning(f"Владелец компании с UUID {owner_uuid} для сущности {meta_class} {item_uuid} указан в SD, но не найден в БД после этапа компаний. Пропуск обработки этой сущности.")
-                          continue # Пропускаем эту единицу оборудования
-
-                      # Если владелец есть в БД (или владелец не указан в SD),
-                      # добавляем задачу на обработку
-                      equipment_update_tasks.append(self.process_and_save_entity(
-                          client,
-                          meta_class,
-                          sd_item,
-                          config,
-                          db_uuids_with_dates.get(meta_class, {}), # Словарь дат для этого метакласса оборудования
-                          session_factory
-                      ))
-
-            # Выполняем все задачи для этапа оборудования параллельно
-            if equipment_update_tasks:
-                logger.info(f"Запущено {len(equipment_update_tasks)} задач синхронизации для этапа 'Оборудование'.")
-                # Собираем результаты, хотя UUID оборудования нам не нужны для дальнейших этапов
-                equipment_results = await asyncio.gather(*equipment_update_tasks)
-                successfully_processed_equipment_count = len([uuid for uuid in equipment_results if uuid is not None])
-                logger.info(f"Этап синхронизации 'Оборудование' завершен. Успешно сохранено/обновлено: {successfully_processed_equipment_count}")
+            self._mark_stage('companies')
+
+            if partitioned:
+                # Оборудование обрабатывают воркеры по частям (sync_partitions.py), им достаются
+                # только новые и измененные сущности. Актуальные считаем здесь, по полным спискам
+                if not use_sql_diff and resumed is None:
+                    for meta_class in sync_configs['equipment']['meta_classes']:
+                        dates = db_uuids_with_dates.get(meta_class, {})
+                        unchanged = sum(1 for item in sd_entity_lists_raw.get(meta_class, []) if not self._entity_needs_update(item, dates))
+                        self._count(meta_class, 'unchanged', unchanged)
+                await self.run_partitions(session_factory, workers)
             else:
-                logger.info("Нет задач для выполнения на этапе синхронизации 'Оборудование'.")
+                await self.sync_equipment(client, session_factory, sync_configs, sd_entity_lists_raw, db_uuids_with_dates, db_company_uuids, list_totals)
 
+            await self.flush_sync_progress(session_factory)
+            if self._checkpoint is not None:
+                await self._checkpoint.finish()
+            self._mark_stage('flush')
 
             # Шаг 3: Удаление сущностей, которых нет в SD - ОТКЛЮЧЕНО
             # TODO: Реализовать логику удаления, сравнивая db_all_uuids с UUIDs из sd_entity_lists_raw.keys()
@@ -529,54 +1074,156 @@ class ServiceDeskService:
             logger.info("Пропуск шага удаления сущностей, отсутствующих в SD.")
 
 
+            self.log_sync_stats()
             logger.info("Инкрементальная синхронизация данных завершена")
 
-    async def process_and_save_entity(
+    async def clean_full_list(self, client: httpx.AsyncClient, meta_class: str, sd_list: List[Dict]) -> List[Dict]:
+        """
+        Очищает полный список сущностей (с атрибутами деталей) для массовой загрузки.
+        Оборудование валидируется пачками в пуле процессов, если он включен, компании - по одной
+        (нужна проверка контрактов в SD). Возвращает очищенные строки с content_hash, без дублей UUID.
+        """
+        records = [item for item in sd_list if isinstance(item, dict) and item.get('UUID')]
+        if meta_class == 'ou$company':
+            cleaned = await asyncio.gather(*(self.process_company_data(client, item) for item in records))
+        else:
+            validated = await validate_records(meta_class, records)
+            if validated is not None:
+                cleaned = list(validated.values())
+            else:
+                process_func = {
+                    'objectBase$Server': self.process_server_data,
+                    'objectBase$Workstation': self.process_workstation_data,
+                    'objectBase$FR': self.process_fr_data
+                }[meta_class]
+                cleaned = await asyncio.gather(*(process_func(item) for item in records))
+
+        rows = {}
+        for data in cleaned:
+            if data and data.get('uuid'):
+                data['content_hash'] = compute_content_hash(data)
+                rows[data['uuid']] = data
+        if len(rows) < len(records):
+            logger.error(f"Не удалось очистить {len(records) - len(rows)} из {len(records)} сущностей {meta_class}.")
+            self._count(meta_class, 'failed', len(records) - len(rows))
+        return list(rows.values())
+
+    async def sync_full_bulk(self, session_factory: async_sessionmaker):
+        """
+        Полная пересинхронизация массовой загрузкой (sync_runner.py --full).
+        Все сущности получаются полными списками с атрибутами деталей, очищаются и
+        сохраняются через bulk_load.bulk_upsert одной транзакцией, без сравнения дат
+        по одной сущности. Нужна для первой загрузки в пустую БД и перестроения данных.
+        Сущности, которых уже нет в SD, не удаляются (как и при инкрементальной синхронизации).
+        """
+        async with httpx.AsyncClient(timeout=httpx.Timeout(60.0)) as client:
+            logger.info("Начало полной синхронизации массовой загрузкой")
+            self._reset_run_state()
+
+            meta_classes = list(ENTITY_MODELS)
+            full_lists = await asyncio.gather(*(
+                self.fetch_entity_list(client, meta_class, DETAIL_ATTRS[meta_class]) for meta_class in meta_classes
+            ))
+            self._mark_stage('list_fetch')
+
+            rows_by_table = {}
+            for meta_class, sd_list in zip(meta_classes, full_lists):
+                self._count(meta_class, 'listed', len(sd_list))
+                if not sd_list:
+                    logger.warning(f"Список {meta_class} из SD пуст или не был получен. Сущности этого метакласса не загружаются.")
+                    continue
+                rows = await self.clean_full_list(client, meta_class, sd_list)
+                await sd_archive.write_payloads(session_factory, [
+                    item for item in (sd_archive.archive_item(meta_class, record) for record in sd_list if isinstance(record, dict))
+                    if item is not None
+                ])
+                self._count(meta_class, 'fetched', len(rows))
+                rows_by_table[ENTITY_MODELS[meta_class].__tablename__] = rows
+            del full_lists
+            self._mark_stage('clean')
+
+            async with session_factory() as session:
+                try:
+                    with tracer.start_as_current_span('db.bulk_upsert'):
+                        saved, dropped = await bulk_upsert(session, rows_by_table)
+                    with DB_COMMIT_SECONDS.time(meta_class='bulk'), tracer.start_as_current_span('db.commit'):
+                        await session.commit()
+                except Exception as e:
+                    logger.error(f"Ошибка массовой загрузки, изменения отменены: {e}", exc_info=True)
+                    await session.rollback()
+                    raise
+            for meta_class, model in ENTITY_MODELS.items():
+                self._count(meta_class, 'bulk_saved', saved.get(model.__tablename__, 0))
+                self._count(meta_class, 'orphaned', dropped.get(model.__tablename__, 0))
+            self._mark_stage('bulk_load')
+
+            self.log_sync_stats()
+            logger.info("Полная синхронизация массовой загрузкой завершена")
+
+    async def process_and_save_entity(self, client: httpx.AsyncClient, meta_class: str, sd_item: ListRecord, *args, **kwargs) -> Optional[str]:
+        """
+        Обертка над _process_and_save_entity: замеряет время обработки сущности
+        для списка самых долгих сущностей в отчете о синхронизации
+        и отмечает сохраненную сущность в контрольной точке.
+        """
+        started = time.monotonic()
+        span_attributes = {'meta_class': meta_class, 'uuid': sd_item.uuid, 'company': sd_company_uuid(meta_class, sd_item)}
+        try:
+            with tracer.start_as_current_span('sync.entity', span_attributes) as span:
+                result = await self._process_and_save_entity(client, meta_class, sd_item, *args, **kwargs)
+                span.set_attribute('saved', result is not None)
+        finally:
+            self._record_entity_time(meta_class, sd_item.uuid, time.monotonic() - started)
+        if self._checkpoint is not None:
+            if result is not None:
+                self._checkpoint.done(meta_class, sd_item.uuid)
+            if self._checkpoint.due():
+                await self.flush_sync_progress(self._checkpoint.session_factory)
+        return result
+
+    async def _process_and_save_entity(
             self,
             client: httpx.AsyncClient,
             meta_class: str,
-            sd_item: Dict,
+            sd_item: ListRecord,
             config: Dict,
-            db_entity_dates: Dict[str, datetime.datetime],
+            db_entity_dates: Dict[str, int],
             session_factory: async_sessionmaker,
             # Добавляем набор UUID компаний для проверки при создании оборудования
             # Этот аргумент будет использоваться только для логики внутри,
             # сам набор будет обновляться в sync_data_incrementally
-            db_company_uuids: Optional[set] = None # Оставил для потенциальных будущих проверок внутри
+            db_company_uuids: Optional[set] = None, # Оставил для потенциальных будущих проверок внутри
+            # Если детали получить не удалось, ставить ли сущность в очередь повторов
+            retry_on_failure: bool = True,
+            # Детали, заранее полученные prefetch_entity_details ({uuid: детали})
+            prefetched_details: Optional[Dict[str, Dict]] = None,
+            # Данные, заранее очищенные пакетной валидацией в пуле процессов ({uuid: данные})
+            prevalidated: Optional[Dict[str, Dict]] = None
             ) -> Optional[str]: # Функция теперь может возвращать UUID (str) или None
         """
         Проверяет необходимость обновления сущности по дате изменения,
         получает полные детали (если нужно), обрабатывает и сохраняет в БД.
         Возвращает UUID успешно обработанной сущности или None.
+        Сущности, детали которых не удалось получить из SD, попадают в self.retry_queue.
         """
-        uuid = sd_item.get('UUID')
-        if not uuid:
-             logger.warning(f"Сущность {meta_class} в списке из SD без UUID. Пропускаем.")
-             return None # Возвращаем None
-
-        sd_last_modified_date_str = sd_item.get('lastModifiedDate')
-        if not sd_last_modified_date_str:
-             logger.warning(f"Сущность {meta_class} {uuid} не имеет lastModifiedDate в списке из SD. Пропускаем обновление.")
-             return None # Возвращаем None
-
-        try:
-            sd_last_modified_date = datetime.datetime.strptime(sd_last_modified_date_str, "%Y.%m.%d %H:%M:%S")
-        except ValueError:
-            logger.error(f"Неверный формат lastModifiedDate для {meta_class} {uuid}: '{sd_last_modified_date_str}'. Пропускаем.")
-            return None # Возвращаем None
+        uuid = sd_item.uuid
 
-        # Быстрая проверка даты изменения по собранному словарю из БД
-        db_last_modified_date = db_entity_dates.get(uuid)
+        # Быстрая проверка даты изменения по собранному словарю из БД.
+        # Даты в списке SD и в словаре - целые секунды от эпохи (см. sync_records)
+        db_last_modified = db_entity_dates.get(uuid)
 
         needs_update = False
         is_new_entity = False # Флаг для определения, нужно ли создавать или обновлять
-        if db_last_modified_date is not None:
+        if db_last_modified is not None:
             # Сущность существует в БД, сравниваем даты
-            if db_last_modified_date < sd_last_modified_date:
+            if db_last_modified < sd_item.modified:
                 needs_update = True
-                logger.debug(f"Сущность {meta_class} {uuid} нуждается в обновлении (дата в SD новее). SD: {sd_last_modified_date}, DB: {db_last_modified_date}")
+                logger.debug(f"Сущность {meta_class} {uuid} нуждается в обновлении (дата в SD новее). SD: {from_epoch(sd_item.modified)}, DB: {from_epoch(db_last_modified)}")
             else:
-                logger.debug(f"Сущность {meta_class} {uuid} актуальна. Пропуск обновления. SD: {sd_last_modified_date}, DB: {db_last_modified_date}")
+                logger.debug(f"Сущность {meta_class} {uuid} актуальна. Пропуск обновления.")
+                self._count(meta_class, 'unchanged')
+                if self._checkpoint is not None:
+                    self._checkpoint.done(meta_class, uuid) # Например, сохранена до прерывания запуска
                 return None # Сущность актуальна, пропускаем и возвращаем None
 
         else:
@@ -586,33 +1233,72 @@ class ServiceDeskService:
             logger.debug(f"Сущность {meta_class} {uuid} отсутствует в БД, будет создана")
 
         if needs_update:
-            # Получаем полные детали только если нужно обновить/создать
-            full_details = await self.fetch_entity_details(client, uuid, meta_class)
+            # Получаем полные детали только если нужно обновить/создать.
+            # Сначала берем из заранее полученных пачкой, иначе запрашиваем по одной.
+            full_details = prefetched_details.pop(uuid, None) if prefetched_details else None
+            if not full_details:
+                full_details = await self.fetch_entity_details(client, uuid, meta_class)
             if not full_details:
-                 logger.error(f"Не удалось получить полные детали для {meta_class} {uuid}. Пропускаем сохранение.")
+                 if retry_on_failure:
+                      # Не теряем сущность до следующего запуска: повторим в конце этапа
+                      logger.warning(f"Не удалось получить полные детали для {meta_class} {uuid}. Сущность поставлена в очередь повторов.")
+                      self.retry_queue.append({
+                          'meta_class': meta_class,
+                          'sd_item': sd_item,
+                          'config': config,
+                          'db_entity_dates': db_entity_dates,
+                          'db_company_uuids': db_company_uuids
+                      })
+                 else:
+                      logger.error(f"Не удалось получить полные детали для {meta_class} {uuid}. Пропускаем сохранение.")
+                      self._fail(meta_class, uuid, "Не удалось получить детали из SD")
                  return None # Возвращаем None
-
-            # Обрабатываем данные с помощью специфической функции
-            if meta_class == 'ou$company':
-                 processed_data = await config['process_func'](client, full_details)
-            else:
-                 processed_data = await config['process_func'](full_details)
+            self._count(meta_class, 'fetched')
+            archived = sd_archive.archive_item(meta_class, full_details, from_epoch(sd_item.modified))
+            if archived is not None:
+                self.pending_payloads.append(archived)
+                if len(self.pending_payloads) >= sd_archive.SD_ARCHIVE_BATCH:
+                    await self.flush_payload_archive(session_factory)
+
+            # Обрабатываем данные с помощью специфической функции,
+            # если они не были провалидированы заранее пачкой в пуле процессов
+            processed_data = prevalidated.pop(uuid, None) if prevalidated else None
+            if processed_data is None:
+                if meta_class == 'ou$company':
+                     processed_data = await config['process_func'](client, full_details)
+                else:
+                     processed_data = await config['process_func'](full_details)
 
             if not processed_data:
                  logger.error(f"Не удалось обработать данные для {meta_class} {uuid}. Пропускаем сохранение.")
+                 self._fail(meta_class, uuid, "Данные не прошли валидацию")
                  return None # Возвращаем None
 
             entity_uuid_to_save = processed_data.get('uuid')
             if not entity_uuid_to_save:
                 logger.error(f"Обработанные данные для {meta_class} не содержат UUID. Пропускаем сохранение.")
+                self._fail(meta_class, uuid, "Обработанные данные без UUID")
                 return None # Возвращаем None
 
+            processed_data['content_hash'] = compute_content_hash(processed_data)
+            if not is_new_entity and self.db_content_hashes.get(meta_class, {}).get(entity_uuid_to_save) == processed_data['content_hash']:
+                # В SD изменились только атрибуты, которые мы не храним. Строку не переписываем,
+                # дату изменения обновим одним массовым запросом в конце этапа (flush_pending_touches).
+                self.pending_touches.setdefault(meta_class, []).append({
+                    'b_uuid': entity_uuid_to_save,
+                    'b_last_modified_date': processed_data.get('last_modified_date') or from_epoch(sd_item.modified)
+                })
+                self._count(meta_class, 'content_unchanged')
+                logger.debug(f"Содержимое {meta_class} {entity_uuid_to_save} не изменилось. Обновим только дату изменения.")
+                return entity_uuid_to_save
+
             # Валидаторы теперь добавляют owner_id и last_modified_date в processed_data
             # Проверка наличия owner_id для оборудования перед созданием
             if is_new_entity and meta_class in ['objectBase$Server', 'objectBase$Workstation', 'objectBase$FR']:
                  owner_uuid = processed_data.get('owner_id')
                  if not owner_uuid:
                       logger.warning(f"Сущность {meta_class} {uuid} не имеет owner_id после обработки. Пропускаем создание.")
+                      self._fail(meta_class, uuid, "Нет owner_id после обработки")
                       return None # Пропускаем создание и возвращаем None
 
                  # Проверку owner_uuid in db_company_uuids делаем на этапе формирования задач в sync_data_incrementally
@@ -645,13 +1331,18 @@ class ServiceDeskService:
 
                     if success:
                          # Если подготовка к сохранению/обновлению прошла успешно, коммитим изменения
-                         await entity_session.commit()
+                         with DB_COMMIT_SECONDS.time(meta_class=meta_class), tracer.start_as_current_span(
+                             'db.commit', {'meta_class': meta_class, 'uuid': entity_uuid_to_save}
+                         ):
+                             await entity_session.commit()
                          logger.debug(f"Изменения для сущности {meta_class} {entity_uuid_to_save} закоммичены.")
+                         self._count(meta_class, 'created' if is_new_entity else 'updated')
                          return entity_uuid_to_save # Возвращаем UUID при успешном коммите
                     else:
                          # Если success=False (ошибка или запись не найдена для обновления), откатываем (на всякий случай, хотя при False add/update не было)
                          await entity_session.rollback()
                          logger.debug(f"Изменения для сущности {meta_class} {entity_uuid_to_save} откатаны (т.к. сохранение не было успешным).")
+                         self._fail(meta_class, uuid, "Репозиторий не сохранил сущность")
                          return None # Возвращаем None при неуспехе
 
                 except Exception as e:
@@ -659,20 +1350,338 @@ class ServiceDeskService:
                     logger.error(f"Ошибка при коммите или неожиданная ошибка при сохранении сущности {meta_class} {entity_uuid_to_save}: {e}", exc_info=True)
                     await entity_session.rollback()
                     logger.debug(f"Изменения для сущности {meta_class} {entity_uuid_to_save} откатаны.")
+                    self._fail(meta_class, uuid, f"{type(e).__name__}: {e}")
                     return None # Возвращаем None при ошибке
 
+    async def flush_pending_touches(self, session_factory: async_sessionmaker):
+        """
+        Массово обновляет last_modified_date у сущностей, содержимое которых не изменилось.
+        Вызывается в конце этапа: один executemany на метакласс вместо UPDATE всей строки на сущность.
+        """
+        if not self.pending_touches:
+            return
+        pending, self.pending_touches = self.pending_touches, {}
+        async with session_factory() as session:
+            try:
+                for meta_class, items in pending.items():
+                    touched = await REPOSITORY_CLASSES[meta_class](session).touch_last_modified(items)
+                    logger.info(f"Обновлена только дата изменения у {touched} сущностей {meta_class}.")
+                await session.commit()
+            except Exception as e:
+                logger.error(f"Ошибка при массовом обновлении дат изменения: {e}", exc_info=True)
+                await session.rollback()
+
+    async def flush_payload_archive(self, session_factory: async_sessionmaker):
+        """Записывает накопленные детали в архив ответов SD (sd_archive)."""
+        if not self.pending_payloads:
+            return
+        pending, self.pending_payloads = self.pending_payloads, []
+        await sd_archive.write_payloads(session_factory, pending)
+
+    async def run_partitions(self, session_factory: async_sessionmaker, workers: int):
+        """
+        Делит новое и измененное оборудование запуска на части (sync_partitions), обрабатывает их
+        вместе с другими воркерами и ждет, пока все части будут завершены. Итоги частей
+        добавляются в счетчики и отчет этого запуска. Незавершенные части - ошибка запуска:
+        их сущности остаются в контрольной точке, и следующий запуск их продолжит.
+        """
+        # Перед публикацией частей статусы компаний и счетчики (размеры списков) должны быть в БД
+        await self.flush_sync_progress(session_factory)
+        run_id = self._run_id
+        partitions = sync_partitions.partition_count(workers)
+        budget = sync_partitions.DbRateBudget(session_factory)
+        await budget.configure()
+        async with session_factory() as session:
+            if not await SyncPartitionRepository(session).create_all(run_id, partitions):
+                raise RuntimeError(f"Не удалось создать части запуска синхронизации {run_id}")
+            await session.commit()
+        logger.info(f"Оборудование запуска {run_id} разделено на {partitions} частей для {workers} воркеров. "
+                    f"Общий потолок запросов к SD: {budget.rate} в секунду.")
+        if self.on_partitions is not None:
+            self.on_partitions(run_id)
+
+        await ServiceDeskService().work_partitions(session_factory, run_id, wait=True)
+
+        async with session_factory() as session:
+            rows = await SyncPartitionRepository(session).list_by_run(run_id)
+        for row in rows:
+            self._merge_partition_report(row.report or {})
+        self._mark_stage('equipment')
+        unfinished = [row.partition for row in rows if row.status != SYNC_JOB_DONE]
+        if unfinished:
+            raise RuntimeError(f"Части {unfinished} запуска синхронизации {run_id} не завершены")
+
+    def _merge_partition_report(self, report: Dict[str, Any]):
+        """Добавляет итоги части запуска (sync_partitions.report) к счетчикам и отчету координатора."""
+        for meta_class, stats in report.get('stats', {}).items():
+            self.sync_stats.setdefault(meta_class, Counter()).update(stats)
+        self.run_http_requests += report.get('http_requests', 0)
+        self.run_bytes_downloaded += report.get('bytes_downloaded', 0)
+        for item in report.get('slowest_entities', []):
+            self._record_entity_time(item['meta_class'], item['uuid'], item['seconds'])
+
+    async def work_partitions(self, session_factory: async_sessionmaker, run_id: int, wait: bool = False):
+        """
+        Забирает и обрабатывает части запуска run_id, пока они есть в очереди.
+        wait=True (координатор) - ждать и части, которые обрабатывают другие воркеры:
+        брошенные части возвращаются в очередь и забираются снова.
+        """
+        worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        # Процессы sync_runner.py подключают бюджет при старте; здесь - для запуска из кода (бенчмарки)
+        budget = limiter.external_budget or sync_partitions.DbRateBudget(session_factory)
+        previous_budget, limiter.external_budget = limiter.external_budget, budget
+        try:
+            while True:
+                claimed = await sync_partitions.claim_partition(session_factory, run_id, worker_id)
+                if claimed is not None:
+                    partition_id, partition, partitions = claimed
+                    async with sync_partitions.PartitionHeartbeat(session_factory, partition_id, worker_id):
+                        await self.sync_partition(session_factory, run_id, partition_id, partition, partitions)
+                    continue
+                if not wait:
+                    break
+                async with session_factory() as session:
+                    rows = await SyncPartitionRepository(session).list_by_run(run_id)
+                if all(row.status in (SYNC_JOB_DONE, SYNC_JOB_FAILED) for row in rows):
+                    break
+                await asyncio.sleep(sync_partitions.SYNC_PARTITION_POLL_INTERVAL)
+        finally:
+            limiter.external_budget = previous_budget
+
+    async def sync_partition(self, session_factory: async_sessionmaker, run_id: int, partition_id: int, partition: int, partitions: int):
+        """
+        Обрабатывает одну часть запуска: необработанное оборудование из ее корзин в контрольной точке.
+        Итоги части записываются в sync_partitions.report, ошибка - в sync_partitions.error.
+        """
+        self._reset_run_state()
+        error = None
+        logger.info(f"Воркер взял часть {partition}/{partitions} запуска синхронизации {run_id}.")
+        try:
+            async with httpx.AsyncClient(timeout=httpx.Timeout(60.0)) as client:
+                sync_configs = self.build_sync_configs()
+                equipment_meta_classes = sync_configs['equipment']['meta_classes']
+                async with session_factory() as session:
+                    rows = await SyncCheckpointRepository(session).list_pending(
+                        run_id, sync_partitions.partition_buckets(partition, partitions), equipment_meta_classes
+                    )
+                    run = await SyncRunRepository(session).get(run_id)
+                    run_stats = (run.stats if run else None) or {}
+                self._checkpoint = sync_checkpoint.SyncCheckpoint(session_factory, run_id, owns_run=False)
+                sd_lists = self._checkpoint.take_rows(rows)
+                del rows
+
+                # Даты и хеши из БД и владельцы - только для сущностей этой части
+                db_dates, owners = {}, set()
+                async with session_factory() as session:
+                    for meta_class, records in sd_lists.items():
+                        model = ENTITY_MODELS[meta_class]
+                        uuids = [record.uuid for record in records]
+                        owners.update(record.ref_uuid for record in records if record.ref_uuid)
+                        db_dates[meta_class], self.db_content_hashes[meta_class] = {}, {}
+                        for start in range(0, len(uuids), SyncCheckpointRepository.UUID_CHUNK_SIZE):
+                            result = await session.execute(
+                                select(model.uuid, model.last_modified_date, model.content_hash)
+                                .where(model.uuid.in_(uuids[start:start + SyncCheckpointRepository.UUID_CHUNK_SIZE]))
+                            )
+                            for uuid, date, content_hash in result:
+                                db_dates[meta_class][sys.intern(uuid)] = to_epoch(date)
+                                self.db_content_hashes[meta_class][uuid] = content_hash
+                    owner_list = list(owners)
+                    db_company_uuids = set()
+                    for start in range(0, len(owner_list), SyncCheckpointRepository.UUID_CHUNK_SIZE):
+                        result = await session.execute(
+                            select(Company.uuid).where(Company.uuid.in_(owner_list[start:start + SyncCheckpointRepository.UUID_CHUNK_SIZE]))
+                        )
+                        db_company_uuids.update(result.scalars())
+                list_totals = {meta_class: run_stats.get(meta_class, {}).get('listed') for meta_class in sd_lists}
+                self._mark_stage('partition_load')
+
+                await self.sync_equipment(client, session_factory, sync_configs, sd_lists, db_dates, db_company_uuids, list_totals)
+                await self.flush_sync_progress(session_factory)
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+            logger.error(f"Ошибка в части {partition}/{partitions} запуска синхронизации {run_id}: {e}", exc_info=True)
+            if self._checkpoint is not None:
+                await self._checkpoint.flush()
+        finally:
+            self._checkpoint = None
+
+        report = self.build_run_report()
+        report.pop('stage_timings', None)
+        async with session_factory() as session:
+            await SyncPartitionRepository(session).finish(partition_id, report, error)
+            await session.commit()
+        logger.info(f"Часть {partition}/{partitions} запуска синхронизации {run_id} завершена {'с ошибкой' if error else 'успешно'}.")
+
+    async def join_partitioned_run(self, session_factory: async_sessionmaker, run_id: Optional[int] = None) -> Optional[int]:
+        """
+        Воркер другого процесса или хоста (sync_runner.py --join): обрабатывает части запуска
+        run_id (по умолчанию - последнего идущего запуска с частями в очереди), пока они есть.
+        Возвращает id запуска или None, если присоединяться не к чему.
+        """
+        if run_id is None:
+            async with session_factory() as session:
+                run_id = await SyncPartitionRepository(session).find_open_run()
+            if run_id is None:
+                logger.info("Нет запусков синхронизации с частями в очереди.")
+                return None
+        logger.info(f"Воркер присоединяется к запуску синхронизации {run_id}.")
+        await self.work_partitions(session_factory, run_id)
+        return run_id
+
+    async def flush_sync_progress(self, session_factory: async_sessionmaker):
+        """
+        Записывает отложенные даты изменения (flush_pending_touches) и, если включены
+        контрольные точки, статусы сущностей и промежуточные счетчики запуска.
+        Заодно записывает накопленные детали в архив ответов SD.
+        """
+        await self.flush_payload_archive(session_factory)
+        if self._checkpoint is None:
+            await self.flush_pending_touches(session_factory)
+            return
+        await self._checkpoint.flush(
+            self.build_run_report()['stats'], before_write=lambda: self.flush_pending_touches(session_factory)
+        )
+
+    async def start_checkpoint(self, sd_lists: Dict[str, List[ListRecord]], db_dates: Dict[str, Dict[str, int]]):
+        """
+        Записывает в контрольную точку новые и измененные сущности запуска.
+        Сущности, которые не удалось сохранить в прошлых запусках, переносятся в начало списков,
+        а те, чья задержка повтора (next_attempt_at) еще не истекла, в этом запуске пропускаются.
+        """
+        checkpoint = self._checkpoint
+        now = datetime.datetime.utcnow()
+        stale = {}
+        for meta_class, sd_list in sd_lists.items():
+            retried, others, backed_off = [], [], 0
+            for record in sd_list:
+                if checkpoint.is_backed_off(meta_class, record.uuid, now):
+                    backed_off += 1
+                elif (meta_class, record.uuid) in checkpoint.failures:
+                    retried.append(record)
+                else:
+                    others.append(record)
+            if backed_off:
+                self._count(meta_class, 'backed_off', backed_off)
+                logger.info(f"Метакласс {meta_class}: {backed_off} сущностей пропущено до истечения задержки после неудачи.")
+            if retried:
+                logger.info(f"Метакласс {meta_class}: {len(retried)} сущностей, не сохраненных в прошлых запусках, обрабатываются первыми.")
+            if retried or backed_off:
+                sd_lists[meta_class] = retried + others
+            dates = db_dates.get(meta_class, {})
+            stale[meta_class] = [record for record in sd_lists[meta_class] if self._entity_needs_update(record, dates)]
+        await checkpoint.start(stale)
+        await checkpoint.flush(self.build_run_report()['stats'])
+
+
+    async def process_retry_queue(self, client: httpx.AsyncClient, session_factory: async_sessionmaker, meta_classes: List[str]) -> set:
+        """
+        Повторно обрабатывает сущности указанных метаклассов из очереди повторов.
+        Вызывается в конце этапа, когда SD уже разгружен. Повторная неудача окончательна
+        для текущего запуска. Возвращает набор UUID, которые удалось сохранить.
+        """
+        pending = [item for item in self.retry_queue if item['meta_class'] in meta_classes]
+        if not pending:
+            return set()
+        self.retry_queue = [item for item in self.retry_queue if item['meta_class'] not in meta_classes]
+
+        logger.info(f"Повторная обработка {len(pending)} сущностей из очереди повторов ({', '.join(meta_classes)}) через {SD_RETRY_QUEUE_DELAY}с.")
+        await asyncio.sleep(SD_RETRY_QUEUE_DELAY)
+
+        results = await asyncio.gather(*(
+            self.process_and_save_entity(
+                client,
+                item['meta_class'],
+                item['sd_item'],
+                item['config'],
+                item['db_entity_dates'],
+                session_factory,
+                item['db_company_uuids'],
+                retry_on_failure=False
+            )
+            for item in pending
+        ))
+        recovered = {uuid for uuid in results if uuid is not None}
+        if len(recovered) < len(pending):
+            logger.error(f"После повторной обработки не удалось сохранить {len(pending) - len(recovered)} из {len(pending)} сущностей ({', '.join(meta_classes)}).")
+        else:
+            logger.info(f"Все {len(pending)} сущностей из очереди повторов успешно сохранены.")
+        return recovered
 
     # Основной метод синхронизации, вызываемый извне
     # Принимает session_factory
-    async def sync_all_data(self, session_factory: async_sessionmaker):
+    async def sync_all_data(self, session_factory: async_sessionmaker, full: bool = False, workers: int = 1,
+                            target: Optional[SyncTarget] = None):
         """
         Запускает инкрементальную синхронизацию всех настроенных метаклассов.
         Использует переданную фабрику сессий.
+        full=True - полная пересинхронизация массовой загрузкой (sync_full_bulk).
+        workers > 1 - оборудование обрабатывается несколькими воркерами (run_partitions).
+        target - выборочная синхронизация (см. sync_target), только инкрементальная и одним процессом.
         """
-        # sync_data_incrementally теперь принимает session_factory
-        await self.sync_data_incrementally(session_factory)
+        run_id = await self.start_sync_run(session_factory)
+        started = time.monotonic()
+        self._run_id = run_id
+        try:
+            # sync_data_incrementally теперь принимает session_factory
+            # При PROFILE_SYNC=1 (sync_runner.py --profile) профиль прогона сохраняется в PROFILE_DIR
+            with SYNC_DURATION_SECONDS.time(), profiling.profiled("sync", profiling.PROFILE_SYNC), \
+                    tracer.start_as_current_span('sync.run', {'run_id': run_id, 'full': full, 'target': target.describe() if target else ''}):
+                if full:
+                    await self.sync_full_bulk(session_factory)
+                else:
+                    await self.sync_data_incrementally(session_factory, workers=workers, target=target)
+        except BaseException as e:
+            # Прерывание (CancelledError при остановке воркера) тоже фиксируем в отчете,
+            # накопленные статусы сущностей - в контрольной точке для продолжения
+            if self._checkpoint is not None:
+                await self._checkpoint.flush()
+            await self.finish_sync_run(session_factory, run_id, started, error=f"{type(e).__name__}: {e}")
+            raise
+        finally:
+            self._run_id = None
+            self._checkpoint = None
+        await self.finish_sync_run(session_factory, run_id, started)
+        if target is not None:
+            # Время последней успешной синхронизации относится только к полным запускам
+            logger.info(f"Выборочная синхронизация завершена: {target.describe()}.")
+            return
+        SYNC_LAST_SUCCESS.set(time.time())
         logger.info("Полная синхронизация завершена.")
 
+    async def start_sync_run(self, session_factory: async_sessionmaker) -> Optional[int]:
+        """Создает запись sync_runs о начале синхронизации. Ошибка записи не мешает синхронизации."""
+        try:
+            async with session_factory() as session:
+                run = await SyncRunRepository(session).create(datetime.datetime.utcnow())
+                if run is None:
+                    return None
+                await session.commit()
+                return run.id
+        except Exception as e:
+            logger.error(f"Не удалось создать запись о запуске синхронизации: {e}", exc_info=True)
+            return None
+
+    async def finish_sync_run(self, session_factory: async_sessionmaker, run_id: Optional[int], started: float, error: Optional[str] = None):
+        """Записывает итоги синхронизации в sync_runs."""
+        if run_id is None:
+            return
+        report = self.build_run_report()
+        report.update({
+            'status': SYNC_RUN_FAILED if error else SYNC_RUN_DONE,
+            'finished_at': datetime.datetime.utcnow(),
+            'duration_seconds': round(time.monotonic() - started, 3),
+            'error': error,
+        })
+        try:
+            async with session_factory() as session:
+                await SyncRunRepository(session).finish(run_id, report)
+                await session.commit()
+            logger.info(f"Отчет о синхронизации {run_id} сохранен: запросов к SD {report['http_requests']}, "
+                        f"получено {report['bytes_downloaded'] / 1024 / 1024:.1f} МБ, этапы {report['stage_timings']}.")
+        except Exception as e:
+            logger.error(f"Не удалось сохранить отчет о синхронизации {run_id}: {e}", exc_info=True)
+
 
     # Методы для получения данных из БД для фронтенда
     # Принимают session: AsyncSession
@@ -767,7 +1776,8 @@ class ServiceDeskService:
                 company_query = company_query.filter(or_(*company_filters)) # Применяем фильтры с OR
 
             # Ограничиваем количество результатов для каждой категории
-            company_results_orm = (await session.execute(company_query.limit(100))).scalars().all()
+            with SEARCH_CATEGORY_SECONDS.time(category='companies'):
+                company_results_orm = (await session.execute(company_query.limit(100))).scalars().all()
             companies_list = [CompanySearchResult.model_validate(c) for c in company_results_orm]
 
 
@@ -797,7 +1807,8 @@ class ServiceDeskService:
                 server_query = server_query.filter(Server.owner_id != None)
 
 
-            server_results_orm = (await session.execute(server_query.limit(100))).scalars().unique().all() # unique() может быть полезно при JOIN
+            with SEARCH_CATEGORY_SECONDS.time(category='servers'):
+                server_results_orm = (await session.execute(server_query.limit(100))).scalars().unique().all() # unique() может быть полезно при JOIN
             servers_list = [ServerSearchResult.model_validate(s) for s in server_results_orm]
 
             # 3. Поиск рабочих станций
@@ -818,7 +1829,8 @@ class ServiceDeskService:
                 workstation_query = workstation_query.filter(Workstation.owner_id != None)
 
 
-            workstation_results_orm = (await session.execute(workstation_query.limit(100))).scalars().unique().all() # unique() может быть полезно при JOIN
+            with SEARCH_CATEGORY_SECONDS.time(category='workstations'):
+                workstation_results_orm = (await session.execute(workstation_query.limit(100))).scalars().unique().all() # unique() может быть полезно при JOIN
             workstations_list = [WorkstationSearchResult.model_validate(w) for w in workstation_results_orm]
 
             # 4. Поиск фискальных регистраторов
@@ -839,7 +1851,8 @@ class ServiceDeskService:
                 fr_query = fr_query.filter(FiscalRegister.owner_id != None)
 
 
-            fr_results_orm = (await session.execute(fr_query.limit(100))).scalars().unique().all() # unique() может быть полезно при JOIN
+            with SEARCH_CATEGORY_SECONDS.time(category='fiscal_registers'):
+                fr_results_orm = (await session.execute(fr_query.limit(100))).scalars().unique().all() # unique() может быть полезно при JOIN
             fr_list = [FiscalRegisterSearchResult.model_validate(f) for f in fr_results_orm]
 
             return SearchResultResponse(
@@ -851,6 +1864,132 @@ class ServiceDeskService:
 
 
 
+    async def find_entity_meta_class(self, session: AsyncSession, uuid: str) -> Optional[str]:
+        """Метакласс сущности, уже сохраненной в БД (по префиксу UUID проверяются только подходящие таблицы)."""
+        prefix = uuid_prefix(uuid)
+        for meta_class, model in ENTITY_MODELS.items():
+            if uuid_prefix(meta_class) != prefix:
+                continue
+            if (await session.execute(select(model.uuid).where(model.uuid == uuid))).first() is not None:
+                return meta_class
+        return None
+
+    async def fetch_unknown_entity(self, client: httpx.AsyncClient, uuid: str) -> Optional[Dict]:
+        """
+        Детали сущности, метакласс которой неизвестен: у оборудования общий префикс UUID (objectBase),
+        поэтому запрашиваются атрибуты всех подходящих метаклассов и metaClass - за один запрос к SD.
+        """
+        prefix = uuid_prefix(uuid)
+        attrs = {'metaClass'}
+        for meta_class, meta_attrs in DETAIL_ATTRS.items():
+            if uuid_prefix(meta_class) == prefix:
+                attrs.update(meta_attrs.split(','))
+        if len(attrs) == 1:
+            logger.warning(f"UUID {uuid} не относится ни к одному синхронизируемому метаклассу.")
+            return None
+        params = {"accessKey": self.access_key, "attrs": ','.join(sorted(attrs))}
+        try:
+            response = await self._request(client, "GET", f"{self.base_api_url}get/{uuid}", params, operation='get')
+            return response.json()
+        except httpx.HTTPStatusError as e:
+            logger.error(f"Ошибка HTTP при получении сущности {uuid} (Статус: {e.response.status_code}): {e}")
+            return None
+        except Exception as e:
+            logger.error(f"Ошибка при получении сущности {uuid}: {e}", exc_info=True)
+            return None
+
+    async def save_entity_details(self, client: httpx.AsyncClient, session_factory: async_sessionmaker, meta_class: str,
+                                  details: Dict, is_new: bool) -> bool:
+        """Обрабатывает детали сущности из SD тем же способом, что и синхронизация, и создает (is_new) или обновляет строку в БД."""
+        config = next(stage['configs'][meta_class] for stage in self.build_sync_configs().values() if meta_class in stage['configs'])
+        if meta_class == 'ou$company':
+            processed_data = await config['process_func'](client, details)
+        else:
+            processed_data = await config['process_func'](details)
+        if not processed_data or not processed_data.get('uuid'):
+            logger.error(f"Не удалось обработать данные для {meta_class} {details.get('UUID')}. Сущность не сохранена.")
+            return False
+        processed_data['content_hash'] = compute_content_hash(processed_data)
+        archived = sd_archive.archive_item(meta_class, details)
+        if archived is not None:
+            await sd_archive.write_payloads(session_factory, [archived])
+        async with session_factory() as session:
+            repo = config['repo_class'](session)
+            try:
+                if is_new:
+                    saved = await repo.create(processed_data)
+                else:
+                    saved = await repo.update(processed_data['uuid'], processed_data)
+                if not saved:
+                    await session.rollback()
+                    return False
+                await session.commit()
+                return True
+            except SQLAlchemyError as e:
+                logger.error(f"Ошибка БД при сохранении {meta_class} {processed_data['uuid']}: {e}", exc_info=True)
+                await session.rollback()
+                return False
+
+    async def refresh_entity(self, session_factory: async_sessionmaker, uuid: str) -> Optional[str]:
+        """
+        Обновляет одну сущность по запросу оператора, не дожидаясь синхронизации.
+        Детали берутся из SD одним запросом с приоритетом: из резерва общего бюджета запросов,
+        который синхронизация не расходует (см. sync_partitions). Компании-владельцы,
+        которых нет в БД, догружаются вверх по иерархии.
+        Возвращает метакласс сохраненной сущности или None.
+        """
+        async with session_factory() as session:
+            meta_class = await self.find_entity_meta_class(session, uuid)
+        is_new = meta_class is None
+        with limiter.priority(), tracer.start_as_current_span('sync.refresh', {'uuid': uuid}):
+            async with httpx.AsyncClient(timeout=httpx.Timeout(30.0)) as client:
+                if meta_class is not None:
+                    details = await self.fetch_entity_details(client, uuid, meta_class)
+                else:
+                    details = await self.fetch_unknown_entity(client, uuid)
+                    meta_class = details.get('metaClass') if details else None
+                    if meta_class not in ENTITY_MODELS:
+                        logger.warning(f"Сущность {uuid} не найдена в SD или ее метакласс {meta_class} не синхронизируется.")
+                        return None
+                if not details:
+                    return None
+
+                # Цепочка владельцев, которых нет в БД: сохраняются от верхней компании к нижней
+                chain = []
+                ref = details.get(REFERENCE_ATTRS[meta_class])
+                owner_uuid = ref.get('UUID') if isinstance(ref, dict) else None
+                while owner_uuid and len(chain) < REFRESH_MAX_OWNER_DEPTH:
+                    async with session_factory() as session:
+                        if await self.find_entity_meta_class(session, owner_uuid):
+                            break
+                    owner = await self.fetch_entity_details(client, owner_uuid, 'ou$company')
+                    if not owner:
+                        logger.error(f"Компания {owner_uuid}, на которую ссылается {meta_class} {uuid}, не получена из SD.")
+                        return None
+                    chain.append(owner)
+                    parent = owner.get('parent')
+                    owner_uuid = parent.get('UUID') if isinstance(parent, dict) else None
+                for owner in reversed(chain):
+                    if not await self.save_entity_details(client, session_factory, 'ou$company', owner, is_new=True):
+                        return None
+                if chain:
+                    logger.info(f"Для {meta_class} {uuid} сохранено {len(chain)} отсутствовавших в БД компаний-владельцев.")
+
+                if not await self.save_entity_details(client, session_factory, meta_class, details, is_new):
+                    return None
+        logger.info(f"Сущность {meta_class} {uuid} обновлена по запросу оператора.")
+        return meta_class
+
+    async def get_search_result(self, session: AsyncSession, meta_class: str, uuid: str) -> Optional[SearchResultResponse]:
+        """Ответ в формате поиска, содержащий только сущность uuid."""
+        category, result_model = SEARCH_RESULT_CATEGORIES[meta_class]
+        entity = await REPOSITORY_CLASSES[meta_class](session).get_by_uuid(uuid)
+        if entity is None:
+            return None
+        results = {name: [] for name, _ in SEARCH_RESULT_CATEGORIES.values()}
+        results[category] = [result_model.model_validate(entity)]
+        return SearchResultResponse(**results)
+
     # Добавляем метод для получения ФР по владельцу (для использования в будущем)
     # Принимает session: AsyncSession
     async def get_fiscal_registers_by_owner(self, owner_uuid: str, session: AsyncSession) -> List[FiscalRegister]:
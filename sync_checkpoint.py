@@ -0,0 +1,192 @@
+import asyncio
+import datetime
+import logging
+import os
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from models import SyncCheckpoint as SyncCheckpointRow, CHECKPOINT_PENDING, CHECKPOINT_FAILED
+from repositories import SyncCheckpointRepository, SyncRunRepository
+from sync_partitions import partition_bucket
+from sync_records import ListRecord, from_epoch, to_epoch
+
+logger = logging.getLogger("ServiceDeskLogger")
+
+# Контрольные точки синхронизации.
+# После получения списков новые и измененные сущности записываются в sync_checkpoints
+# со статусом pending, по мере сохранения пачками помечаются done или failed.
+# Если процесс убит или SD перестал отвечать, следующий запуск берет необработанные
+# сущности прерванного запуска из контрольной точки и не запрашивает списки заново.
+# Неудачные сущности сохраняются между запусками: следующие запуски повторяют их первыми,
+# но не раньше next_attempt_at (экспоненциальная задержка по числу неудач подряд).
+#
+# Переменные окружения:
+# SYNC_CHECKPOINTS           - "0" выключить контрольные точки (по умолчанию включены)
+# SYNC_CHECKPOINT_BATCH      - сколько статусов копить перед записью в БД (200)
+# SYNC_RESUME_MAX_AGE        - продолжать запуск, прерванный не раньше стольких секунд назад (21600)
+# SYNC_RESUME_IDLE_SECONDS   - запуск в статусе running считается брошенным, если его контрольная
+#                              точка не обновлялась столько секунд (300)
+# SYNC_FAILED_BACKOFF_BASE   - задержка повтора после первой неудачи, сек (300), дальше удваивается
+# SYNC_FAILED_BACKOFF_MAX    - предел задержки повтора, сек (21600)
+SYNC_CHECKPOINTS = os.getenv("SYNC_CHECKPOINTS", "1") != "0"
+SYNC_CHECKPOINT_BATCH = int(os.getenv("SYNC_CHECKPOINT_BATCH", "200"))
+SYNC_RESUME_MAX_AGE = float(os.getenv("SYNC_RESUME_MAX_AGE", "21600"))
+SYNC_RESUME_IDLE_SECONDS = float(os.getenv("SYNC_RESUME_IDLE_SECONDS", "300"))
+SYNC_FAILED_BACKOFF_BASE = float(os.getenv("SYNC_FAILED_BACKOFF_BASE", "300"))
+SYNC_FAILED_BACKOFF_MAX = float(os.getenv("SYNC_FAILED_BACKOFF_MAX", "21600"))
+
+
+def failed_backoff(attempts: int) -> datetime.timedelta:
+    """Задержка перед следующим повтором сущности после attempts неудач подряд."""
+    return datetime.timedelta(seconds=min(SYNC_FAILED_BACKOFF_BASE * 2 ** max(attempts - 1, 0), SYNC_FAILED_BACKOFF_MAX))
+
+
+class SyncCheckpoint:
+    """
+    Контрольная точка одного запуска синхронизации. Статусы копятся в памяти и пишутся
+    в БД пачками (flush), коммит выполняется здесь же: это служебные данные запуска,
+    они не должны зависеть от транзакций сохранения сущностей.
+    """
+
+    def __init__(self, session_factory: async_sessionmaker, run_id: int, owns_run: bool = True):
+        self.session_factory = session_factory
+        self.run_id = run_id
+        # Воркер части запуска (owns_run=False) не пишет счетчики в sync_runs: это делает координатор
+        self.owns_run = owns_run
+        # Сущности в работе: {meta_class: {uuid}}
+        self.pending: Dict[str, Set[str]] = {}
+        # Неудачи прошлых запусков: {(meta_class, uuid): (attempts, next_attempt_at)}
+        self.failures: Dict[Tuple[str, str], Tuple[int, Optional[datetime.datetime]]] = {}
+        self._done: Dict[str, List[str]] = {}
+        self._failed: List[Dict] = []
+        self._marks = 0
+        self._lock = asyncio.Lock()
+
+    async def load_failures(self):
+        """
+        Удаляет строки завершенных и брошенных запусков (кроме неудачных) и загружает неудачные сущности.
+        Строки запуска, который идет параллельно (другой процесс), остаются: их не продолжает и resume.
+        """
+        async with self.session_factory() as session:
+            repo = SyncCheckpointRepository(session)
+            now = datetime.datetime.utcnow()
+            expired_before = now - datetime.timedelta(seconds=SYNC_FAILED_BACKOFF_MAX)
+            await repo.clear_finished(expired_before, now - datetime.timedelta(seconds=SYNC_RESUME_IDLE_SECONDS))
+            await session.commit()
+            rows = await repo.list_by_status(CHECKPOINT_FAILED)
+        self.failures = {(row.meta_class, row.uuid): (row.attempts, row.next_attempt_at) for row in rows}
+        if self.failures:
+            logger.info(f"В контрольной точке {len(self.failures)} сущностей, не сохраненных в прошлых запусках.")
+
+    async def resume(self) -> Optional[Tuple[int, Dict[str, List[ListRecord]], Dict[str, Dict]]]:
+        """
+        Находит прерванный запуск и забирает его необработанные сущности.
+        Возвращает (id прерванного запуска, {meta_class: [ListRecord]}, его счетчики) или None.
+        """
+        async with self.session_factory() as session:
+            repo = SyncCheckpointRepository(session)
+            old_run_id = await repo.find_resumable(
+                datetime.timedelta(seconds=SYNC_RESUME_MAX_AGE), datetime.timedelta(seconds=SYNC_RESUME_IDLE_SECONDS)
+            )
+            if old_run_id is None or old_run_id == self.run_id:
+                return None
+            rows = await repo.list_by_status(CHECKPOINT_PENDING, old_run_id)
+            old_run = await SyncRunRepository(session).get(old_run_id)
+            await repo.adopt(old_run_id, self.run_id)
+            await session.commit()
+        return old_run_id, self.take_rows(rows), (old_run.stats if old_run and old_run.stats else {})
+
+    def take_rows(self, rows: List[SyncCheckpointRow]) -> Dict[str, List[ListRecord]]:
+        """Берет в работу строки pending контрольной точки. Возвращает {meta_class: [ListRecord]}."""
+        records: Dict[str, List[ListRecord]] = {}
+        for row in rows:
+            records.setdefault(row.meta_class, []).append(ListRecord(row.uuid, to_epoch(row.sd_modified), row.ref_uuid))
+            self.pending.setdefault(row.meta_class, set()).add(row.uuid)
+            if row.attempts:
+                # Повтор неудачной сущности: при новой неудаче задержка продолжает расти
+                self.failures[(row.meta_class, row.uuid)] = (row.attempts, row.next_attempt_at)
+        return records
+
+    def is_backed_off(self, meta_class: str, uuid: str, now: datetime.datetime) -> bool:
+        """Сущность недавно не удалось сохранить, и время следующей попытки еще не пришло."""
+        failure = self.failures.get((meta_class, uuid))
+        return failure is not None and failure[1] is not None and failure[1] > now
+
+    async def start(self, stale: Dict[str, List[ListRecord]]):
+        """Записывает новые и измененные сущности запуска (pending), неудачные прошлых запусков снова берутся в работу."""
+        new_rows, retaken = [], []
+        for meta_class, records in stale.items():
+            uuids = self.pending.setdefault(meta_class, set())
+            for record in records:
+                if record.uuid in uuids:
+                    continue
+                uuids.add(record.uuid)
+                row = {'meta_class': meta_class, 'uuid': record.uuid, 'sd_modified': from_epoch(record.modified),
+                       'ref_uuid': record.ref_uuid, 'bucket': partition_bucket(record.uuid)}
+                (retaken if (meta_class, record.uuid) in self.failures else new_rows).append(row)
+        async with self.session_factory() as session:
+            repo = SyncCheckpointRepository(session)
+            await repo.add_pending(self.run_id, new_rows)
+            await repo.retake_failed(self.run_id, retaken)
+            await session.commit()
+        logger.info(f"Контрольная точка запуска {self.run_id}: в работе {len(new_rows) + len(retaken)} сущностей, "
+                    f"из них повторов неудачных {len(retaken)}.")
+
+    def done(self, meta_class: str, uuid: str):
+        if uuid in self.pending.get(meta_class, ()):
+            self._done.setdefault(meta_class, []).append(uuid)
+            self._marks += 1
+
+    def failed(self, meta_class: str, uuid: str, error: str):
+        if uuid not in self.pending.get(meta_class, ()):
+            return
+        attempts = self.failures.get((meta_class, uuid), (0, None))[0] + 1
+        self._failed.append({
+            'meta_class': meta_class, 'uuid': uuid, 'attempts': attempts,
+            'next_attempt_at': datetime.datetime.utcnow() + failed_backoff(attempts), 'error': error[:1000]
+        })
+        self._marks += 1
+
+    def due(self) -> bool:
+        """Накопилось достаточно статусов для записи, и запись сейчас не идет."""
+        return self._marks >= SYNC_CHECKPOINT_BATCH and not self._lock.locked()
+
+    async def flush(self, progress: Optional[Dict[str, Dict]] = None, before_write: Optional[Callable[[], Awaitable[None]]] = None):
+        """
+        Записывает накопленные статусы и (если передан) промежуточные счетчики запуска в sync_runs.
+        before_write выполняется после того, как статусы забраны из буфера, но до их записи:
+        так сущность не помечается done раньше, чем сохранены ее отложенные изменения.
+        """
+        async with self._lock:
+            done, failed = self._done, self._failed
+            self._done, self._failed, self._marks = {}, [], 0
+            if before_write is not None:
+                await before_write()
+            if not done and not failed and (progress is None or not self.owns_run):
+                return
+            async with self.session_factory() as session:
+                try:
+                    repo = SyncCheckpointRepository(session)
+                    for meta_class, uuids in done.items():
+                        await repo.mark_done(meta_class, uuids)
+                    await repo.mark_failed(failed)
+                    if progress is not None and self.owns_run:
+                        await SyncRunRepository(session).save_progress(self.run_id, progress)
+                    await session.commit()
+                except Exception as e:
+                    # Потеря пачки статусов не страшна: при продолжении эти сущности окажутся актуальными в БД
+                    logger.error(f"Ошибка записи контрольной точки запуска {self.run_id}: {e}", exc_info=True)
+                    await session.rollback()
+
+    async def finish(self):
+        """Запуск завершен: в контрольной точке остаются только неудачные сущности."""
+        await self.flush()
+        async with self.session_factory() as session:
+            try:
+                removed = await SyncCheckpointRepository(session).finish_run(self.run_id)
+                await session.commit()
+                logger.debug(f"Контрольная точка запуска {self.run_id} закрыта, удалено {removed} строк.")
+            except Exception as e:
+                logger.error(f"Ошибка закрытия контрольной точки запуска {self.run_id}: {e}", exc_info=True)
+                await session.rollback()
@@ -0,0 +1,168 @@
+import datetime
+import logging
+import os
+import sys
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple
+
+from sqlalchemy import DateTime, bindparam, text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from sync_records import ListRecord, from_epoch, to_epoch
+
+logger = logging.getLogger("ServiceDeskLogger")
+
+# Поиск изменений на стороне БД.
+# Вместо загрузки всех (uuid, last_modified_date, content_hash) из четырех таблиц в словари
+# списки из SD (UUID, lastModifiedDate, владелец/родитель) загружаются во временную таблицу
+# (в PostgreSQL - через COPY), а новые, измененные, отсутствующие в SD и "осиротевшие"
+# сущности находятся несколькими запросами с JOIN. В Python возвращаются только
+# устаревшие сущности, поэтому память синхронизации зависит от числа изменений,
+# а не от размера каталога.
+#
+# Переменные окружения:
+# SYNC_DIFF_ENGINE - "python" (по умолчанию, словари в памяти) или "sql" (временная таблица)
+SYNC_DIFF_ENGINE = os.getenv("SYNC_DIFF_ENGINE", "python")
+
+STAGING_TABLE = "sd_stage"
+# Размер пачки INSERT для БД без COPY (SQLite в разработке)
+STAGING_INSERT_BATCH = 5000
+
+# Таблица сущностей каждого метакласса
+ENTITY_TABLES = {
+    'ou$company': 'companies',
+    'objectBase$Server': 'servers',
+    'objectBase$Workstation': 'workstations',
+    'objectBase$FR': 'fiscal_registers',
+}
+
+STAGING_COLUMNS = ['meta_class', 'uuid', 'sd_modified', 'ref_uuid']
+
+
+def staging_records(meta_class: str, records: List[ListRecord]) -> Iterator[Tuple[str, str, datetime.datetime, Optional[str]]]:
+    """Строки временной таблицы из компактного списка SD."""
+    for record in records:
+        yield (meta_class, record.uuid, from_epoch(record.modified), record.ref_uuid)
+
+
+async def _load_staging(session: AsyncSession, sd_lists: Dict[str, List[ListRecord]]) -> int:
+    """Создает временную таблицу и загружает в нее списки SD. Возвращает число строк."""
+    conn = await session.connection()
+    is_postgres = conn.dialect.name == 'postgresql'
+    if not is_postgres:
+        # В SQLite временные таблицы живут до закрытия соединения, а соединения переиспользуются пулом
+        await conn.execute(text(f"DROP TABLE IF EXISTS temp.{STAGING_TABLE}"))
+    await conn.execute(text(
+        f"CREATE TEMPORARY TABLE {STAGING_TABLE} ("
+        "meta_class VARCHAR NOT NULL, uuid VARCHAR NOT NULL, sd_modified TIMESTAMP NOT NULL, "
+        "ref_uuid VARCHAR, stale BOOLEAN NOT NULL DEFAULT FALSE)"
+        + (" ON COMMIT DROP" if is_postgres else "")
+    ))
+
+    loaded = 0
+    if is_postgres:
+        # COPY через соединение asyncpg в той же транзакции, что и CREATE TEMPORARY TABLE.
+        # Строки передаются генератором, без промежуточного списка.
+        raw = await conn.get_raw_connection()
+        for meta_class, sd_list in sd_lists.items():
+            await raw.driver_connection.copy_records_to_table(
+                STAGING_TABLE, records=staging_records(meta_class, sd_list), columns=STAGING_COLUMNS
+            )
+        loaded = (await conn.execute(text(f"SELECT COUNT(*) FROM {STAGING_TABLE}"))).scalar()
+    else:
+        insert = text(
+            f"INSERT INTO {STAGING_TABLE} (meta_class, uuid, sd_modified, ref_uuid) "
+            "VALUES (:meta_class, :uuid, :sd_modified, :ref_uuid)"
+        ).bindparams(bindparam('sd_modified', type_=DateTime())) # Формат даты как у колонок моделей
+        for meta_class, sd_list in sd_lists.items():
+            batch = []
+            for record in staging_records(meta_class, sd_list):
+                batch.append(dict(zip(STAGING_COLUMNS, record)))
+                if len(batch) >= STAGING_INSERT_BATCH:
+                    await conn.execute(insert, batch)
+                    loaded += len(batch)
+                    batch = []
+            if batch:
+                await conn.execute(insert, batch)
+                loaded += len(batch)
+
+    await conn.execute(text(f"CREATE INDEX {STAGING_TABLE}_uuid ON {STAGING_TABLE} (meta_class, uuid)"))
+    await conn.execute(text(f"CREATE INDEX {STAGING_TABLE}_ref ON {STAGING_TABLE} (ref_uuid)"))
+    await conn.execute(text(f"ANALYZE {STAGING_TABLE}"))
+    return loaded
+
+
+async def compute_sync_diff(session: AsyncSession, sd_lists: Dict[str, List[ListRecord]], partial: bool = False) -> Dict[str, Any]:
+    """
+    Сравнивает списки SD с БД во временной таблице.
+    Возвращает {'meta_classes': {meta_class: delta}, 'known_company_uuids': set}, где delta:
+        'stale'       - новые и измененные сущности (ListRecord)
+        'db_dates'    - {uuid: last_modified_date в секундах от эпохи} измененных сущностей (новых там нет)
+        'db_hashes'   - {uuid: content_hash} измененных сущностей
+        'total'       - сколько сущностей метакласса в списке SD
+        'unchanged'   - сколько из них актуальны в БД
+        'missing_in_sd' - сколько сущностей есть в БД, но отсутствуют в списке SD
+        'orphaned'    - сколько устаревших сущностей ссылаются на компанию, которой нет ни в БД, ни в SD
+    known_company_uuids - компании из БД, на которые ссылаются устаревшие сущности
+    (как родитель или владелец): этого достаточно для проверки ссылок на этапах синхронизации.
+    Временная таблица живет до конца транзакции session, вызывающий ее откатывает.
+    partial=True - списки содержат только часть SD (выборочная синхронизация): missing_in_sd не считается.
+    """
+    conn = await session.connection()
+    loaded = await _load_staging(session, sd_lists)
+    logger.info(f"Во временную таблицу {STAGING_TABLE} загружено {loaded} сущностей из списков SD.")
+
+    diff: Dict[str, Any] = {'meta_classes': {}, 'known_company_uuids': set()}
+    for meta_class in sd_lists:
+        table = ENTITY_TABLES[meta_class]
+        params = {'meta_class': meta_class}
+        # Устаревшие: нет в БД, дата в БД не указана или старше даты SD
+        await conn.execute(text(
+            f"UPDATE {STAGING_TABLE} SET stale = TRUE WHERE meta_class = :meta_class AND NOT EXISTS ("
+            f"SELECT 1 FROM {table} t WHERE t.uuid = {STAGING_TABLE}.uuid "
+            f"AND t.last_modified_date >= {STAGING_TABLE}.sd_modified)"
+        ), params)
+
+        delta = {'stale': [], 'db_dates': {}, 'db_hashes': {}, 'total': 0, 'unchanged': 0, 'missing_in_sd': 0, 'orphaned': 0}
+        rows = await conn.stream(text(
+            f"SELECT s.uuid, s.sd_modified, s.ref_uuid, t.last_modified_date, t.content_hash "
+            f"FROM {STAGING_TABLE} s LEFT JOIN {table} t ON t.uuid = s.uuid "
+            "WHERE s.meta_class = :meta_class AND s.stale"
+        ).columns(sd_modified=DateTime(), last_modified_date=DateTime()), params)
+        async for uuid, sd_modified, ref_uuid, db_date, content_hash in rows:
+            delta['stale'].append(ListRecord(sys.intern(uuid), to_epoch(sd_modified), sys.intern(ref_uuid) if ref_uuid else None))
+            if db_date is not None:
+                delta['db_dates'][uuid] = to_epoch(db_date)
+                delta['db_hashes'][uuid] = content_hash
+
+        counts = (await conn.execute(text(
+            f"SELECT COUNT(*), COUNT(*) FILTER (WHERE NOT stale) FROM {STAGING_TABLE} WHERE meta_class = :meta_class"
+        ), params)).one()
+        delta['total'], delta['unchanged'] = counts
+        if delta['total'] and not partial:
+            # Пустой список скорее означает ошибку получения, чем удаление всего из SD
+            delta['missing_in_sd'] = (await conn.execute(text(
+                f"SELECT COUNT(*) FROM {table} t WHERE NOT EXISTS ("
+                f"SELECT 1 FROM {STAGING_TABLE} s WHERE s.meta_class = :meta_class AND s.uuid = t.uuid)"
+            ), params)).scalar()
+        delta['orphaned'] = (await conn.execute(text(
+            f"SELECT COUNT(*) FROM {STAGING_TABLE} s WHERE s.meta_class = :meta_class AND s.stale "
+            "AND s.ref_uuid IS NOT NULL "
+            "AND NOT EXISTS (SELECT 1 FROM companies c WHERE c.uuid = s.ref_uuid) "
+            f"AND NOT EXISTS (SELECT 1 FROM {STAGING_TABLE} p WHERE p.meta_class = 'ou$company' AND p.uuid = s.ref_uuid)"
+        ), params)).scalar()
+
+        logger.info(
+            f"Метакласс {meta_class}: в SD {delta['total']}, актуальны {delta['unchanged']}, "
+            f"новых и измененных {len(delta['stale'])}, нет в SD {delta['missing_in_sd']}, "
+            f"ссылаются на неизвестную компанию {delta['orphaned']}."
+        )
+        diff['meta_classes'][meta_class] = delta
+
+    known: Set[str] = set()
+    rows = await conn.stream(text(
+        f"SELECT DISTINCT c.uuid FROM {STAGING_TABLE} s JOIN companies c ON c.uuid = s.ref_uuid WHERE s.stale"
+    ))
+    async for (uuid,) in rows:
+        known.add(uuid)
+    diff['known_company_uuids'] = known
+    return diff
@@ -0,0 +1,162 @@
+import datetime
+import json
+import logging
+import os
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from repositories import SyncEventRepository
+from services import ServiceDeskService, ENTITY_MODELS
+from sync_checkpoint import failed_backoff
+from sync_target import SyncTarget, uuid_prefix
+
+logger = logging.getLogger("ServiceDeskLogger")
+
+# Синхронизация по уведомлениям SD об изменении сущностей.
+# SD вызывает POST /sync/events с пачкой уведомлений {"UUID", "metaClass"}, API только
+# записывает их в таблицу sync_events (повторное уведомление о той же сущности схлопывается
+# в одну строку) и сразу отвечает. Воркер (sync_runner.py --events) забирает сущности,
+# о которых не было уведомлений SYNC_EVENTS_COALESCE секунд (частые правки одной сущности
+# обрабатываются один раз), но не позже SYNC_EVENTS_MAX_DELAY после первого уведомления,
+# и прогоняет их пачкой через обычный конвейер выборочной синхронизации (SyncTarget с entities):
+# find с фильтром по UUID, детали, очистка, сохранение, тот же лимитер запросов к SD.
+# Если пачка не обработана (SD или БД недоступны, список метакласса не получен или часть
+# его сущностей не сохранена), сущности метакласса возвращаются в очередь с экспоненциальной
+# задержкой, но не больше SYNC_EVENTS_MAX_ATTEMPTS раз: дальше, как и удаления в SD,
+# их догоняет ночная полная синхронизация.
+#
+# Переменные окружения:
+# SYNC_EVENTS_TOKEN         - токен заголовка X-Events-Token; без него эндпоинт недоступен
+# SYNC_EVENTS_COALESCE      - окно схлопывания: сколько секунд сущность должна не меняться (5)
+# SYNC_EVENTS_MAX_DELAY     - предел ожидания сущности, которую меняют непрерывно, сек (30)
+# SYNC_EVENTS_BATCH         - сколько сущностей воркер обрабатывает за раз (500)
+# SYNC_EVENTS_POLL_INTERVAL - как часто воркер проверяет очередь, если она пуста, сек (1)
+# SYNC_EVENTS_CLAIM_STALE   - через сколько секунд забранная воркером сущность считается брошенной (600)
+# SYNC_EVENTS_MAX_ATTEMPTS  - сколько раз повторять сущности, которые не удалось обработать (5)
+# SYNC_EVENTS_RECORD        - файл, в который API дописывает полученные пачки (JSONL) для
+#                             benchmarks/replay_events.py; по умолчанию не пишется
+SYNC_EVENTS_TOKEN = os.getenv("SYNC_EVENTS_TOKEN")
+SYNC_EVENTS_COALESCE = float(os.getenv("SYNC_EVENTS_COALESCE", "5"))
+SYNC_EVENTS_MAX_DELAY = float(os.getenv("SYNC_EVENTS_MAX_DELAY", "30"))
+SYNC_EVENTS_BATCH = int(os.getenv("SYNC_EVENTS_BATCH", "500"))
+SYNC_EVENTS_POLL_INTERVAL = float(os.getenv("SYNC_EVENTS_POLL_INTERVAL", "1"))
+SYNC_EVENTS_CLAIM_STALE = float(os.getenv("SYNC_EVENTS_CLAIM_STALE", "600"))
+SYNC_EVENTS_MAX_ATTEMPTS = int(os.getenv("SYNC_EVENTS_MAX_ATTEMPTS", "5"))
+SYNC_EVENTS_RECORD = os.getenv("SYNC_EVENTS_RECORD")
+
+
+def _meta_class_by_prefix() -> Dict[str, str]:
+    """Префикс UUID -> метакласс, если префикс однозначен (у оборудования общий префикс objectBase)."""
+    by_prefix: Dict[str, List[str]] = {}
+    for meta_class in ENTITY_MODELS:
+        by_prefix.setdefault(uuid_prefix(meta_class), []).append(meta_class)
+    return {prefix: meta_classes[0] for prefix, meta_classes in by_prefix.items() if len(meta_classes) == 1}
+
+
+def parse_events(payload: Any) -> Tuple[List[Dict[str, str]], int]:
+    """
+    Уведомления из тела запроса: список [{"UUID", "metaClass"}] или {"events": [...]}.
+    Без metaClass метакласс определяется по префиксу UUID, если он однозначен.
+    Возвращает ([{meta_class, uuid}] без дублей, число пропущенных: не синхронизируемые метаклассы и мусор).
+    """
+    items = payload.get('events') if isinstance(payload, dict) else payload
+    if not isinstance(items, list):
+        raise ValueError("Ожидается список уведомлений или объект с полем events")
+    by_prefix = _meta_class_by_prefix()
+    events, ignored = {}, 0
+    for item in items:
+        uuid = item.get('UUID') if isinstance(item, dict) else None
+        if not isinstance(uuid, str) or '$' not in uuid:
+            ignored += 1
+            continue
+        meta_class = item.get('metaClass') or by_prefix.get(uuid_prefix(uuid))
+        if not isinstance(meta_class, str) or meta_class not in ENTITY_MODELS:
+            ignored += 1
+            continue
+        events[(meta_class, uuid)] = {'meta_class': meta_class, 'uuid': uuid}
+    return list(events.values()), ignored
+
+
+def record_events(payload: Any, path: str = SYNC_EVENTS_RECORD):
+    """Дописывает полученную пачку в файл записи (JSONL: {"at": время получения, "events": тело запроса})."""
+    line = json.dumps({'at': datetime.datetime.utcnow().isoformat(), 'events': payload}, ensure_ascii=False)
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write(line + '\n')
+
+
+async def process_events(service: ServiceDeskService, session_factory: async_sessionmaker, worker_id: str) -> Optional[int]:
+    """
+    Забирает и обрабатывает одну пачку сущностей из sync_events.
+    Возвращает число обработанных сущностей, 0 - очередь пуста, None - пачка возвращена в очередь.
+    """
+    async def release(items: List[Tuple], error: str) -> int:
+        """Возвращает сущности в очередь с задержкой. Исчерпавшие попытки остаются за воркером и удаляются finish."""
+        failed_at = datetime.datetime.utcnow()
+        retry = [
+            {'meta_class': meta_class, 'uuid': uuid, 'attempts': attempts + 1,
+             'next_attempt_at': failed_at + failed_backoff(attempts + 1), 'error': error[:1000]}
+            for meta_class, uuid, attempts, *_ in items if attempts + 1 < SYNC_EVENTS_MAX_ATTEMPTS
+        ]
+        if len(retry) < len(items):
+            logger.warning(f"Воркер {worker_id}: {len(items) - len(retry)} сущностей исчерпали {SYNC_EVENTS_MAX_ATTEMPTS} попыток "
+                           f"и будут обновлены полной синхронизацией. Последняя ошибка: {error}")
+        async with session_factory() as session:
+            released = await SyncEventRepository(session).release(worker_id, retry)
+            await session.commit()
+        return released
+
+    now = datetime.datetime.utcnow()
+    async with session_factory() as session:
+        claimed = await SyncEventRepository(session).claim(
+            worker_id,
+            quiet_since=now - datetime.timedelta(seconds=SYNC_EVENTS_COALESCE),
+            overdue_since=now - datetime.timedelta(seconds=SYNC_EVENTS_MAX_DELAY),
+            stale_claim_since=now - datetime.timedelta(seconds=SYNC_EVENTS_CLAIM_STALE),
+            limit=SYNC_EVENTS_BATCH,
+        )
+        claimed = [(event.meta_class, event.uuid, event.attempts, event.received_at, event.events) for event in claimed]
+        await session.commit()
+    if not claimed:
+        return 0
+
+    entities: Dict[str, List[str]] = {}
+    for meta_class, uuid, *_ in claimed:
+        entities.setdefault(meta_class, []).append(uuid)
+    oldest = min(received_at for *_, received_at, _ in claimed)
+    logger.info(f"Воркер {worker_id}: {len(claimed)} сущностей по {sum(count for *_, count in claimed)} уведомлениям SD, "
+                f"первое получено {(now - oldest).total_seconds():.1f}с назад.")
+    try:
+        await service.sync_data_incrementally(session_factory, target=SyncTarget(entities=entities))
+    except Exception as e:
+        logger.error(f"Ошибка обработки уведомлений SD воркером {worker_id}: {e}", exc_info=True)
+        await release(claimed, f"{type(e).__name__}: {e}")
+        await finish(session_factory, worker_id)
+        return None
+
+    # Ошибки списков и сохранения сущностей конвейер пишет в лог и счетчики (failed), не прерывая запуск.
+    # Какие именно сущности не сохранены, неизвестно, поэтому повторяется весь метакласс:
+    # повтор дешевый, сущности без изменений в SD детали не запрашивают
+    failed_meta_classes = [meta_class for meta_class in entities if service.sync_stats.get(meta_class, {}).get('failed')]
+    # Сущности, которых нет в ответе SD (удалены после уведомления), не повторяются: их удаление
+    # из БД, как и прочие удаления в SD, выполняет полная синхронизация
+    missing = sum(max(len(uuids) - service.sync_stats.get(meta_class, {}).get('listed', 0), 0)
+                  for meta_class, uuids in entities.items() if meta_class not in failed_meta_classes)
+    if missing:
+        logger.info(f"Воркер {worker_id}: {missing} сущностей из уведомлений не найдены в SD и убраны из очереди.")
+    if failed_meta_classes:
+        await release([item for item in claimed if item[0] in failed_meta_classes],
+                      f"Не обработаны сущности метаклассов {', '.join(failed_meta_classes)}, см. лог синхронизации")
+    removed = await finish(session_factory, worker_id)
+    if removed < len(claimed):
+        logger.info(f"Воркер {worker_id}: {len(claimed) - removed} сущностей изменились во время обработки "
+                    f"или возвращены для повтора и остались в очереди.")
+    return len(claimed)
+
+
+async def finish(session_factory: async_sessionmaker, worker_id: str) -> int:
+    """Удаляет из очереди сущности, которые остались за воркером после обработки пачки."""
+    async with session_factory() as session:
+        removed = await SyncEventRepository(session).finish(worker_id)
+        await session.commit()
+    return removed
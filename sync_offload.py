@@ -0,0 +1,90 @@
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional, List, Dict, Any
+
+from data_validator import BATCH_VALIDATORS, rows_from_columns
+
+logger = logging.getLogger("ServiceDeskLogger")
+
+# Размер пула процессов для разбора JSON и валидации во время синхронизации.
+# 0 - пул выключен, все выполняется в event loop, как раньше.
+SYNC_PROCESS_POOL_SIZE = int(os.getenv("SYNC_PROCESS_POOL_SIZE", "0"))
+# Ответы меньше этого размера (байт) разбираются прямо в event loop: передача в процесс дороже
+SYNC_OFFLOAD_MIN_BYTES = int(os.getenv("SYNC_OFFLOAD_MIN_BYTES", str(256 * 1024)))
+# Сколько записей валидировать одной задачей пула
+SYNC_OFFLOAD_CHUNK_SIZE = int(os.getenv("SYNC_OFFLOAD_CHUNK_SIZE", "2000"))
+
+_process_pool: Optional[ProcessPoolExecutor] = None
+
+
+def _init_worker():
+    """Инициализация процесса пула: сообщения валидаторов (по умолчанию от WARNING) выводим в stderr."""
+    logging.basicConfig(
+        level=os.getenv("SYNC_WORKER_LOG_LEVEL", "WARNING").upper(),
+        format='%(asctime)s - %(levelname)s - %(processName)s - %(message)s'
+    )
+
+
+def get_process_pool() -> Optional[ProcessPoolExecutor]:
+    """Возвращает пул процессов (создается при первом обращении) или None, если пул выключен."""
+    global _process_pool
+    if SYNC_PROCESS_POOL_SIZE <= 0:
+        return None
+    if _process_pool is None:
+        # spawn: не копируем в дочерние процессы event loop, соединения с БД и потоки uvicorn
+        _process_pool = ProcessPoolExecutor(
+            max_workers=SYNC_PROCESS_POOL_SIZE,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker
+        )
+        logger.info(f"Запущен пул из {SYNC_PROCESS_POOL_SIZE} процессов для разбора и валидации данных SD.")
+    return _process_pool
+
+
+def shutdown_process_pool():
+    """Останавливает пул процессов, если он был запущен."""
+    global _process_pool
+    if _process_pool is not None:
+        _process_pool.shutdown(wait=True, cancel_futures=True)
+        _process_pool = None
+        logger.info("Пул процессов разбора и валидации данных SD остановлен.")
+
+
+def _validate_chunk(meta_class: str, records: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Выполняется в процессе пула: пакетная валидация записей одного метакласса."""
+    return rows_from_columns(BATCH_VALIDATORS[meta_class](records))
+
+
+async def parse_json(content: bytes) -> Any:
+    """Разбирает JSON ответа SD. Большие ответы разбираются в пуле процессов, если он включен."""
+    pool = get_process_pool()
+    if pool is None or len(content) < SYNC_OFFLOAD_MIN_BYTES:
+        return json.loads(content)
+    return await asyncio.get_running_loop().run_in_executor(pool, json.loads, content)
+
+
+async def validate_records(meta_class: str, records: List[Dict[str, Any]]) -> Optional[Dict[str, Dict[str, Any]]]:
+    """
+    Валидирует сырые записи SD в пуле процессов пачками по SYNC_OFFLOAD_CHUNK_SIZE.
+    Возвращает {uuid: очищенные данные} или None, если пул выключен или для метакласса
+    нет пакетного валидатора (тогда записи валидируются по одной в process_and_save_entity).
+    """
+    pool = get_process_pool()
+    if pool is None or meta_class not in BATCH_VALIDATORS or not records:
+        return None
+
+    loop = asyncio.get_running_loop()
+    chunks = [records[i:i + SYNC_OFFLOAD_CHUNK_SIZE] for i in range(0, len(records), SYNC_OFFLOAD_CHUNK_SIZE)]
+    try:
+        results = await asyncio.gather(*(loop.run_in_executor(pool, _validate_chunk, meta_class, chunk) for chunk in chunks))
+    except Exception as e:
+        logger.error(f"Ошибка пакетной валидации {meta_class} в пуле процессов: {e}", exc_info=True)
+        return None
+
+    validated = {row['uuid']: row for rows in results for row in rows if row.get('uuid')}
+    logger.debug("В пуле процессов провалидировано %s из %s записей %s.", len(validated), len(records), meta_class)
+    return validated
@@ -0,0 +1,178 @@
+import asyncio
+import contextlib
+import datetime
+import logging
+import os
+import time
+import zlib
+from typing import List, Optional
+
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from repositories import SdRateBudgetRepository, SyncPartitionRepository
+
+logger = logging.getLogger("ServiceDeskLogger")
+
+# Синхронизация несколькими воркерами (sync_runner.py --workers N, --join с других хостов).
+# Запуск-координатор получает списки, обрабатывает компании (их иерархию нельзя делить)
+# и записывает новое и измененное оборудование в контрольную точку (sync_checkpoints).
+# Каждая сущность попадает в корзину по crc32 своего UUID, корзины делятся на части
+# (sync_partitions): части bucket % partitions == partition. Воркеры, включая координатора,
+# забирают части через FOR UPDATE SKIP LOCKED, шлют heartbeat и записывают итоги части
+# в sync_partitions.report; координатор складывает их в общий отчет запуска (sync_runs).
+# Общий потолок частоты запросов к SD соблюдается через бюджет в БД (sd_rate_budget),
+# из которого процессы берут токены порциями. Бюджет подключается при старте каждого процесса,
+# обращающегося к SD (API, sync_runner.py во всех режимах): SD_RATE_LIMIT остается потолком
+# отдельного процесса, SD_GLOBAL_RATE_LIMIT - всех вместе.
+#
+# Переменные окружения:
+# SYNC_PARTITIONS_PER_WORKER   - частей на воркера: мелкие части выравнивают нагрузку (4)
+# SYNC_PARTITION_POLL_INTERVAL - как часто координатор проверяет части других воркеров, сек (2)
+# SYNC_PARTITION_HEARTBEAT     - как часто воркер обновляет heartbeat части, сек (15)
+# SYNC_PARTITION_STALE_AFTER   - через сколько секунд без heartbeat часть возвращается в очередь (120)
+# SYNC_PARTITION_MAX_ATTEMPTS  - сколько раз часть возвращается в очередь до ошибки (3)
+# SD_GLOBAL_RATE_LIMIT         - общий для всех воркеров потолок запросов к SD в секунду (SD_RATE_LIMIT, 45)
+# SD_GLOBAL_RATE_LEASE         - сколько токенов процесс берет из бюджета за одно обращение к БД (5)
+# SD_PRIORITY_RESERVE          - сколько токенов бюджета синхронизация оставляет запросам оператора
+#                                (обновление сущности из интерфейса): они не ждут идущую синхронизацию (5)
+# SD_RATE_BUDGET_RETRY         - сколько секунд после ошибки обращения к бюджету запросы выпускаются
+#                                без него, только по локальному лимитеру процесса (10)
+SYNC_PARTITION_BUCKETS = 256
+SYNC_PARTITIONS_PER_WORKER = int(os.getenv("SYNC_PARTITIONS_PER_WORKER", "4"))
+SYNC_PARTITION_POLL_INTERVAL = float(os.getenv("SYNC_PARTITION_POLL_INTERVAL", "2"))
+SYNC_PARTITION_HEARTBEAT = float(os.getenv("SYNC_PARTITION_HEARTBEAT", "15"))
+SYNC_PARTITION_STALE_AFTER = float(os.getenv("SYNC_PARTITION_STALE_AFTER", "120"))
+SYNC_PARTITION_MAX_ATTEMPTS = int(os.getenv("SYNC_PARTITION_MAX_ATTEMPTS", "3"))
+SD_GLOBAL_RATE_LIMIT = float(os.getenv("SD_GLOBAL_RATE_LIMIT", os.getenv("SD_RATE_LIMIT", "45")))
+SD_GLOBAL_RATE_LEASE = float(os.getenv("SD_GLOBAL_RATE_LEASE", "5"))
+SD_PRIORITY_RESERVE = float(os.getenv("SD_PRIORITY_RESERVE", "5"))
+SD_RATE_BUDGET_RETRY = float(os.getenv("SD_RATE_BUDGET_RETRY", "10"))
+SD_RATE_BUDGET_NAME = "servicedesk"
+
+
+def partition_bucket(uuid: str) -> int:
+    """Корзина сущности: crc32 UUID одинаков во всех процессах (в отличие от hash())."""
+    return zlib.crc32(uuid.encode()) % SYNC_PARTITION_BUCKETS
+
+
+def partition_count(workers: int) -> int:
+    return max(1, min(SYNC_PARTITION_BUCKETS, workers * SYNC_PARTITIONS_PER_WORKER))
+
+
+def partition_buckets(partition: int, partitions: int) -> List[int]:
+    return [bucket for bucket in range(SYNC_PARTITION_BUCKETS) if bucket % partitions == partition]
+
+
+class DbRateBudget:
+    """
+    Общий бюджет запросов к SD для нескольких процессов (token bucket в таблице sd_rate_budget).
+    Подключается к AdaptiveLimiter как external_budget: лимитер выпускает запрос только после
+    получения токена. Токены берутся из БД порциями по SD_GLOBAL_RATE_LEASE, поэтому обращение
+    к БД приходится на несколько запросов. Часы процессов должны быть синхронизированы (NTP).
+    Обычные запросы не трогают последние reserve токенов бюджета: их берут только приоритетные
+    (запросы оператора), по одному, поэтому приоритетный запрос ждет не дольше обращения к БД,
+    пока резерв не исчерпан.
+    """
+
+    def __init__(self, session_factory: async_sessionmaker, name: str = SD_RATE_BUDGET_NAME,
+                 rate: float = SD_GLOBAL_RATE_LIMIT, lease: float = SD_GLOBAL_RATE_LEASE,
+                 reserve: float = SD_PRIORITY_RESERVE):
+        self.session_factory = session_factory
+        self.name = name
+        self.rate = rate
+        self.lease = max(1.0, lease)
+        # Резерв меньше емкости бюджета (rate), иначе обычным запросам ничего не останется
+        self.reserve = min(max(0.0, reserve), max(0.0, rate - 1))
+        self._tokens = 0.0
+        self._lock = asyncio.Lock()
+        # До этого момента (time.monotonic) бюджет считается недоступным после ошибки БД
+        self._unavailable_until = 0.0
+
+    async def configure(self):
+        """Создает бюджет в БД (или обновляет его частоту). Вызывается при старте процесса и координатором запуска."""
+        async with self.session_factory() as session:
+            await SdRateBudgetRepository(session).configure(self.name, self.rate, self.rate, time.time())
+            await session.commit()
+
+    async def acquire(self, priority: bool = False):
+        """
+        Берет токен бюджета. Если БД недоступна, запрос выпускается без бюджета и следующие
+        SD_RATE_BUDGET_RETRY секунд бюджет не запрашивается: частоту держит локальный лимитер.
+        """
+        async with self._lock:
+            if self._tokens < 1 and time.monotonic() < self._unavailable_until:
+                return
+            while self._tokens < 1:
+                # Приоритетный запрос берет один токен: резерв не должен оседать в одном процессе
+                wanted = 1 - self._tokens if priority else self.lease - self._tokens
+                try:
+                    async with self.session_factory() as session:
+                        granted = await SdRateBudgetRepository(session).take(
+                            self.name, wanted, time.time(), reserve=0.0 if priority else self.reserve)
+                        await session.commit()
+                except Exception as e:
+                    # Ошибки подключения asyncpg (OSError, TimeoutError) и commit не перехватываются репозиторием
+                    logger.error(f"Ошибка обращения к бюджету запросов {self.name}: {e}")
+                    granted = None
+                if granted is None:
+                    # Бюджета в БД нет или БД недоступна: не останавливаем синхронизацию,
+                    # локальный лимитер все равно держит частоту процесса
+                    self._unavailable_until = time.monotonic() + SD_RATE_BUDGET_RETRY
+                    logger.warning(f"Бюджет запросов {self.name} недоступен, запросы выпускаются без него "
+                                   f"{SD_RATE_BUDGET_RETRY:.0f}с.")
+                    return
+                self._tokens += granted
+                if self._tokens < 1:
+                    await asyncio.sleep((1 - self._tokens) / self.rate)
+            self._tokens -= 1
+
+
+async def attach_rate_budget(limiter, session_factory: async_sessionmaker) -> DbRateBudget:
+    """Подключает общий бюджет запросов к лимитеру процесса (services.limiter). Вызывается при старте процесса."""
+    budget = DbRateBudget(session_factory)
+    await budget.configure()
+    limiter.external_budget = budget
+    logger.info(f"Лимитер запросов к SD подключен к общему бюджету {budget.name}: {budget.rate} запросов в секунду на все процессы.")
+    return budget
+
+
+class PartitionHeartbeat:
+    """Обновляет heartbeat_at части, пока воркер ее обрабатывает: async with PartitionHeartbeat(...)."""
+
+    def __init__(self, session_factory: async_sessionmaker, partition_id: int, worker_id: str):
+        self.session_factory = session_factory
+        self.partition_id = partition_id
+        self.worker_id = worker_id
+        self._task: Optional[asyncio.Task] = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(SYNC_PARTITION_HEARTBEAT)
+            try:
+                async with self.session_factory() as session:
+                    alive = await SyncPartitionRepository(session).heartbeat(self.partition_id, self.worker_id)
+                    await session.commit()
+                if not alive:
+                    logger.warning(f"Часть синхронизации {self.partition_id} больше не принадлежит воркеру {self.worker_id}.")
+            except Exception as e:
+                logger.error(f"Ошибка при обновлении heartbeat части синхронизации {self.partition_id}: {e}", exc_info=True)
+
+    async def __aenter__(self):
+        self._task = asyncio.create_task(self._run())
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self._task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await self._task
+        return None
+
+
+async def claim_partition(session_factory: async_sessionmaker, run_id: int, worker_id: str):
+    """Возвращает брошенные части запуска в очередь и забирает следующую. (id, partition, partitions) или None."""
+    async with session_factory() as session:
+        repo = SyncPartitionRepository(session)
+        await repo.requeue_stale(run_id, datetime.timedelta(seconds=SYNC_PARTITION_STALE_AFTER), SYNC_PARTITION_MAX_ATTEMPTS)
+        partition = await repo.claim_next(run_id, worker_id)
+        await session.commit()
+        return (partition.id, partition.partition, partition.partitions) if partition else None
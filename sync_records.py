@@ -0,0 +1,80 @@
+import datetime
+import logging
+import sys
+from typing import Dict, Iterable, List, Optional
+
+from data_validator import parse_sd_datetime
+
+logger = logging.getLogger("ServiceDeskLogger")
+
+# Компактное представление списков SD на время синхронизации.
+# Элемент списка из SD - словарь с вложенным словарем владельца/родителя, строкой даты
+# и лишними атрибутами (DeviceName, title). Для сравнения с БД нужны только UUID, дата
+# изменения и UUID компании, поэтому сразу после получения списка элементы заменяются
+# на ListRecord со __slots__, даты хранятся целыми секундами от эпохи, а UUID интернируются:
+# UUID владельца повторяется у всего оборудования компании, а UUID сущности
+# совпадает с ключом словаря дат из БД.
+
+EPOCH = datetime.datetime(1970, 1, 1)
+_SECOND = datetime.timedelta(seconds=1)
+
+# Атрибут SD со ссылкой на компанию: родитель у компании, владелец у оборудования
+REFERENCE_ATTRS = {
+    'ou$company': 'parent',
+    'objectBase$Server': 'owner',
+    'objectBase$Workstation': 'owner',
+    'objectBase$FR': 'owner',
+}
+
+
+def to_epoch(value: Optional[datetime.datetime]) -> Optional[int]:
+    """Дата без часового пояса (как в SD и в БД) -> целые секунды от эпохи."""
+    if value is None:
+        return None
+    return (value - EPOCH) // _SECOND
+
+
+def from_epoch(value: int) -> datetime.datetime:
+    return EPOCH + datetime.timedelta(seconds=value)
+
+
+class ListRecord:
+    """Элемент списка SD: UUID, дата изменения (секунды от эпохи) и UUID родителя/владельца."""
+    __slots__ = ('uuid', 'modified', 'ref_uuid')
+
+    def __init__(self, uuid: str, modified: int, ref_uuid: Optional[str] = None):
+        self.uuid = uuid
+        self.modified = modified
+        self.ref_uuid = ref_uuid
+
+    def __repr__(self) -> str:
+        return f"ListRecord({self.uuid!r}, {from_epoch(self.modified)}, ref={self.ref_uuid!r})"
+
+
+def compact_list(meta_class: str, sd_list: Iterable[Dict]) -> List[ListRecord]:
+    """
+    Преобразует список из SD в ListRecord. Элементы без UUID, без даты изменения
+    или с неверной датой пропускаются с сообщением в лог: обработать их все равно нельзя.
+    """
+    ref_attr = REFERENCE_ATTRS[meta_class]
+    records = []
+    for item in sd_list:
+        if not isinstance(item, dict):
+            continue
+        uuid = item.get('UUID')
+        modified_text = item.get('lastModifiedDate')
+        if not uuid:
+            logger.warning(f"Сущность {meta_class} в списке из SD без UUID. Пропускаем.")
+            continue
+        if not modified_text:
+            logger.warning(f"Сущность {meta_class} {uuid} не имеет lastModifiedDate в списке из SD. Пропускаем обновление.")
+            continue
+        try:
+            modified = to_epoch(parse_sd_datetime(modified_text))
+        except ValueError:
+            logger.error(f"Неверный формат lastModifiedDate для {meta_class} {uuid}: '{modified_text}'. Пропускаем.")
+            continue
+        ref = item.get(ref_attr)
+        ref_uuid = ref.get('UUID') if isinstance(ref, dict) else None
+        records.append(ListRecord(sys.intern(uuid), modified, sys.intern(ref_uuid) if ref_uuid else None))
+    return records
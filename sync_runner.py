@@ -1,9 +1,25 @@
+import argparse
 import asyncio
+import contextlib
 import logging
 import datetime
+import os
+import signal
+import socket
+import subprocess
 import sys
-from models import AsyncSessionLocal, Base, engine, check_db_connection
-from services import ServiceDeskService
+from sqlalchemy.exc import SQLAlchemyError
+from models import AsyncSessionLocal, engine, check_db_connection, SYNC_JOB_SERVICEDESK, SYNC_JOB_FTP
+from migrations import run_migrations
+from repositories import SyncJobRepository
+from metrics import start_metrics_server
+import profiling
+from services import ServiceDeskService, ENTITY_MODELS, limiter
+from sync_offload import shutdown_process_pool
+from sync_target import SyncTarget, parse_since, read_uuids_file
+import sync_events
+import sync_partitions
+import sd_archive
 from dotenv import load_dotenv
 
 from log import setup_logger
@@ -12,40 +28,89 @@ from log import setup_logger
 load_dotenv()
 
 # Настройка логгирования должна быть вызвана первой
-# Уровень INFO будет выводиться в консоль, DEBUG+ в файл
-setup_logger(console_logging=True)
+# Уровни файла и консоли задаются LOG_LEVEL, LOG_LEVELS и CONSOLE_LOG_LEVEL (см. log.py)
+setup_logger(console_logging=True, log_name="sync_runner")
 
 # Получаем логгер после настройки
 logger = logging.getLogger("SyncRunner")
 
-# Асинхронная функция для создания таблиц БД, если они не существуют
+# Настройки режима воркера (--serve)
+# Как часто проверять очередь заданий, если она пуста (сек)
+SYNC_WORKER_POLL_INTERVAL = float(os.getenv("SYNC_WORKER_POLL_INTERVAL", "5"))
+# Как часто выполняемое задание обновляет heartbeat_at (сек)
+SYNC_JOB_HEARTBEAT_INTERVAL = float(os.getenv("SYNC_JOB_HEARTBEAT_INTERVAL", "30"))
+# Через сколько секунд без heartbeat задание считается брошенным и возвращается в очередь
+SYNC_JOB_STALE_AFTER = float(os.getenv("SYNC_JOB_STALE_AFTER", "300"))
+# Сколько раз брошенное задание возвращается в очередь, прежде чем будет помечено ошибкой
+SYNC_JOB_MAX_ATTEMPTS = int(os.getenv("SYNC_JOB_MAX_ATTEMPTS", "3"))
+# Порт, на котором воркер отдает метрики Prometheus (0 - не отдавать)
+SYNC_WORKER_METRICS_PORT = int(os.getenv("SYNC_WORKER_METRICS_PORT", "0"))
+# Между сколькими процессами делится оборудование в задании синхронизации (как --workers)
+SYNC_WORKERS = int(os.getenv("SYNC_WORKERS", "1"))
+
+# Тип задания -> метод ServiceDeskService, принимающий фабрику сессий
+JOB_HANDLERS = {
+    SYNC_JOB_SERVICEDESK: 'sync_all_data',
+    SYNC_JOB_FTP: 'sync_ftp_data',
+}
+
+# Асинхронная функция для создания и обновления схемы БД
 async def init_db():
-    """Проверяет наличие таблиц в БД и создает их, если необходимо."""
-    logger.info("Проверка и создание таблиц БД начаты.")
+    """Применяет миграции схемы БД (см. migrations.py): таблицы, новые колонки, индексы."""
+    logger.info("Применение миграций схемы БД начато.")
     try:
-        async with engine.begin() as conn:
-            # run_sync позволяет выполнять синхронные операции с асинхронным движком
-            # Это безопасно для DDL операций (CREATE TABLE)
-            await conn.run_sync(Base.metadata.create_all)
-        logger.info("Проверка и создание таблиц БД завершены.")
+        await run_migrations(engine)
+        logger.info("Применение миграций схемы БД завершено.")
     except Exception as e:
         logger.error(f"Ошибка при проверке/создании таблиц БД: {e}", exc_info=True)
         # Генерируем исключение, чтобы вызывающий код мог его обработать (например, sys.exit)
         raise
 
+def spawn_partition_workers(count: int, run_id: int) -> list:
+    """Запускает count процессов sync_runner.py --join run_id на этом хосте."""
+    command = [sys.executable, os.path.abspath(__file__), '--join', str(run_id)]
+    processes = [subprocess.Popen(command) for _ in range(count)]
+    logger.info(f"Запущено {count} воркеров для запуска синхронизации {run_id}: pid {[process.pid for process in processes]}.")
+    return processes
+
+
+async def stop_partition_workers(processes: list, timeout: float = 30.0):
+    """Ждет завершения воркеров (части уже обработаны), зависшие останавливает."""
+    for process in processes:
+        try:
+            await asyncio.to_thread(process.wait, timeout)
+        except subprocess.TimeoutExpired:
+            logger.warning(f"Воркер {process.pid} не завершился за {timeout}с, останавливаем.")
+            process.terminate()
+            await asyncio.to_thread(process.wait)
+
+
 # Асинхронная функция для запуска полной синхронизации
-async def run_sync():
-    """Запуск полной инкрементальной синхронизации данных из ServiceDesk."""
+async def run_sync(full: bool = False, workers: int = 1, target: SyncTarget = None):
+    """
+    Запуск полной инкрементальной синхронизации данных из ServiceDesk.
+    full=True - пересинхронизация массовой загрузкой через COPY (для пустой БД или перестроения).
+    workers > 1 - оборудование делится на части, кроме этого процесса запускается workers - 1
+    воркеров (sync_runner.py --join). С других хостов к запуску можно присоединиться через --join.
+    target - выборочная синхронизация (--meta-class, --company, --since, --uuids).
+    """
+    worker_processes = []
     try:
         # Создаем экземпляр ServiceDeskService без аргументов
         service = ServiceDeskService()
+        if workers > 1:
+            service.on_partitions = lambda run_id: worker_processes.extend(spawn_partition_workers(workers - 1, run_id))
 
         # Начало синхронизации
         start_time = datetime.datetime.now()
-        logger.info("Начало полной синхронизации данных.")
+        if target is not None:
+            logger.info(f"Начало выборочной синхронизации данных: {target.describe()}.")
+        else:
+            logger.info(f"Начало полной синхронизации данных{' (массовая загрузка)' if full else ''}"
+                        f"{f', воркеров {workers}' if workers > 1 else ''}.")
 
         # Запуск синхронизации через сервис. Передаем фабрику сессий.
-        await service.sync_all_data(AsyncSessionLocal)
+        await service.sync_all_data(AsyncSessionLocal, full=full, workers=workers, target=target)
 
         # Завершение синхронизации.
         end_time = datetime.datetime.now()
@@ -56,13 +121,24 @@ async def run_sync():
         # Логгируем ошибку и генерируем исключение для main
         logger.error(f"Ошибка при выполнении полной синхронизации: {e}", exc_info=True)
         raise # Пробрасываем исключение
+    finally:
+        if worker_processes:
+            await stop_partition_workers(worker_processes)
+
+
+async def join_sync(run_id: int = 0):
+    """Воркер части запуска синхронизации: sync_runner.py --join [RUN_ID] (0 - последний идущий запуск)."""
+    service = ServiceDeskService()
+    joined = await service.join_partitioned_run(AsyncSessionLocal, run_id or None)
+    if joined is not None:
+        logger.info(f"Воркер завершил части запуска синхронизации {joined}.")
 
 # Асинхронная функция для запуска тестовой синхронизации
-async def test_sync():
+async def test_sync(target: SyncTarget = None):
     """
     Запуск тестовой синхронизации.
     В текущей инкрементальной логике, тестовая синхронизация
-    запускает полный проход.
+    запускает полный проход (или выборочный, если задана цель).
     """
     logger.info("Запуск тестовой синхронизации (полный инкрементальный проход).")
 
@@ -79,7 +155,7 @@ async def test_sync():
 
     try:
         # Тестовый запуск просто вызывает полную синхронизацию
-        await run_sync()
+        await run_sync(target=target)
     finally:
         # Возвращаем уровень логгирования, если меняли
         if 'original_level' in locals() and service_logger.level != original_level:
@@ -89,8 +165,214 @@ async def test_sync():
     logger.info("Тестовая синхронизация завершена.")
 
 
+async def revalidate():
+    """Повторная очистка архива ответов SD правилами data_validator, без запросов к SD (sd_archive)."""
+    start_time = datetime.datetime.now()
+    logger.info("Начало повторной очистки данных из архива ответов SD.")
+    stats = await sd_archive.revalidate(AsyncSessionLocal)
+    changed = sum(counter['changed'] for counter in stats.values())
+    archived = sum(counter['archived'] for counter in stats.values())
+    logger.info(f"Повторная очистка завершена: переписано {changed} из {archived} сущностей архива. "
+                f"Длительность: {datetime.datetime.now() - start_time}")
+
+
+async def job_heartbeat(job_id: int, worker_id: str):
+    """Периодически обновляет heartbeat_at задания, пока оно выполняется."""
+    while True:
+        await asyncio.sleep(SYNC_JOB_HEARTBEAT_INTERVAL)
+        try:
+            async with AsyncSessionLocal() as session:
+                alive = await SyncJobRepository(session).heartbeat(job_id, worker_id)
+                await session.commit()
+            if not alive:
+                logger.warning(f"Задание синхронизации {job_id} больше не принадлежит воркеру {worker_id}.")
+        except SQLAlchemyError as e:
+            logger.error(f"Ошибка БД при обновлении heartbeat задания {job_id}: {e}", exc_info=True)
+
+
+async def run_job(job_id: int, job_type: str, worker_id: str, workers: int = 1):
+    """
+    Выполняет задание синхронизации и записывает результат в sync_jobs.
+    workers > 1 - оборудование синхронизации SD делится с workers - 1 процессами sync_runner.py --join.
+    """
+    handler_name = JOB_HANDLERS.get(job_type)
+    error = None
+    worker_processes = []
+    heartbeat_task = asyncio.create_task(job_heartbeat(job_id, worker_id))
+    start_time = datetime.datetime.now()
+    logger.info(f"Воркер {worker_id} начал задание синхронизации {job_id} ({job_type}).")
+    try:
+        if handler_name is None:
+            error = f"Неизвестный тип задания: {job_type}"
+            logger.error(error)
+        elif handler_name == 'sync_all_data' and workers > 1:
+            service = ServiceDeskService()
+            service.on_partitions = lambda run_id: worker_processes.extend(spawn_partition_workers(workers - 1, run_id))
+            await service.sync_all_data(AsyncSessionLocal, workers=workers)
+        else:
+            service = ServiceDeskService()
+            await getattr(service, handler_name)(AsyncSessionLocal)
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+        logger.error(f"Ошибка при выполнении задания синхронизации {job_id}: {e}", exc_info=True)
+    finally:
+        heartbeat_task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await heartbeat_task
+        if worker_processes:
+            await stop_partition_workers(worker_processes)
+
+    async with AsyncSessionLocal() as session:
+        await SyncJobRepository(session).finish(job_id, error)
+        await session.commit()
+    logger.info(f"Задание синхронизации {job_id} завершено {'с ошибкой' if error else 'успешно'}. Длительность: {datetime.datetime.now() - start_time}")
+
+
+async def claim_job(worker_id: str):
+    """Возвращает зависшие задания в очередь и забирает следующее. Возвращает (id, тип) или None."""
+    try:
+        async with AsyncSessionLocal() as session:
+            repo = SyncJobRepository(session)
+            await repo.requeue_stale(datetime.timedelta(seconds=SYNC_JOB_STALE_AFTER), SYNC_JOB_MAX_ATTEMPTS)
+            job = await repo.claim_next(worker_id)
+            await session.commit()
+            return (job.id, job.job_type) if job else None
+    except SQLAlchemyError as e:
+        logger.error(f"Ошибка БД при получении задания синхронизации: {e}", exc_info=True)
+        return None
+
+
+async def serve(workers: int = 1):
+    """
+    Режим воркера: забирает задания из sync_jobs и выполняет их по одному.
+    workers > 1 - синхронизация SD делится между этим и workers - 1 запущенными на время задания процессами.
+    По SIGTERM/SIGINT прерывает текущее задание и возвращает его в очередь.
+    """
+    worker_id = f"{socket.gethostname()}:{os.getpid()}"
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        with contextlib.suppress(NotImplementedError):
+            loop.add_signal_handler(sig, stop_event.set)
+
+    metrics_server = await start_metrics_server(SYNC_WORKER_METRICS_PORT) if SYNC_WORKER_METRICS_PORT else None
+
+    logger.info(f"Воркер синхронизации {worker_id} запущен. Интервал опроса очереди: {SYNC_WORKER_POLL_INTERVAL}с"
+                f"{f', процессов на задание: {workers}' if workers > 1 else ''}.")
+    while not stop_event.is_set():
+        claimed = await claim_job(worker_id)
+        if claimed is None:
+            with contextlib.suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(stop_event.wait(), timeout=SYNC_WORKER_POLL_INTERVAL)
+            continue
+
+        job_id, job_type = claimed
+        job_task = asyncio.create_task(run_job(job_id, job_type, worker_id, workers))
+        stop_task = asyncio.create_task(stop_event.wait())
+        await asyncio.wait({job_task, stop_task}, return_when=asyncio.FIRST_COMPLETED)
+        stop_task.cancel()
+        if not job_task.done():
+            logger.warning(f"Воркер {worker_id} останавливается, задание {job_id} прервано и возвращено в очередь.")
+            job_task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await job_task
+            async with AsyncSessionLocal() as session:
+                await SyncJobRepository(session).release(job_id, worker_id)
+                await session.commit()
+        elif job_task.exception():
+            logger.error(f"Ошибка воркера при обработке задания {job_id}: {job_task.exception()}")
+
+    if metrics_server:
+        metrics_server.close()
+        await metrics_server.wait_closed()
+    logger.info(f"Воркер синхронизации {worker_id} остановлен.")
+
+
+async def serve_events():
+    """
+    Режим воркера уведомлений SD: забирает сущности из sync_events пачками и синхронизирует их.
+    По SIGTERM/SIGINT дожидается текущей пачки: она небольшая, а прерванная вернулась бы в очередь
+    только через SYNC_EVENTS_CLAIM_STALE.
+    """
+    worker_id = f"{socket.gethostname()}:{os.getpid()}"
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        with contextlib.suppress(NotImplementedError):
+            loop.add_signal_handler(sig, stop_event.set)
+
+    metrics_server = await start_metrics_server(SYNC_WORKER_METRICS_PORT) if SYNC_WORKER_METRICS_PORT else None
+
+    service = ServiceDeskService()
+    logger.info(f"Воркер уведомлений SD {worker_id} запущен. Окно схлопывания: {sync_events.SYNC_EVENTS_COALESCE}с, "
+                f"пачка до {sync_events.SYNC_EVENTS_BATCH} сущностей.")
+    while not stop_event.is_set():
+        try:
+            processed = await sync_events.process_events(service, AsyncSessionLocal, worker_id)
+        except SQLAlchemyError as e:
+            logger.error(f"Ошибка БД воркера уведомлений SD: {e}", exc_info=True)
+            processed = 0
+        if not processed:
+            with contextlib.suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(stop_event.wait(), timeout=sync_events.SYNC_EVENTS_POLL_INTERVAL)
+
+    if metrics_server:
+        metrics_server.close()
+        await metrics_server.wait_closed()
+    logger.info(f"Воркер уведомлений SD {worker_id} остановлен.")
+
+
 if __name__ == "__main__":
     # Основной блок выполнения скрипта
+    parser = argparse.ArgumentParser(description="Синхронизация данных из ServiceDesk")
+    parser.add_argument("--test", action="store_true", help="Тестовая синхронизация с DEBUG-логами ServiceDeskLogger")
+    parser.add_argument("--serve", action="store_true", help="Режим воркера: выполнять задания из очереди sync_jobs")
+    parser.add_argument("--events", action="store_true", help="Режим воркера: синхронизировать сущности по уведомлениям SD (sync_events)")
+    parser.add_argument("--profile", action="store_true", help="Профилировать синхронизацию, профили сохраняются в PROFILE_DIR")
+    parser.add_argument("--full", action="store_true", help="Полная пересинхронизация массовой загрузкой (COPY) вместо инкрементальной")
+    parser.add_argument("--revalidate", action="store_true",
+                        help="Заново очистить оборудование из архива ответов SD (после исправления data_validator), без запросов к SD")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Число процессов, между которыми делится оборудование (вместе с этим); для --serve по умолчанию SYNC_WORKERS")
+    parser.add_argument("--join", type=int, nargs="?", const=0, default=None, metavar="RUN_ID",
+                        help="Обработать части идущего запуска RUN_ID (без значения - последнего) и завершиться")
+    parser.add_argument("--meta-class", action="append", choices=list(ENTITY_MODELS), dest="meta_classes",
+                        help="Выборочно: только этот метакласс (можно указать несколько раз)")
+    parser.add_argument("--company", metavar="UUID", help="Выборочно: компания, ее дочерние компании и их оборудование")
+    parser.add_argument("--since", metavar="DATE", help="Выборочно: сущности, измененные в SD не раньше DATE (YYYY-MM-DD[ HH:MM[:SS]])")
+    parser.add_argument("--uuids", metavar="FILE", help="Выборочно: сущности из файла, по одному UUID в строке")
+    args = parser.parse_args()
+    if args.workers is None:
+        args.workers = SYNC_WORKERS if args.serve else 1
+    if args.full and args.serve:
+        parser.error("--full выполняет одну синхронизацию и несовместим с --serve")
+    if args.events and (args.serve or args.full or args.workers > 1 or args.join is not None or args.test):
+        parser.error("--events несовместим с --serve, --full, --workers, --join и --test")
+    if args.revalidate and (args.serve or args.events or args.full or args.workers > 1 or args.join is not None or args.test):
+        parser.error("--revalidate несовместим с --serve, --events, --full, --workers, --join и --test")
+    if args.workers > 1 and args.full:
+        parser.error("--workers делит инкрементальную синхронизацию и несовместим с --full")
+    if args.join is not None and (args.full or args.serve or args.workers > 1):
+        parser.error("--join несовместим с --full, --serve и --workers")
+    target = None
+    if args.meta_classes or args.company or args.since or args.uuids:
+        if args.full or args.serve or args.events or args.revalidate or args.workers > 1 or args.join is not None:
+            parser.error("--meta-class, --company, --since и --uuids несовместимы с --full, --serve, --events, --revalidate, --workers и --join")
+        try:
+            target = SyncTarget(
+                meta_classes=args.meta_classes,
+                company_uuid=args.company,
+                since=parse_since(args.since) if args.since else None,
+                uuids=read_uuids_file(args.uuids) if args.uuids else None,
+            )
+        except (ValueError, OSError) as e:
+            parser.error(str(e))
+        if target.uuids is not None and not target.uuids:
+            parser.error(f"В файле {args.uuids} нет UUID")
+    if args.profile:
+        profiling.PROFILE_SYNC = True
 
     async def main():
         # Шаг 1: Проверяем подключение к БД с повторными попытками
@@ -113,15 +395,35 @@ if __name__ == "__main__":
             logger.critical(f"Критическая ошибка при инициализации или создании таблиц БД: {e}", exc_info=True)
             sys.exit(1) # Завершаем скрипт с кодом ошибки
 
-        # Шаг 3: Запускаем синхронизацию (полную или тестовую)
+        # Все процессы, обращающиеся к SD, делят общий бюджет запросов (sync_partitions)
+        if not args.revalidate:
+            try:
+                await sync_partitions.attach_rate_budget(limiter, AsyncSessionLocal)
+            except Exception as e:
+                logger.error(f"Не удалось подключить общий бюджет запросов к SD, действует только лимит процесса: {e}", exc_info=True)
+
+        # Шаг 3: Запускаем синхронизацию (полную, тестовую или воркер очереди)
         try:
-            if len(sys.argv) > 1 and sys.argv[1] == "--test":
-                await test_sync()
+            if args.serve:
+                await serve(args.workers)
+            elif args.events:
+                await serve_events()
+            elif args.revalidate:
+                await revalidate()
+            elif args.join is not None:
+                await join_sync(args.join)
+            elif args.test:
+                await test_sync(target)
             else:
-                await run_sync()
+                await run_sync(full=args.full, workers=args.workers, target=target)
         except Exception as e:
              logger.critical(f"Критическая ошибка при выполнении синхронизации: {e}", exc_info=True)
              sys.exit(1) # Завершаем скрипт с кодом ошибки
+        finally:
+            # Останавливаем пул процессов валидации, если он запускался
+            shutdown_process_pool()
+            # Закрываем соединения пула: с aiosqlite их потоки не дают процессу завершиться
+            await engine.dispose()
 
         logger.info("Выполнение скрипта завершено успешно.")
         sys.exit(0) # Завершаем скрипт с кодом успеха
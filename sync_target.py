@@ -0,0 +1,116 @@
+import datetime
+import logging
+from typing import Dict, Iterable, List, Optional, Set
+
+from sync_records import ListRecord, to_epoch
+
+logger = logging.getLogger("ServiceDeskLogger")
+
+# Выборочная синхронизация (sync_runner.py --meta-class/--company/--since/--uuids,
+# а также пачки уведомлений SD об изменениях, см. sync_events).
+# Проходит тот же конвейер, что и полная инкрементальная синхронизация, но списки
+# запрашиваются у SD только для цели: для --company - список компаний (он нужен, чтобы
+# найти дочерние) и оборудование с фильтром по владельцу, для --uuids - find с фильтром
+# по UUID. Фильтра по дате изменения у find нет, поэтому --since отбирает сущности
+# из полученных списков. Детали, как обычно, запрашиваются только для новых и измененных.
+# Выборочный запуск не пишет контрольную точку: продолжать его полным запуском нельзя.
+
+COMPANY_META_CLASS = 'ou$company'
+
+
+def uuid_prefix(value: str) -> str:
+    """Префикс UUID SD ('ou$123' -> 'ou'), он же первая часть имени метакласса ('ou$company')."""
+    return value.split('$', 1)[0]
+
+
+def parse_since(value: str) -> datetime.datetime:
+    """
+    Дата для --since: ISO-формат ('2025-03-01', '2025-03-01 12:30') или формат SD ('2025.03.01 12:30:00').
+    Часовой пояс тот же, что у дат SD и БД (без пояса).
+    """
+    text = value.strip()
+    try:
+        return datetime.datetime.fromisoformat(text.replace('.', '-', 2) if text[4:5] == '.' else text)
+    except ValueError:
+        raise ValueError(f"Неверный формат даты: '{value}'. Ожидается YYYY-MM-DD[ HH:MM[:SS]].")
+
+
+def read_uuids_file(path: str) -> List[str]:
+    """UUID из файла: по одному в строке, пустые строки и строки с # пропускаются, дубли убираются."""
+    uuids = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            uuid = line.split('#', 1)[0].strip()
+            if uuid and '$' in uuid:
+                uuids.append(uuid)
+            elif uuid:
+                logger.warning(f"Строка '{uuid}' в файле {path} не похожа на UUID SD. Пропускаем.")
+    return list(dict.fromkeys(uuids))
+
+
+def company_subtree(companies: Iterable[ListRecord], root_uuid: str) -> Set[str]:
+    """UUID компании root_uuid и всех ее дочерних (на любой глубине) по списку компаний SD."""
+    children: Dict[str, List[str]] = {}
+    for record in companies:
+        if record.ref_uuid:
+            children.setdefault(record.ref_uuid, []).append(record.uuid)
+    subtree, stack = set(), [root_uuid]
+    while stack:
+        uuid = stack.pop()
+        if uuid in subtree:
+            continue # Защита от циклов в данных SD
+        subtree.add(uuid)
+        stack.extend(children.get(uuid, ()))
+    return subtree
+
+
+class SyncTarget:
+    """Цель выборочной синхронизации. Незаданные ограничения не сужают выборку."""
+
+    def __init__(self, meta_classes: Optional[Iterable[str]] = None, company_uuid: Optional[str] = None,
+                 since: Optional[datetime.datetime] = None, uuids: Optional[Iterable[str]] = None,
+                 entities: Optional[Dict[str, List[str]]] = None):
+        self.meta_classes = set(meta_classes) if meta_classes else None
+        self.company_uuid = company_uuid
+        self.since = since
+        self.uuids = list(uuids) if uuids is not None else None
+        # UUID с известным метаклассом ({meta_class: [uuid]}): запрашиваются только в своем метаклассе
+        self.entities = entities
+
+    @property
+    def by_uuid(self) -> bool:
+        """Цель задана списком UUID: списки запрашиваются с фильтром по UUID."""
+        return self.uuids is not None or self.entities is not None
+
+    def includes(self, meta_class: str) -> bool:
+        """Нужен ли список метакласса: задан в --meta-class и может содержать UUID из --uuids."""
+        if self.meta_classes is not None and meta_class not in self.meta_classes:
+            return False
+        return not self.by_uuid or bool(self.uuids_for(meta_class))
+
+    def uuids_for(self, meta_class: str) -> List[str]:
+        """UUID из --uuids, которые могут относиться к метаклассу (по префиксу UUID), или UUID метакласса из entities."""
+        if self.entities is not None:
+            return list(self.entities.get(meta_class, ()))
+        prefix = uuid_prefix(meta_class)
+        return [uuid for uuid in self.uuids or () if uuid_prefix(uuid) == prefix]
+
+    def filter_since(self, records: List[ListRecord]) -> List[ListRecord]:
+        if self.since is None:
+            return records
+        since = to_epoch(self.since)
+        return [record for record in records if record.modified >= since]
+
+    def describe(self) -> str:
+        parts = []
+        if self.meta_classes is not None:
+            parts.append(f"метаклассы {', '.join(sorted(self.meta_classes))}")
+        if self.company_uuid:
+            parts.append(f"компания {self.company_uuid} с дочерними")
+        if self.uuids is not None:
+            parts.append(f"{len(self.uuids)} UUID")
+        if self.entities is not None:
+            parts.append(f"{sum(len(uuids) for uuids in self.entities.values())} сущностей")
+        if self.since is not None:
+            parts.append(f"изменено с {self.since}")
+        return ', '.join(parts) or 'все сущности'
@@ -0,0 +1,12 @@
+import os
+import sys
+
+# Модули приложения лежат в корне репозитория и читают настройки при импорте,
+# поэтому путь и DATABASE_URL задаются до того, как тесты их импортируют
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# TEST_DATABASE_URL - PostgreSQL для тестов, которым нужна настоящая БД (миграции применяются,
+# данные тестов откатываются). Без него такие тесты пропускаются
+TEST_DATABASE_URL = os.getenv("TEST_DATABASE_URL")
+if TEST_DATABASE_URL:
+    os.environ["DATABASE_URL"] = TEST_DATABASE_URL
@@ -0,0 +1,76 @@
+"""
+Пакетные валидаторы clearify_*_batch дают те же записи, что clearify_*_data по одной,
+включая записи, которые clearify_*_data отвергает исключением (в пакете они пропускаются).
+"""
+import pytest
+
+from benchmarks.synthetic import generate_device_records
+from data_validator import (
+    BATCH_VALIDATORS, clearify_server_data, clearify_pos_data, clearify_fr_data, rows_from_columns
+)
+
+VALIDATORS = {
+    'objectBase$Server': clearify_server_data,
+    'objectBase$Workstation': clearify_pos_data,
+    'objectBase$FR': clearify_fr_data,
+}
+
+# Значения, которые не попадают в быстрые пути пакетной валидации
+ODD_VALUES = [
+    None, '', '   ', 'нет', 5, 12345678901, {'title': 'x'}, ['1'],
+    '123456789', ' 123 456 789 0 ', '123\t456\t789', 'id: 1234567890 пароль', '١٢٣٤٥٦٧٨٩',
+    '123-456-789', ' 123-456-789', '123-456-789\n', '１２３-456-789',
+    '192.168.0.1', '192.168.0.1:9080', '300.1.1.1', ' 10.0.0.1 ', 'http://10.0.0.1:81/x',
+    'rest-1.iiko.it', 'https://a.rest-1.syrve.online/x', 'srv.local:8080', 'адрес уточнить',
+    'https://pp.iiko.ru/cabinet?clientId=123', 'clientId=abc', 'a=1=22 ', 'без ссылки',
+    'MH_12345', ' MH_12345 ', 'MH_1234', 'MH_12345xyz', 'LM MH_54321 и MH_11111',
+    '2024.02.29 10:00:00', '2024.02.31 10:00:00', '2024-02-01 10:00:00', '2024.02.01 10:00:0１',
+    '2024.02.01 10:00:00\n2024.02.01 10:00:00',
+]
+TEXT_FIELDS = {
+    'objectBase$Server': ['UniqueID', 'Teamviewer', 'RDP', 'AnyDesk', 'IP', 'CabinetLink', 'litemanagerID', 'description', 'nameforclient'],
+    'objectBase$Workstation': ['Teamviewer', 'AnyDesk', 'litemanagerID', 'Commentariy'],
+    'objectBase$FR': ['KKTRegDate', 'FNExpireDate', 'ModelKKT', 'FFD'],
+}
+
+
+def expected_rows(meta_class, records):
+    rows = []
+    for record in records:
+        try:
+            rows.append(VALIDATORS[meta_class](record))
+        except (AttributeError, TypeError, ValueError):
+            continue
+    return rows
+
+
+def odd_records(meta_class):
+    records = generate_device_records(meta_class, len(ODD_VALUES), seed=7)
+    for i, record in enumerate(records):
+        for shift, field in enumerate(TEXT_FIELDS[meta_class]):
+            record[field] = ODD_VALUES[(i + shift) % len(ODD_VALUES)]
+    return records
+
+
+@pytest.mark.parametrize("meta_class", list(VALIDATORS))
+def test_batch_matches_per_record(meta_class):
+    records = generate_device_records(meta_class, 2000)
+    assert rows_from_columns(BATCH_VALIDATORS[meta_class](records)) == expected_rows(meta_class, records)
+
+
+@pytest.mark.parametrize("meta_class", list(VALIDATORS))
+def test_batch_matches_per_record_on_odd_values(meta_class):
+    records = odd_records(meta_class)
+    assert rows_from_columns(BATCH_VALIDATORS[meta_class](records)) == expected_rows(meta_class, records)
+
+
+@pytest.mark.parametrize("meta_class", list(VALIDATORS))
+def test_batch_skips_records_rejected_per_record(meta_class):
+    records = generate_device_records(meta_class, 50)
+    records[3]['lastModifiedDate'] = '2024.02.31 10:00:00'
+    records[10]['lastModifiedDate'] = 'вчера'
+    records[20]['owner'] = 'ou$1'
+    records[30]['lastModifiedDate'] = None
+    rows = rows_from_columns(BATCH_VALIDATORS[meta_class](records))
+    assert len(rows) == 47
+    assert rows == expected_rows(meta_class, records)
@@ -0,0 +1,140 @@
+"""
+Планы запросов API в PostgreSQL используют индексы ix_* из migrations.LOOKUP_INDEXES.
+
+Запросы не собираются заново, как в benchmarks/explain_indexes.py, а перехватываются
+у настоящих методов (поиск, get_company_details, get_by_owner_uuid, загрузка иерархии компаний)
+и разбираются EXPLAIN с теми же параметрами. В транзакции выключается enable_seqscan:
+на маленькой тестовой таблице планировщик честно выберет полный просмотр, а проверяется,
+что индекс применим к запросу. Тестовые строки откатываются вместе с транзакцией.
+
+Запуск: TEST_DATABASE_URL=postgresql+asyncpg://user@localhost/test python -m pytest tests
+"""
+import asyncio
+import os
+import re
+from typing import Dict, List, Tuple
+
+import pytest
+
+if not os.getenv("TEST_DATABASE_URL", "").startswith("postgresql"):
+    pytest.skip("TEST_DATABASE_URL с PostgreSQL не задан", allow_module_level=True)
+
+from sqlalchemy import event, text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from migrations import run_migrations
+from models import Company, FiscalRegister, Server, Workstation, engine
+from repositories import FiscalRegisterRepository
+from services import ServiceDeskService
+
+TOP = 'ou$explain-top'
+CHILD = 'ou$explain-child'
+
+# Индекс, которым выбираются строки таблицы по владельцу или родителю
+OWNER_INDEXES = {
+    'servers': 'ix_servers_owner_id',
+    'workstations': 'ix_workstations_owner_id',
+    'fiscal_registers': 'ix_fiscal_registers_owner_id',
+    'companies': 'ix_companies_parent_uuid',
+}
+
+
+def _rows() -> list:
+    rows = []
+    for company, parent in ((TOP, None), (CHILD, TOP)):
+        suffix = company.split('-')[-1]
+        rows += [
+            Company(uuid=company, title=f"explain {suffix}", parent_uuid=parent, active_contract=True),
+            Server(uuid=f"objectBase$explain-srv-{suffix}", device_name=f"explain {suffix}", owner_id=company),
+            Workstation(uuid=f"objectBase$explain-ws-{suffix}", device_name=f"explain {suffix}", owner_id=company),
+            FiscalRegister(uuid=f"objectBase$explain-fr-{suffix}", rn_kkt=f"explain {suffix}", owner_id=company),
+        ]
+    return rows
+
+
+async def _collect_plans() -> Dict[str, List[Tuple[str, str]]]:
+    """{вызов: [(SQL, план)]} для каждого запроса, выполненного методом."""
+    captured: List[Tuple[str, object]] = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith('SELECT'):
+            captured.append((statement, parameters))
+
+    service = ServiceDeskService()
+    calls = {
+        'get_by_owner_uuid': lambda session: FiscalRegisterRepository(session).get_by_owner_uuid(TOP),
+        'get_company_details': lambda session: service.get_company_details(TOP, session),
+        'get_top_level_companies': lambda session: service.get_top_level_companies(session),
+        'search_entities': lambda session: service.search_entities(session, 'explain', show_inactive=False),
+    }
+    plans = {}
+    try:
+        await run_migrations(engine)
+        async with engine.connect() as conn:
+            await conn.begin()
+            await conn.execute(text("SET LOCAL enable_seqscan = off"))
+            session = AsyncSession(bind=conn, expire_on_commit=False)
+            session.add_all(_rows())
+            await session.flush()
+            event.listen(engine.sync_engine, "before_cursor_execute", capture)
+            try:
+                for name, call in calls.items():
+                    captured.clear()
+                    session.expunge_all() # Иначе selectinload берет связи из identity map без запросов
+                    assert await call(session), f"{name} ничего не вернул"
+                    plans[name] = list(captured)
+            finally:
+                event.remove(engine.sync_engine, "before_cursor_execute", capture)
+            for name, statements in plans.items():
+                explained = []
+                for statement, parameters in statements:
+                    rows = (await conn.exec_driver_sql(f"EXPLAIN {statement}", parameters)).all()
+                    explained.append((statement, "\n".join(row[0] for row in rows)))
+                plans[name] = explained
+            await conn.rollback()
+    finally:
+        await engine.dispose()
+    return plans
+
+
+@pytest.fixture(scope="module")
+def plans() -> Dict[str, List[Tuple[str, str]]]:
+    return asyncio.run(_collect_plans())
+
+
+def _table(statement: str) -> str:
+    return re.search(r'\bFROM (\w+)', statement).group(1)
+
+
+def _assert_owner_indexes(statements: List[Tuple[str, str]], skip_first: bool = False):
+    """Каждый запрос (кроме первого, если он выбирает саму компанию) использует индекс своей таблицы."""
+    assert statements
+    for statement, plan in statements[1 if skip_first else 0:]:
+        index = OWNER_INDEXES[_table(statement)]
+        assert index in plan, f"нет {index} в плане запроса\n{statement}\n{plan}"
+
+
+def test_get_by_owner_uuid(plans):
+    _assert_owner_indexes(plans['get_by_owner_uuid'])
+
+
+def test_get_company_details(plans):
+    statements = plans['get_company_details']
+    # Сама компания и ее дети, серверы, рабочие станции, ФР (selectinload)
+    assert len(statements) == 5
+    assert 'companies_pkey' in statements[0][1]
+    _assert_owner_indexes(statements, skip_first=True)
+
+
+def test_get_top_level_companies(plans):
+    statements = plans['get_top_level_companies']
+    # Верхний уровень и его оборудование (3), дети, внуки и оборудование детей (3)
+    assert len(statements) == 9
+    _assert_owner_indexes(statements)
+
+
+def test_search_joins(plans):
+    # Компании ищутся без JOIN; оборудование соединяется с владельцем по owner_id
+    statements = [(statement, plan) for statement, plan in plans['search_entities'] if _table(statement) != 'companies']
+    assert len(statements) == 3
+    _assert_owner_indexes(statements)
@@ -0,0 +1,314 @@
+import argparse
+import atexit
+import contextvars
+import functools
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+logger = logging.getLogger("ServiceDeskLogger")
+
+# Легкая трассировка горячих путей синхронизации.
+# API повторяет основу OpenTelemetry (get_tracer, start_as_current_span, start_span,
+# set_attribute, record_exception, get_current_span), поэтому при переходе на
+# opentelemetry-sdk вызовы в коде менять не нужно. Экспорт - в локальный файл JSONL
+# (одна строка на завершенный span, поля как у ConsoleSpanExporter), без коллектора.
+# Завершенные span'ы передаются через очередь фоновому потоку, event loop файл не пишет.
+#
+# Переменные окружения:
+# TRACING_ENABLED - "1" включить трассировку (по умолчанию выключена, вызовы ничего не стоят)
+# TRACE_FILE      - файл для span'ов (traces/spans.jsonl), дописывается
+#
+# Сводка по файлу: python tracing.py [--file traces/spans.jsonl] [--trace-id ID] [--entity UUID]
+TRACING_ENABLED = os.getenv("TRACING_ENABLED") == "1"
+TRACE_FILE = os.getenv("TRACE_FILE", os.path.join("traces", "spans.jsonl"))
+
+STATUS_UNSET = "UNSET"
+STATUS_OK = "OK"
+STATUS_ERROR = "ERROR"
+
+_current_span: contextvars.ContextVar[Optional["Span"]] = contextvars.ContextVar("current_span", default=None)
+
+
+class Span:
+    """Span с атрибутами и статусом. Завершается end() и передается экспортеру."""
+
+    def __init__(self, name: str, trace_id: int, parent_id: Optional[int], attributes: Optional[Dict[str, Any]], start_time: Optional[int]):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = random.getrandbits(64)
+        self.parent_id = parent_id
+        self.attributes: Dict[str, Any] = dict(attributes) if attributes else {}
+        self.start_time = start_time or time.time_ns()
+        self.end_time: Optional[int] = None
+        self.status = STATUS_UNSET
+        self.status_description: Optional[str] = None
+        self.events: List[Dict[str, Any]] = []
+
+    def is_recording(self) -> bool:
+        return self.end_time is None
+
+    def set_attribute(self, key: str, value: Any):
+        self.attributes[key] = value
+
+    def set_attributes(self, attributes: Dict[str, Any]):
+        self.attributes.update(attributes)
+
+    def set_status(self, status: str, description: Optional[str] = None):
+        self.status = status
+        self.status_description = description
+
+    def record_exception(self, exception: BaseException):
+        self.events.append({
+            'name': 'exception',
+            'timestamp': time.time_ns(),
+            'attributes': {'exception.type': type(exception).__name__, 'exception.message': str(exception)},
+        })
+
+    def end(self, end_time: Optional[int] = None):
+        if self.end_time is not None:
+            return
+        self.end_time = end_time or time.time_ns()
+        _exporter.submit(self)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'name': self.name,
+            'context': {'trace_id': f"0x{self.trace_id:032x}", 'span_id': f"0x{self.span_id:016x}"},
+            'parent_id': f"0x{self.parent_id:016x}" if self.parent_id else None,
+            'start_time': self.start_time,
+            'end_time': self.end_time,
+            'duration_ms': round((self.end_time - self.start_time) / 1e6, 3),
+            'status': {'status_code': self.status, 'description': self.status_description},
+            'attributes': self.attributes,
+            'events': self.events,
+        }
+
+
+class NonRecordingSpan:
+    """Span-заглушка при выключенной трассировке: все методы ничего не делают."""
+
+    def is_recording(self) -> bool:
+        return False
+
+    def set_attribute(self, key: str, value: Any):
+        pass
+
+    def set_attributes(self, attributes: Dict[str, Any]):
+        pass
+
+    def set_status(self, status: str, description: Optional[str] = None):
+        pass
+
+    def record_exception(self, exception: BaseException):
+        pass
+
+    def end(self, end_time: Optional[int] = None):
+        pass
+
+
+INVALID_SPAN = NonRecordingSpan()
+
+
+class JsonlFileExporter:
+    """Пишет завершенные span'ы в файл JSONL из фонового потока."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._queue: "queue.SimpleQueue[Optional[Span]]" = queue.SimpleQueue()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        # Файл не открылся: span'ы отбрасываются, а не копятся в очереди без потока-читателя
+        self._disabled = False
+
+    def submit(self, span: Span):
+        if self._thread is None:
+            self._start()
+        if self._disabled:
+            return
+        self._queue.put(span)
+
+    def _start(self):
+        with self._lock:
+            if self._thread is not None or self._disabled:
+                return
+            # Файл открывается здесь, а не в потоке: об ошибке нужно узнать до того, как span попадет в очередь
+            try:
+                directory = os.path.dirname(self.path)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                out = open(self.path, 'a', encoding='utf-8')
+            except OSError as e:
+                logger.error(f"Не удалось открыть файл трассировки {self.path}, span'ы не сохраняются: {e}")
+                self._disabled = True
+                return
+            self._thread = threading.Thread(target=self._run, args=(out,), name="SpanExporter", daemon=True)
+            self._thread.start()
+            atexit.register(self.shutdown)
+
+    def _run(self, out):
+        with out:
+            while True:
+                span = self._queue.get()
+                if span is None:
+                    break
+                out.write(json.dumps(span.to_dict(), ensure_ascii=False, default=str) + "\n")
+                # Сбрасываем на диск, когда очередь опустела, а не на каждой строке
+                if self._queue.empty():
+                    out.flush()
+
+    def shutdown(self):
+        """Дописывает оставшиеся span'ы и останавливает поток."""
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+
+_exporter = JsonlFileExporter(TRACE_FILE)
+
+
+class Tracer:
+    """Создает span'ы. Родитель берется из контекста (contextvars), поэтому наследуется задачами asyncio."""
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def start_span(self, name: str, attributes: Optional[Dict[str, Any]] = None, start_time: Optional[int] = None):
+        if not TRACING_ENABLED:
+            return INVALID_SPAN
+        parent = _current_span.get()
+        if parent is None:
+            return Span(name, random.getrandbits(128), None, attributes, start_time)
+        return Span(name, parent.trace_id, parent.span_id, attributes, start_time)
+
+    @contextmanager
+    def start_as_current_span(self, name: str, attributes: Optional[Dict[str, Any]] = None) -> Iterator[Any]:
+        if not TRACING_ENABLED:
+            yield INVALID_SPAN
+            return
+        span = self.start_span(name, attributes)
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.record_exception(e)
+            span.set_status(STATUS_ERROR, f"{type(e).__name__}: {e}")
+            raise
+        finally:
+            _current_span.reset(token)
+            span.end()
+
+
+def get_tracer(name: str) -> Tracer:
+    return Tracer(name)
+
+
+def get_current_span():
+    """Текущий span или заглушка, если трассировка выключена или span'а нет."""
+    return _current_span.get() or INVALID_SPAN
+
+
+def traced(name: Optional[str] = None, attributes: Optional[Callable[..., Dict[str, Any]]] = None):
+    """
+    Декоратор для корутин: выполняет вызов внутри span'а name (по умолчанию - qualname функции).
+    attributes получает те же аргументы, что и функция, и возвращает атрибуты span'а.
+    """
+    def decorator(func):
+        span_name = name or func.__qualname__
+        tracer = get_tracer(func.__module__)
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            if not TRACING_ENABLED:
+                return await func(*args, **kwargs)
+            with tracer.start_as_current_span(span_name, attributes(*args, **kwargs) if attributes else None):
+                return await func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+# --- Сводка по файлу трассировки ---
+
+def load_spans(path: str) -> List[Dict[str, Any]]:
+    spans = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                try:
+                    spans.append(json.loads(line))
+                except json.JSONDecodeError:
+                    continue # Строка, недописанная при аварийной остановке
+    return spans
+
+
+def summarize(spans: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Агрегирует длительности по имени span'а: количество, сумма, среднее, p95, максимум (мс)."""
+    durations = defaultdict(list)
+    for span in spans:
+        durations[span['name']].append(span['duration_ms'])
+    rows = []
+    for name, values in durations.items():
+        values.sort()
+        rows.append({
+            'name': name,
+            'count': len(values),
+            'total_ms': round(sum(values), 1),
+            'avg_ms': round(sum(values) / len(values), 2),
+            'p95_ms': values[min(len(values) - 1, int(len(values) * 0.95))],
+            'max_ms': values[-1],
+        })
+    rows.sort(key=lambda row: row['total_ms'], reverse=True)
+    return rows
+
+
+def entity_tree(spans: List[Dict[str, Any]], uuid: str) -> List[str]:
+    """Строки дерева span'ов обработки сущности uuid: от запроса деталей в SD до коммита."""
+    children = defaultdict(list)
+    for span in spans:
+        children[span['parent_id']].append(span)
+    roots = [span for span in spans if span['name'] == 'sync.entity' and span['attributes'].get('uuid') == uuid]
+    lines = []
+
+    def walk(span, depth):
+        attrs = ", ".join(f"{key}={value}" for key, value in span['attributes'].items())
+        status = f" [{span['status']['status_code']}]" if span['status']['status_code'] == STATUS_ERROR else ""
+        lines.append(f"{'  ' * depth}{span['name']} {span['duration_ms']:.1f} мс{status} ({attrs})")
+        for child in sorted(children[span['context']['span_id']], key=lambda s: s['start_time']):
+            walk(child, depth + 1)
+
+    for root in sorted(roots, key=lambda s: s['start_time']):
+        walk(root, 0)
+    return lines
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Сводка по файлу трассировки")
+    parser.add_argument("--file", default=TRACE_FILE, help="Файл span'ов JSONL")
+    parser.add_argument("--trace-id", help="Только один запуск (trace_id span'а sync.run); по умолчанию последний")
+    parser.add_argument("--entity", help="Показать дерево span'ов обработки сущности с этим UUID")
+    args = parser.parse_args()
+
+    all_spans = load_spans(args.file)
+    trace_id = args.trace_id
+    if trace_id is None:
+        runs = [span for span in all_spans if span['name'] == 'sync.run']
+        trace_id = max(runs, key=lambda s: s['start_time'])['context']['trace_id'] if runs else None
+    if trace_id:
+        all_spans = [span for span in all_spans if span['context']['trace_id'] == trace_id]
+        print(f"trace_id {trace_id}, span'ов: {len(all_spans)}")
+
+    if args.entity:
+        print("\n".join(entity_tree(all_spans, args.entity)) or f"Сущность {args.entity} не найдена")
+    else:
+        print(f"{'span':<40} {'кол-во':>8} {'сумма, мс':>12} {'сред., мс':>10} {'p95, мс':>10} {'макс., мс':>10}")
+        for row in summarize(all_spans):
+            print(f"{row['name']:<40} {row['count']:>8} {row['total_ms']:>12.1f} {row['avg_ms']:>10.2f} {row['p95_ms']:>10.1f} {row['max_ms']:>10.1f}")